@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Batch Persistence Benchmark for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Compares per-message persistence (one log_message call per message) with the
+batched WebhookHandler path (one log_messages call per POST) for WhatsApp
+deliveries carrying 1, 10 and 100 messages.
+
+Usage:
+    python benchmarks/bench_batch_persistence.py [--posts 50] [--sizes 1,10,100]
+"""
+
+import argparse
+import time
+
+from common import use_scratch_database
+
+use_scratch_database()
+
+from src.database import init_database  # noqa: E402
+from src.api.webhook_app import webhook_handler  # noqa: E402
+
+
+def build_payload(run: str, post: int, size: int) -> dict:
+    """Build a WhatsApp delivery with `size` messages spread over entries."""
+    messages = [
+        {
+            "from": f"+2547{(post * size + i) % 1000:08d}",
+            "id": f"wamid.{run}.{post}.{i}",
+            "timestamp": str(int(time.time())),
+            "type": "text",
+            "text": {"body": f"Benchmark message {i}"},
+        }
+        for i in range(size)
+    ]
+    # Meta coalesces entries under load; mimic that with ten messages per entry
+    entries = [
+        {"id": "bench", "changes": [{
+            "field": "messages",
+            "value": {
+                "messaging_product": "whatsapp",
+                "metadata": {"display_phone_number": "+1234567890", "phone_number_id": "987654321"},
+                "messages": messages[i:i + 10],
+            },
+        }]}
+        for i in range(0, size, 10)
+    ]
+    return {"object": "whatsapp_business_account", "entry": entries}
+
+
+def per_message(payload: dict) -> None:
+    """Persist each message with its own log_message call."""
+    for record in webhook_handler.extract_records(payload):
+        webhook_handler.message_service.log_message(**record.to_record())
+
+
+def per_batch(payload: dict) -> None:
+    """Persist the whole delivery with one log_messages call."""
+    webhook_handler.handle_payload(payload)
+
+
+def run(label: str, fn, size: int, posts: int) -> float:
+    payloads = [build_payload(f"{label}{size}", post, size) for post in range(posts)]
+    start = time.perf_counter()
+    for payload in payloads:
+        fn(payload)
+    elapsed = time.perf_counter() - start
+    return posts * size / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--posts", type=int, default=50, help="POSTs per scenario")
+    parser.add_argument("--sizes", default="1,10,100", help="messages per POST")
+    args = parser.parse_args()
+
+    init_database()
+    sizes = [int(s) for s in args.sizes.split(",")]
+
+    print(f"{'msgs/POST':>10} {'per-message msg/s':>18} {'per-batch msg/s':>16} {'speedup':>8}")
+    for size in sizes:
+        single = run("single", per_message, size, args.posts)
+        batched = run("batch", per_batch, size, args.posts)
+        print(f"{size:>10} {single:>18.0f} {batched:>16.0f} {batched / single:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
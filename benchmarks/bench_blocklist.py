@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Opt-Out Blocklist Benchmark for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Imports --numbers opt-outs into a scratch database, then reports how long a
+fresh process takes to load the Bloom filter and what a send-path check
+costs: the filter alone (numbers not opted out), a filter hit confirmed
+with one query, and the indexed query every send would otherwise make. Also
+times a campaign chunk checked with blocked_among() and compares the
+filter's memory with an exact in-memory set of the same numbers.
+
+Usage:
+    python benchmarks/bench_blocklist.py [--numbers 200000] [--chunk 1000]
+"""
+
+import argparse
+import sys
+import time
+
+from common import latency_summary, use_scratch_database
+
+use_scratch_database()
+
+
+def timed(fn, args_list):
+    latencies = []
+    for args in args_list:
+        started = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - started)
+    return latency_summary(latencies)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--numbers", type=int, default=200000)
+    parser.add_argument("--chunk", type=int, default=1000, help="campaign chunk size")
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    from src.database import OptOut, get_db_session, init_database
+    from src.services import Blocklist
+
+    init_database()
+    numbers = [f"+2547{i:08d}" for i in range(args.numbers)]
+    started = time.perf_counter()
+    report = Blocklist(min_capacity=1000, rebuild_interval=10 ** 9).add(numbers, source="import")
+    print(f"import   {report['added']} numbers in {time.perf_counter() - started:.2f}s")
+
+    blocklist = Blocklist(min_capacity=args.numbers)
+    started = time.perf_counter()
+    blocklist.refresh(force=True)
+    print(f"load     {time.perf_counter() - started:.2f}s  {blocklist.stats()['filter']}")
+
+    misses = [(f"+1555{i:07d}",) for i in range(args.lookups)]
+    hits = [(numbers[i * 97 % args.numbers],) for i in range(args.lookups)]
+
+    def query(recipient: str) -> bool:
+        with get_db_session() as session:
+            return session.query(OptOut.id).filter(
+                OptOut.platform == "WhatsApp", OptOut.recipient == recipient.lstrip("+")
+            ).first() is not None
+
+    for label, fn, cases in (("filter miss", blocklist.is_blocked, misses),
+                             ("filter hit+confirm", blocklist.is_blocked, hits),
+                             ("query per send", query, misses)):
+        r = timed(fn, cases)
+        print(f"{label:<19} p50 {r['p50_ms'] * 1000:8.1f} us  p99 {r['p99_ms'] * 1000:8.1f} us")
+
+    chunk = [number for (number,) in misses[:args.chunk - args.chunk // 100]] + numbers[:args.chunk // 100]
+    started = time.perf_counter()
+    blocked = blocklist.blocked_among(chunk)
+    print(f"campaign chunk of {len(chunk)}: {len(blocked)} opted out in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    exact = {number.lstrip("+") for number in numbers}
+    set_bytes = sys.getsizeof(exact) + sum(sys.getsizeof(key) for key in exact)
+    print(f"memory   filter {blocklist.stats()['filter']['bytes'] / 1e6:.2f} MB  "
+          f"vs exact set {set_bytes / 1e6:.1f} MB per process")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Campaign Benchmark for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Imports a synthetic recipient CSV (with duplicate and malformed rows) into a
+campaign, then sends the campaign through the Graph client to the local
+stand-in (benchmarks/graph_stub.py) at several fan-out concurrencies, and
+compares that with calling WhatsAppMessenger.send_template_message once per
+number in a loop. Reports import rate, sends per second and Meta-side 429s.
+
+Usage:
+    python benchmarks/bench_campaign.py [--recipients 2000] [--concurrency 1,8,32] [--latency 40] [--meta-rate 250]
+"""
+
+import argparse
+import io
+import os
+import random
+import time
+
+from common import use_scratch_database
+
+use_scratch_database()
+
+from graph_stub import GraphStub  # noqa: E402
+
+
+def recipient_csv(count: int, seed: int, offset: int) -> str:
+    """CSV with a header, ~5% repeated numbers and ~2% malformed ones."""
+    rng = random.Random(seed)
+    lines = ["name,phone"]
+    for i in range(count):
+        roll = rng.random()
+        if roll < 0.05 and i:
+            number = f"+2547{offset + rng.randrange(i):08d}"
+        elif roll < 0.07:
+            number = "07xx-not-a-number"
+        else:
+            number = f"+2547{offset + i:08d}"
+        lines.append(f"Customer {i},{number}")
+    return "\n".join(lines) + "\n"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--recipients", type=int, default=2000)
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--latency", type=float, default=40.0, help="stand-in latency per call, ms")
+    parser.add_argument("--meta-rate", type=int, default=250, help="stand-in limit, sends/second per number")
+    parser.add_argument("--rate", type=float, default=0.0, help="sender token bucket, sends/second (0: config)")
+    parser.add_argument("--loop", type=int, default=200, help="sends for the one-at-a-time baseline")
+    args = parser.parse_args()
+
+    with GraphStub(latency_ms=args.latency, rate_limit=args.meta_rate) as stub:
+        os.environ.update(GRAPH_BASE_URL=stub.url, WHATSAPP_PHONE_ID="123456", WHATSAPP_ACCESS_TOKEN="bench",
+                          GRAPH_BACKOFF_BASE="0.05", GRAPH_POOL_SIZE="64", LOG_LEVEL="ERROR")
+        if args.rate:
+            os.environ.update(SEND_WHATSAPP_RATE=str(args.rate), SEND_WHATSAPP_BURST=str(max(1.0, args.rate / 10)))
+        from src.database import init_database
+        from src.services import CampaignRunner, GraphOutboundSender, get_campaign_service, get_send_limiters
+        from src.services.campaign_service import iter_csv_numbers
+
+        init_database()
+        service = get_campaign_service()
+        print(f"recipients={args.recipients} latency={args.latency}ms meta-rate={args.meta_rate}/s "
+              f"bucket={get_send_limiters()['WhatsApp'].rate}/s")
+
+        from messaging import get_whatsapp_messenger
+        messenger = get_whatsapp_messenger()
+        throttled = stub.counts["throttled"]
+        start = time.perf_counter()
+        ok = sum(bool(messenger.send_template_message(f"2547{i:08d}", "promo_v1")["success"])
+                 for i in range(args.loop))
+        elapsed = time.perf_counter() - start
+        print(f"{'loop':<12} {'':>8} {args.loop / elapsed:>9.0f} sends/s  ok={ok}/{args.loop} "
+              f"429s={stub.counts['throttled'] - throttled}")
+
+        for n, concurrency in enumerate(int(c) for c in args.concurrency.split(",")):
+            campaign = service.create_campaign(f"bench {concurrency}", "BenchAgent", "promo_v1",
+                                               components=[{"type": "body", "parameters": []}],
+                                               concurrency=concurrency)
+            start = time.perf_counter()
+            report = service.add_recipients(campaign["id"], iter_csv_numbers(
+                io.StringIO(recipient_csv(args.recipients, seed=n, offset=n * 10**6))))
+            imported = time.perf_counter() - start
+
+            runner = CampaignRunner(GraphOutboundSender(), chunk_size=100)
+            service.set_status(campaign["id"], "running")
+            throttled = stub.counts["throttled"]
+            start = time.perf_counter()
+            runner.run(campaign["id"])
+            elapsed = time.perf_counter() - start
+            progress = service.get_progress(campaign["id"])
+            print(f"{'campaign':<12} c={concurrency:<6} {progress['sent'] / elapsed:>9.0f} sends/s  "
+                  f"sent={progress['sent']} failed={progress['failed']} 429s={stub.counts['throttled'] - throttled}  "
+                  f"import {report['received'] / imported:,.0f} rows/s "
+                  f"(accepted={report['accepted']} dup={report['duplicates']} invalid={report['invalid']})")
+
+
+if __name__ == "__main__":
+    main()
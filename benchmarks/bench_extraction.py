@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Payload Extraction Benchmark for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Compares the previous extraction path (validate_*_payload, then an if/elif
+walk building one dict record per message and one dict per status) with the
+single-pass PayloadExtractor building __slots__ records, on synthetic
+deliveries from benchmarks/payloads.py. Reports time per payload, bytes
+retained per record and tracemalloc peak, for extraction alone and for
+extraction plus normalization into messages rows. No database is touched.
+
+Usage:
+    python benchmarks/bench_extraction.py [--posts 5000] [--messages 1-10] [--mix text=60,status=40]
+"""
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Tuple
+
+from common import use_scratch_database
+
+use_scratch_database()
+
+from payloads import PayloadGenerator, parse_mix  # noqa: E402
+from src.services.extraction import PayloadExtractor  # noqa: E402
+from src.services.message_service import MessageService  # noqa: E402
+from src.utils.validators import validate_whatsapp_payload, validate_facebook_payload  # noqa: E402
+
+
+def legacy_whatsapp_record(message: Dict[str, Any], value: Dict[str, Any]) -> Dict[str, Any]:
+    if message["type"] == "text":
+        content = message["text"]["body"]
+        message_type = "text"
+    elif message["type"] == "image":
+        content = f"[Image message] ID: {message['image']['id']}"
+        message_type = "image"
+    elif message["type"] == "document":
+        content = f"[Document] {message['document'].get('filename', 'Unknown')}"
+        message_type = "document"
+    elif message["type"] == "audio":
+        content = "[Audio message]"
+        message_type = "audio"
+    elif message["type"] == "video":
+        content = "[Video message]"
+        message_type = "video"
+    else:
+        content = f"[{message['type'].title()} message]"
+        message_type = message["type"]
+    return {
+        "agent": "Agent1", "platform": "WhatsApp", "recipient": message["from"], "content": content,
+        "message_type": message_type, "message_id": message.get("id"), "sender_id": message["from"],
+        "is_incoming": True, "status": "received",
+        "extra_data": {
+            "phone_number_id": value.get("metadata", {}).get("phone_number_id"),
+            "display_phone_number": value.get("metadata", {}).get("display_phone_number"),
+            "message_type": message["type"]
+        }
+    }
+
+
+def legacy_facebook_record(event: Dict[str, Any]) -> Dict[str, Any]:
+    sender = event["sender"]["id"]
+    if "message" in event:
+        message = event["message"]
+        if "text" in message:
+            content, message_type = message["text"], "text"
+        elif "attachments" in message:
+            content, message_type = f"[Attachment] Type: {message['attachments'][0]['type']}", "attachment"
+        else:
+            content, message_type = "[Unknown message type]", "unknown"
+        return {
+            "agent": "Agent1", "platform": "Facebook", "recipient": sender, "content": content,
+            "message_type": message_type, "message_id": message.get("mid"), "sender_id": sender,
+            "is_incoming": True, "status": "received",
+            "extra_data": {"recipient_id": event.get("recipient", {}).get("id"), "message_type": message_type}
+        }
+    postback = event["postback"]
+    return {
+        "agent": "Agent1", "platform": "Facebook", "recipient": sender,
+        "content": f"[Postback] {postback['title']}: {postback['payload']}", "message_type": "postback",
+        "message_id": postback.get("mid"), "sender_id": sender, "is_incoming": True, "status": "received",
+        "extra_data": {"postback_title": postback["title"], "postback_payload": postback["payload"]}
+    }
+
+
+def legacy_extract(data: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """The pre-extractor path: validate, walk messages, walk statuses again."""
+    records, statuses = [], []
+    if data.get("object") == "whatsapp_business_account":
+        if not validate_whatsapp_payload(data):
+            raise ValueError("Invalid WhatsApp payload structure")
+        for entry in data["entry"]:
+            for change in entry["changes"]:
+                value = change.get("value") or {}
+                for message in value.get("messages") or []:
+                    records.append(legacy_whatsapp_record(message, value))
+        for entry in data.get("entry") or []:
+            for change in entry.get("changes") or []:
+                for status in (change.get("value") or {}).get("statuses") or []:
+                    try:
+                        timestamp = datetime.fromtimestamp(int(status["timestamp"]), timezone.utc)
+                    except (KeyError, TypeError, ValueError):
+                        timestamp = None
+                    statuses.append({"message_id": status.get("id"), "status": status.get("status"),
+                                     "timestamp": timestamp})
+    else:
+        if not validate_facebook_payload(data):
+            raise ValueError("Invalid Facebook payload structure")
+        for entry in data["entry"]:
+            for event in entry.get("messaging") or []:
+                records.append(legacy_facebook_record(event))
+    return records, statuses
+
+
+def typed_extractor() -> Callable[[Dict[str, Any]], Tuple[list, list]]:
+    extractor = PayloadExtractor()
+
+    def extract(data: Dict[str, Any]) -> Tuple[list, list]:
+        messages, statuses = extractor.extract(data)
+        for message in messages:
+            if message.agent is None:
+                message.agent = "Agent1"
+        return messages, statuses
+    return extract
+
+
+def legacy_rows(service: MessageService) -> Callable[[Dict[str, Any]], list]:
+    def run(data: Dict[str, Any]) -> list:
+        return [service._normalize_record(record) for record in legacy_extract(data)[0]]
+    return run
+
+
+def typed_rows() -> Callable[[Dict[str, Any]], list]:
+    extract = typed_extractor()
+
+    def run(data: Dict[str, Any]) -> list:
+        return [message.to_row() for message in extract(data)[0]]
+    return run
+
+
+def measure(fn: Callable[[Dict[str, Any]], Any], payloads: List[Dict[str, Any]], items: int) -> Dict[str, float]:
+    """Time per payload (best of 3), then retained bytes per item and peak with tracemalloc."""
+    best = float("inf")
+    for _ in range(3):
+        gc.collect()
+        start = time.perf_counter()
+        for payload in payloads:
+            fn(payload)
+        best = min(best, time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    kept = [fn(payload) for payload in payloads]
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return {
+        "us_per_payload": best / len(payloads) * 1e6,
+        "bytes_per_item": retained / max(items, 1),
+        "peak_kib": peak / 1024,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--posts", type=int, default=5000, help="payloads per run")
+    parser.add_argument("--messages", default="1-10", help="messages per payload, N or MIN-MAX")
+    parser.add_argument("--mix", default=None, help="kind weights, e.g. text=50,image=10,status=30,postback=10")
+    parser.add_argument("--seed", type=int, default=8598)
+    args = parser.parse_args()
+
+    low, _, high = args.messages.partition("-")
+    generator = PayloadGenerator(
+        mix=parse_mix(args.mix) if args.mix else None,
+        min_messages=int(low), max_messages=int(high or low), seed=args.seed
+    )
+    bodies = generator.batch(args.posts)
+    payloads = [json.loads(body) for body, _ in bodies]
+    items = sum(count for _, count in bodies)
+    service = MessageService()
+
+    print(f"payloads={args.posts} items={items} messages/payload={args.messages}")
+    print(f"{'path':<24} {'us/payload':>11} {'bytes/item':>11} {'peak KiB':>10}")
+    scenarios = [
+        ("extract (legacy)", legacy_extract),
+        ("extract (typed)", typed_extractor()),
+        ("extract+rows (legacy)", legacy_rows(service)),
+        ("extract+rows (typed)", typed_rows()),
+    ]
+    for label, fn in scenarios:
+        result = measure(fn, payloads, items)
+        print(f"{label:<24} {result['us_per_payload']:>11.2f} {result['bytes_per_item']:>11.0f} "
+              f"{result['peak_kib']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Graph Batch Benchmark for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Sends WhatsApp text messages to the local Graph stand-in
+(benchmarks/graph_stub.py) with per-request latency, once as individual
+POSTs over the pooled GraphClient and once through the GraphBatcher, which
+coalesces the sends of a --window ms window into Graph batch requests. The
+first part calls the client from --concurrency threads, like /send under
+load; the second drains the same number of outbox rows with one relay
+worker, like a queued burst.
+
+Usage:
+    python benchmarks/bench_graph_batch.py [--sends 2000] [--concurrency 1,8,32] [--latency 40] [--window 5]
+"""
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from common import latency_summary, use_scratch_database
+
+use_scratch_database()
+
+from graph_stub import GraphStub  # noqa: E402
+
+
+def payload(i: int) -> Dict[str, str]:
+    return {"messaging_product": "whatsapp", "to": f"2547{i % 100000:08d}", "type": "text",
+            "text": {"body": f"Benchmark reply {i}"}}
+
+
+def run(send: Callable[[int], int], sends: int, concurrency: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i: int) -> None:
+        nonlocal errors
+        started = time.perf_counter()
+        ok = send(i) < 400
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            errors += not ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(sends)))
+    report = {"elapsed_s": time.perf_counter() - start, "errors": errors}
+    report.update(latency_summary(latencies))
+    return report
+
+
+def drain(pool, sends: int) -> float:
+    """Enqueue `sends` outbox rows and time one relay worker delivering them all."""
+    from src.services import enqueue_send
+
+    for i in range(sends):
+        enqueue_send({"agent": "BenchAgent", "platform": "WhatsApp", "recipient": f"+2547{i:08d}",
+                      "content": f"reply {i}", "message_type": "text", "is_incoming": False}, payload(i))
+    start = time.perf_counter()
+    while pool.drain_once():
+        pass
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--sends", type=int, default=2000)
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--latency", type=float, default=40.0, help="stand-in latency per request, ms")
+    parser.add_argument("--window", type=float, default=5.0, help="batch window, ms")
+    args = parser.parse_args()
+
+    with GraphStub(latency_ms=args.latency) as stub:
+        os.environ.update(GRAPH_BASE_URL=stub.url, WHATSAPP_PHONE_ID="123456", WHATSAPP_ACCESS_TOKEN="bench",
+                          SEND_RELAY="false")
+        from src.database import init_database
+        from src.services import GraphBatcher, GraphClient, GraphOutboundSender, OutboundWorkerPool
+        from src.utils.rate_limit import KeyedRateLimiter
+
+        init_database()
+        print(f"stand-in={stub.url} sends={args.sends} latency={args.latency}ms window={args.window}ms")
+        print(f"{'client':<10} {'conc':>5} {'sends/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'requests':>9} {'errors':>7}")
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            client = GraphClient(base_url=stub.url, pool_size=max(concurrency, 4))
+            batcher = GraphBatcher(client, window_ms=args.window)
+            senders = (
+                ("single", lambda i: client.post("123456/messages", payload(i), token="bench").status_code),
+                ("batched", lambda i: batcher.post("123456/messages", payload(i), token="bench").status_code),
+            )
+            for label, send in senders:
+                requests_before = stub.counts["requests"]
+                report = run(send, args.sends, concurrency)
+                print(f"{label:<10} {concurrency:>5} {args.sends / report['elapsed_s']:>9.0f} "
+                      f"{report['p50_ms']:>8.1f} {report['p99_ms']:>8.1f} "
+                      f"{stub.counts['requests'] - requests_before:>9} {report['errors']:>7}")
+            batcher.close()
+            client.close()
+
+        print(f"\n{'relay':<10} {'rows':>5} {'sends/s':>9} {'requests':>9}")
+        client = GraphClient(base_url=stub.url)
+        for label, sender in (("single", GraphOutboundSender(client)),
+                              ("batched", GraphOutboundSender(client, GraphBatcher(client, window_ms=args.window)))):
+            pool = OutboundWorkerPool(sender, limiters={"WhatsApp": KeyedRateLimiter(0)}, workers=1, batch_size=50)
+            requests_before = stub.counts["requests"]
+            elapsed = drain(pool, args.sends // 4)
+            print(f"{label:<10} {args.sends // 4:>5} {args.sends // 4 / elapsed:>9.0f} "
+                  f"{stub.counts['requests'] - requests_before:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Graph Brownout Benchmark for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Drives WhatsApp sends from --concurrency threads through the GraphClient
+against the local Graph stand-in (benchmarks/graph_stub.py) while the
+stand-in goes healthy -> degraded (answers slower than the read timeout) ->
+healthy again. Runs once with the circuit breaker and adaptive in-flight
+limit effectively disabled and once with them on, and reports per phase how
+many calls succeeded, timed out or failed fast, the caller latency, and the
+thread-seconds spent waiting on Graph: the time sync workers were not
+available for anything else.
+
+Usage:
+    python benchmarks/bench_graph_breaker.py [--concurrency 32] [--phase 3] [--read-timeout 1]
+"""
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from common import latency_summary, use_scratch_database
+
+use_scratch_database()
+
+from graph_stub import GraphStub  # noqa: E402
+
+PHASES = (("healthy", False), ("degraded", True), ("recovered", False))
+
+
+def run(client, stub: GraphStub, concurrency: int, phase_s: float, slow_s: float) -> List[Dict[str, float]]:
+    import requests
+    from src.services import GraphUnavailable
+
+    results = []
+    for name, degraded in PHASES:
+        stub.latency = slow_s if degraded else 0.04
+        counts = {"ok": 0, "timeout": 0, "fast_fail": 0}
+        latencies: List[float] = []
+        lock = threading.Lock()
+        deadline = time.monotonic() + phase_s
+
+        def caller(worker: int) -> None:
+            i = 0
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    client.post("123456/messages", {"messaging_product": "whatsapp", "to": f"2547{worker:04d}{i:04d}",
+                                                    "type": "text", "text": {"body": "hi"}}, token="bench")
+                    outcome = "ok"
+                except GraphUnavailable:
+                    outcome = "fast_fail"
+                except requests.RequestException:
+                    outcome = "timeout"
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+                    counts[outcome] += 1
+                if outcome == "fast_fail":
+                    time.sleep(0.05)  # a worker would move on to other work here
+                i += 1
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(caller, range(concurrency)))
+        report = dict(counts, phase=name, waited_s=sum(latencies))
+        report.update(latency_summary(latencies))
+        report["limit"] = client.limiter.stats()["limit"]
+        report["breaker"] = client.breaker("messages").stats()["state"]
+        results.append(report)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--phase", type=float, default=3.0, help="seconds per phase")
+    parser.add_argument("--read-timeout", type=float, default=1.0)
+    args = parser.parse_args()
+
+    with GraphStub() as stub:
+        os.environ.update(GRAPH_BASE_URL=stub.url, GRAPH_BREAKER_OPEN_SECONDS="1", GRAPH_LATENCY_TARGET_MS="500",
+                          GRAPH_LIMIT_WAIT="0.1")
+        from src.services import GraphClient, GraphRetryPolicy
+        from src.utils import AIMDLimiter
+
+        print(f"stand-in={stub.url} concurrency={args.concurrency} phase={args.phase}s "
+              f"read_timeout={args.read_timeout}s degraded_latency={args.read_timeout * 2}s")
+        print(f"{'client':<9} {'phase':<10} {'ok':>6} {'timeout':>8} {'fastfail':>9} {'p50 ms':>8} {'p99 ms':>8} "
+              f"{'waited s':>9} {'limit':>6} {'breaker':>9}")
+        for label in ("unguarded", "guarded"):
+            retry = GraphRetryPolicy(max_retries=0)
+            if label == "unguarded":
+                client = GraphClient(base_url=stub.url, pool_size=args.concurrency, read_timeout=args.read_timeout,
+                                     retry=retry, limiter=AIMDLimiter(args.concurrency, minimum=args.concurrency))
+                client.breaker("messages").failure_threshold = 10 ** 9
+            else:
+                client = GraphClient(base_url=stub.url, pool_size=args.concurrency, read_timeout=args.read_timeout,
+                                     retry=retry)
+            for r in run(client, stub, args.concurrency, args.phase, args.read_timeout * 2):
+                print(f"{label:<9} {r['phase']:<10} {r['ok']:>6} {r['timeout']:>8} {r['fast_fail']:>9} "
+                      f"{r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['waited_s']:>9.1f} {r['limit']:>6} {r['breaker']:>9}")
+            client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Graph Client Benchmark for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Sends WhatsApp text messages to a local Graph stand-in (benchmarks/graph_stub.py)
+the old way, one requests.post (and so one new connection) per send, and
+through the shared pooled GraphClient, at several concurrency levels. With
+--tls the stand-in serves a self-signed certificate so the cost of the
+TCP+TLS handshake each unpooled send pays is included.
+
+Usage:
+    python benchmarks/bench_graph_client.py [--sends 2000] [--concurrency 1,8,32] [--tls] [--latency 20]
+    python benchmarks/bench_graph_client.py --throttle 0.05   # 5% of calls answered 429
+"""
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from common import latency_summary, use_scratch_database
+
+use_scratch_database()
+
+import requests  # noqa: E402
+
+from graph_stub import GraphStub  # noqa: E402
+
+
+def payload(i: int) -> Dict[str, Any]:
+    return {"messaging_product": "whatsapp", "to": f"2547{i % 100000:08d}", "type": "text",
+            "text": {"body": f"Benchmark reply {i}"}}
+
+
+def run(send: Callable[[int], int], sends: int, concurrency: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i: int) -> None:
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            ok = send(i) < 400
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(sends)))
+    report = {"elapsed_s": time.perf_counter() - start, "errors": errors}
+    report.update(latency_summary(latencies))
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--sends", type=int, default=2000)
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--tls", action="store_true", help="serve the stand-in over self-signed TLS")
+    parser.add_argument("--latency", type=float, default=0.0, help="stand-in latency per request, ms")
+    parser.add_argument("--throttle", type=float, default=0.0, help="share of requests answered 429")
+    args = parser.parse_args()
+
+    with GraphStub(latency_ms=args.latency, throttle_rate=args.throttle, tls=args.tls) as stub:
+        os.environ["GRAPH_BASE_URL"] = stub.url
+        from src.services.graph_client import GraphClient, GraphRetryPolicy
+
+        url = f"{stub.url}/v18.0/123456/messages"
+        verify = stub.cert_path or True
+        headers = {"Authorization": "Bearer bench", "Content-Type": "application/json"}
+
+        def unpooled(i: int) -> int:
+            return requests.post(url, json=payload(i), headers=headers, timeout=20, verify=verify).status_code
+
+        print(f"stand-in={stub.url} sends={args.sends} latency={args.latency}ms throttle={args.throttle}")
+        print(f"{'client':<10} {'conc':>5} {'sends/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'conns':>7} {'errors':>7}")
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            client = GraphClient(base_url=stub.url, pool_size=concurrency,
+                                 retry=GraphRetryPolicy(max_retries=3, backoff_base=0.01))
+
+            def pooled(i: int) -> int:
+                return client.post("123456/messages", payload(i), token="bench", verify=verify).status_code
+
+            for label, send in (("requests", unpooled), ("pooled", pooled)):
+                connections = stub.counts["connections"]
+                report = run(send, args.sends, concurrency)
+                print(f"{label:<10} {concurrency:>5} {args.sends / report['elapsed_s']:>9.0f} "
+                      f"{report['p50_ms']:>8.2f} {report['p99_ms']:>8.2f} "
+                      f"{stub.counts['connections'] - connections:>7} {report['errors']:>7}")
+            client.close()
+
+
+if __name__ == "__main__":
+    main()
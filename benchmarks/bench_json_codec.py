@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+JSON Codec Benchmark for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Compares the standard library json module with the codec backend
+(src.utils.json_codec) on the JSON work done per webhook: decoding realistic
+WhatsApp deliveries, encoding per-message extra_data and encoding the
+response body.
+
+Usage:
+    python benchmarks/bench_json_codec.py [--iterations 2000] [--sizes 1,10,100]
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.utils import json_codec  # noqa: E402
+
+
+def build_message(i: int) -> dict:
+    """A mix of text, image and document messages as Meta delivers them."""
+    base = {
+        "from": f"+2547{i:08d}",
+        "id": f"wamid.HBgMMjU0NzAwMDAwMDAwFQIAEhggQjE{i:012d}",
+        "timestamp": str(1735689600 + i),
+    }
+    kind = i % 3
+    if kind == 0:
+        base.update(type="text", text={"body": f"Habari, nahitaji msaada na akaunti yangu #{i} 🙏"})
+    elif kind == 1:
+        base.update(type="image", image={
+            "caption": "Risiti ya malipo",
+            "mime_type": "image/jpeg",
+            "sha256": "Xj1pZzH0YQkq0YI2mJ6xk1Jt3b4n9bQz8r1Yw1pQmFc=",
+            "id": f"{1000000000000000 + i}",
+        })
+    else:
+        base.update(type="document", document={
+            "filename": f"statement_{i}.pdf",
+            "mime_type": "application/pdf",
+            "sha256": "m5kL0pQ8wV2sY7bN4cR1tE6uI9oA3dF0gH2jK5lZ8xC=",
+            "id": f"{2000000000000000 + i}",
+        })
+    return base
+
+
+def build_payload(size: int) -> bytes:
+    """Raw body of a WhatsApp delivery carrying `size` messages, ten per entry."""
+    messages = [build_message(i) for i in range(size)]
+    entries = [
+        {"id": "102290129340398", "changes": [{
+            "field": "messages",
+            "value": {
+                "messaging_product": "whatsapp",
+                "metadata": {"display_phone_number": "15550783881", "phone_number_id": "106540352242922"},
+                "contacts": [{"profile": {"name": "Amina W."}, "wa_id": m["from"].lstrip("+")} for m in messages[i:i + 10]],
+                "messages": messages[i:i + 10],
+            },
+        }]}
+        for i in range(0, size, 10)
+    ]
+    return json.dumps({"object": "whatsapp_business_account", "entry": entries}).encode("utf-8")
+
+
+def stdlib_roundtrip(body: bytes) -> None:
+    data = json.loads(body)
+    for entry in data["entry"]:
+        for change in entry["changes"]:
+            for message in change["value"]["messages"]:
+                json.dumps({"whatsapp_message_id": message["id"], "raw": message}, ensure_ascii=False)
+    json.dumps({"status": "ok", "signature": "8598"}, sort_keys=True)
+
+
+def codec_roundtrip(body: bytes) -> None:
+    data = json_codec.loads(body)
+    for entry in data["entry"]:
+        for change in entry["changes"]:
+            for message in change["value"]["messages"]:
+                json_codec.dumps({"whatsapp_message_id": message["id"], "raw": message})
+    json_codec.dumps({"status": "ok", "signature": "8598"}, sort_keys=True)
+
+
+def measure(fn, body: bytes, iterations: int) -> float:
+    """Microseconds per webhook."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(body)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--iterations", type=int, default=2000, help="webhooks per scenario")
+    parser.add_argument("--sizes", default="1,10,100", help="messages per webhook")
+    args = parser.parse_args()
+
+    print(f"codec backend: {json_codec.BACKEND}")
+    print(f"{'msgs/POST':>10} {'bytes':>8} {'stdlib us':>10} {'codec us':>10} {'speedup':>8}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        body = build_payload(size)
+        stdlib = measure(stdlib_roundtrip, body, args.iterations)
+        codec = measure(codec_roundtrip, body, args.iterations)
+        print(f"{size:>10} {len(body):>8} {stdlib:>10.1f} {codec:>10.1f} {stdlib / codec:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Send Queue Benchmark for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Posts bursts of /send requests against a local Graph stand-in
+(benchmarks/graph_stub.py) that adds per-call latency and throttles each
+sending number above --meta-rate sends per second, the way Meta does.
+Direct mode waits for the Graph call inside /send (a send still throttled after
+the client's retries answers 202 and is left to the outbox relay, which this
+benchmark keeps stopped); queue mode (SEND_MODE=queue)
+stores the message and answers 202, then the send workers deliver under a
+token bucket of --rate per phone number id. Reports /send latency, time until
+every message was delivered and how many calls Meta-side throttling rejected.
+
+Usage:
+    python benchmarks/bench_send_queue.py [--sends 500] [--concurrency 16] [--latency 40] [--meta-rate 80] [--rate 70]
+"""
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from common import latency_summary, use_scratch_database
+
+use_scratch_database()
+
+from graph_stub import GraphStub  # noqa: E402
+
+
+def post_burst(app, sends: int, concurrency: int) -> Dict[str, float]:
+    """POST `sends` /send requests from `concurrency` threads; returns latency summary and status counts."""
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    lock = threading.Lock()
+
+    def one(i: int) -> None:
+        client = app.test_client()
+        started = time.perf_counter()
+        response = client.post('/send', json={"agent": "BenchAgent", "to": f"+2547{i:08d}", "text": f"^BA reply {i}"})
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(sends)))
+    report = {"elapsed_s": time.perf_counter() - start, "statuses": statuses}
+    report.update(latency_summary(latencies))
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--sends", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=40.0, help="stand-in latency per call, ms")
+    parser.add_argument("--meta-rate", type=int, default=80, help="stand-in limit, sends/second per number")
+    parser.add_argument("--rate", type=float, default=70.0, help="send worker token bucket, sends/second")
+    parser.add_argument("--workers", type=int, default=16)
+    args = parser.parse_args()
+
+    with GraphStub(latency_ms=args.latency, rate_limit=args.meta_rate) as stub:
+        os.environ.update(GRAPH_BASE_URL=stub.url, WHATSAPP_PHONE_ID="123456", WHATSAPP_ACCESS_TOKEN="bench",
+                          GRAPH_BACKOFF_BASE="0.05", SEND_RELAY="false", GRAPH_POOL_SIZE=str(max(args.concurrency, args.workers)))
+        from src.api.webhook_app import app
+        from src.config import config
+        from src.database import OutboundSend, get_db_session, init_database
+        from src.services import GraphOutboundSender, OutboundWorkerPool
+        from src.utils.rate_limit import KeyedRateLimiter
+
+        init_database()
+        app.test_client().post('/team/initials', json={"initials": "BA", "agent": "BenchAgent"})
+
+        print(f"sends={args.sends} concurrency={args.concurrency} latency={args.latency}ms "
+              f"meta-rate={args.meta_rate}/s rate={args.rate}/s")
+        print(f"{'mode':<8} {'p50 ms':>8} {'p99 ms':>8} {'delivered s':>12} {'sends/s':>8} {'429s':>6} {'statuses'}")
+
+        throttled = stub.counts["throttled"]
+        report = post_burst(app, args.sends, args.concurrency)
+        print(f"{'direct':<8} {report['p50_ms']:>8.1f} {report['p99_ms']:>8.1f} {report['elapsed_s']:>12.2f} "
+              f"{args.sends / report['elapsed_s']:>8.0f} {stub.counts['throttled'] - throttled:>6} {report['statuses']}")
+
+        # Keep direct-mode leftovers out of the queue-mode delivery count
+        with get_db_session() as session:
+            session.query(OutboundSend).filter(OutboundSend.status == "queued").update({"status": "failed"})
+            session.commit()
+
+        throttled = stub.counts["throttled"]
+        sends = stub.counts["sends"]
+        config.outbound.mode = "queue"
+        pool = OutboundWorkerPool(GraphOutboundSender(), limiters={"WhatsApp": KeyedRateLimiter(args.rate, max(1.0, args.rate / 10))},
+                                  workers=args.workers, batch_size=20, poll_interval=0.05)
+        start = time.perf_counter()
+        pool.start()
+        report = post_burst(app, args.sends, args.concurrency)
+        while stub.counts["sends"] - sends < args.sends and time.perf_counter() - start < 300:
+            time.sleep(0.05)
+        delivered = time.perf_counter() - start
+        pool.stop()
+        print(f"{'queue':<8} {report['p50_ms']:>8.1f} {report['p99_ms']:>8.1f} {delivered:>12.2f} "
+              f"{args.sends / delivered:>8.0f} {stub.counts['throttled'] - throttled:>6} {report['statuses']}")
+        print(f"queue workers: {pool.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Shared helpers for HCTC-CRM benchmarks
+Copyright (c) 2025 - Signature: 8598
+"""
+
+import math
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def use_scratch_database() -> None:
+    """
+    Point the app at a throwaway SQLite database (unless DATABASE_URL is set)
+    and make `src` importable. Call before importing anything from src.
+    """
+    tmpdir = tempfile.mkdtemp(prefix="hctc_bench_")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{tmpdir}/bench.db")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("ENVIRONMENT", "staging")
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/max of latencies given in seconds, reported in milliseconds."""
+    ordered = sorted(latencies)
+    return {
+        "p50_ms": percentile(ordered, 50) * 1000,
+        "p95_ms": percentile(ordered, 95) * 1000,
+        "p99_ms": percentile(ordered, 99) * 1000,
+        "max_ms": (ordered[-1] if ordered else 0.0) * 1000,
+    }
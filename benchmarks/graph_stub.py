@@ -0,0 +1,205 @@
+"""
+Local Graph API stand-in for HCTC-CRM benchmarks
+Copyright (c) 2025 - Signature: 8598
+
+A small threaded HTTP/1.1 server (keep-alive, optional self-signed TLS) that
+answers the Graph calls the app makes: WhatsApp and Messenger sends
+(POST /<version>/<id>/messages), batch requests of up to 50 sends
+(POST /<version>/ with {"batch": [...]}) and media lookups
+(GET /<version>/<media-id>).
+It can add per-request latency, answer a share of requests with 429 to
+exercise retries, and enforce a per-sender rate limit (sends per second per
+phone number / page id) the way Meta throttles. Standalone: no imports from src.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+import itertools
+import json
+import os
+import random
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+
+class GraphStub:
+    """
+    Runs the stand-in on 127.0.0.1 in a background thread.
+    Signature: 8598
+
+        with GraphStub(latency_ms=40, tls=True) as stub:
+            os.environ["GRAPH_BASE_URL"] = stub.url
+    """
+
+    def __init__(self, latency_ms: float = 0.0, throttle_rate: float = 0.0, tls: bool = False, seed: int = 8598,
+                 rate_limit: int = 0):
+        self.latency = latency_ms / 1000
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit  # sends per second per sender id; 0 disables
+        self._windows: Dict[str, list] = {}
+        self.tls = tls
+        self.random = random.Random(seed)
+        self.counts: Dict[str, int] = {"requests": 0, "sends": 0, "batches": 0, "throttled": 0, "connections": 0}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._certdir: Optional[tempfile.TemporaryDirectory] = None
+        self.cert_path: Optional[str] = None  # CA bundle for clients when tls=True
+
+    @property
+    def url(self) -> str:
+        scheme = "https" if self.tls else "http"
+        return f"{scheme}://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> "GraphStub":
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self) -> None:
+                super().setup()
+                # Headers and body go out in separate writes; don't let Nagle hold the body back
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                stub._count("connections")
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                stub._count("requests")
+                try:
+                    payload = json.loads(body or b"{}")
+                except ValueError:
+                    return self._send(400, {"error": {"message": "invalid json"}})
+                if "batch" in payload:
+                    return self._batch(payload["batch"])
+                parts = self.path.split("?")[0].strip("/").split("/")
+                status, reply = stub._message(parts[-2] if len(parts) > 1 else "", payload)
+                if status == 429:
+                    return self._send(429, reply, {"Retry-After": "0"})
+                self._send(status, reply)
+
+            def _batch(self, items: list) -> None:
+                """Graph batch request: each item is answered as if sent on its own, in one response."""
+                if stub._throttle():
+                    return self._send(429, {"error": {"code": 4, "message": "rate limited"}}, {"Retry-After": "0"})
+                if len(items) > 50:
+                    return self._send(400, {"error": {"message": "too many batch requests"}})
+                stub._count("batches")
+                results = []
+                for item in items:
+                    fields = {key: values[0] for key, values in parse_qs(item.get("body") or "").items()}
+                    for key, value in fields.items():
+                        if value[:1] in "{[":
+                            fields[key] = json.loads(value)
+                    parts = item.get("relative_url", "").split("?")[0].strip("/").split("/")
+                    status, reply = stub._message(parts[-2] if len(parts) > 1 else "", fields, throttle=False)
+                    results.append({"code": status, "headers": [{"name": "Content-Type", "value": "application/json"}],
+                                    "body": json.dumps(reply)})
+                self._send(200, results)
+
+            def do_GET(self) -> None:
+                stub._count("requests")
+                if stub._throttle():
+                    return self._send(429, {"error": {"code": 4, "message": "rate limited"}}, {"Retry-After": "0"})
+                media_id = self.path.rstrip("/").rsplit("/", 1)[-1].split("?")[0]
+                self._send(200, {"url": f"{stub.url}/media/{media_id}", "mime_type": "image/jpeg",
+                                 "file_size": 0, "id": media_id})
+
+            def _send(self, status: int, body: dict, headers: Optional[Dict[str, str]] = None) -> None:
+                if stub.latency:
+                    time.sleep(stub.latency)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        if self.tls:
+            # Handshake in the handler thread, not in the accept loop
+            self._server.socket = self._tls_context().wrap_socket(
+                self._server.socket, server_side=True, do_handshake_on_connect=False
+            )
+        self._thread = threading.Thread(target=self._server.serve_forever, name="graph-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self._certdir is not None:
+            self._certdir.cleanup()
+
+    def __enter__(self) -> "GraphStub":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    def _message(self, sender: str, payload: dict, throttle: bool = True):
+        """(status, body) of one message send from `sender`."""
+        if (throttle and self._throttle()) or self._over_limit(sender):
+            return 429, {"error": {"code": 4, "message": "rate limited"}}
+        self._count("sends")
+        message_id = f"stub.{next(self._ids)}"
+        if payload.get("messaging_product") == "whatsapp":
+            return 200, {"messaging_product": "whatsapp",
+                         "contacts": [{"input": payload.get("to"), "wa_id": payload.get("to")}],
+                         "messages": [{"id": f"wamid.{message_id}"}]}
+        return 200, {"recipient_id": (payload.get("recipient") or {}).get("id"), "message_id": f"m_{message_id}"}
+
+    def _throttle(self) -> bool:
+        with self._lock:
+            throttled = self.throttle_rate and self.random.random() < self.throttle_rate
+        if throttled:
+            self._count("throttled")
+        return bool(throttled)
+
+    def _over_limit(self, sender: str) -> bool:
+        """Fixed one-second window per sender id."""
+        if not self.rate_limit:
+            return False
+        second = int(time.monotonic())
+        with self._lock:
+            window = self._windows.setdefault(sender, [second, 0])
+            if window[0] != second:
+                window[:] = [second, 0]
+            window[1] += 1
+            over = window[1] > self.rate_limit
+        if over:
+            self._count("throttled")
+        return over
+
+    def _tls_context(self) -> ssl.SSLContext:
+        """Self-signed certificate for 127.0.0.1 (needs the openssl CLI); clients verify with cert_path."""
+        self._certdir = tempfile.TemporaryDirectory(prefix="graph_stub_")
+        cert = os.path.join(self._certdir.name, "cert.pem")
+        key = os.path.join(self._certdir.name, "key.pem")
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1", "-nodes",
+             "-days", "1", "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+             "-keyout", key, "-out", cert],
+            check=True, capture_output=True
+        )
+        self.cert_path = cert
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        return context
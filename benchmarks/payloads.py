@@ -0,0 +1,186 @@
+"""
+Synthetic Meta webhook payloads for HCTC-CRM benchmarks
+Copyright (c) 2025 - Signature: 8598
+
+Generates realistic WhatsApp Cloud API and Facebook Messenger deliveries:
+text, image and document messages, Messenger text, attachments and
+postbacks, WhatsApp status callbacks, multi-entry batches and duplicate
+retries of earlier deliveries, in a configurable mix.
+"""
+
+from typing import Dict, List, Optional, Tuple
+import json
+import random
+import time
+
+WHATSAPP_KINDS = ("text", "image", "document", "status")
+FACEBOOK_KINDS = ("fb_text", "fb_attachment", "postback")
+KINDS = WHATSAPP_KINDS + FACEBOOK_KINDS
+
+DEFAULT_MIX = {
+    "text": 45, "image": 10, "document": 5, "status": 20,
+    "fb_text": 12, "fb_attachment": 4, "postback": 4,
+}
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """Parse 'text=50,image=10,status=40' into a weight per kind."""
+    mix = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        kind, _, weight = part.partition("=")
+        if kind not in KINDS:
+            raise ValueError(f"unknown payload kind {kind!r}; expected one of {', '.join(KINDS)}")
+        mix[kind] = float(weight or 1)
+    if not mix or not any(mix.values()):
+        raise ValueError("payload mix is empty")
+    return mix
+
+
+class PayloadGenerator:
+    """
+    Produces webhook bodies one POST at a time.
+    Signature: 8598
+
+    Each POST carries between `min_messages` and `max_messages` items of
+    one platform; with `entries` > 1 they are spread over several entries
+    the way Meta coalesces deliveries under load. `duplicate_rate` is the
+    share of POSTs that resend an earlier body unchanged (a Meta retry).
+    """
+
+    def __init__(
+        self,
+        mix: Optional[Dict[str, float]] = None,
+        min_messages: int = 1,
+        max_messages: int = 1,
+        entries: int = 1,
+        duplicate_rate: float = 0.0,
+        senders: int = 500,
+        seed: int = 8598,
+        run_id: Optional[str] = None
+    ):
+        self.mix = mix or dict(DEFAULT_MIX)
+        self.min_messages = min_messages
+        self.max_messages = max(min_messages, max_messages)
+        self.entries = max(1, entries)
+        self.duplicate_rate = duplicate_rate
+        self.senders = senders
+        self.random = random.Random(seed)
+        self.run_id = run_id or str(int(time.time()))
+        self._kinds = list(self.mix)
+        self._weights = [self.mix[k] for k in self._kinds]
+        self._sequence = 0
+        self._history: List[Tuple[bytes, int]] = []
+        self._whatsapp_ids: List[str] = []
+
+    def next(self) -> Tuple[bytes, int]:
+        """Return (body, number of messages or statuses it carries)."""
+        if self._history and self.random.random() < self.duplicate_rate:
+            return self.random.choice(self._history)
+
+        first = self._pick(self._kinds, self._weights)
+        platform_kinds = WHATSAPP_KINDS if first in WHATSAPP_KINDS else FACEBOOK_KINDS
+        kinds = [k for k in self._kinds if k in platform_kinds]
+        weights = [self.mix[k] for k in kinds]
+        count = self.random.randint(self.min_messages, self.max_messages)
+        items = [first] + [self._pick(kinds, weights) for _ in range(count - 1)]
+
+        if platform_kinds is WHATSAPP_KINDS:
+            payload = self._whatsapp_payload(items)
+        else:
+            payload = self._facebook_payload(items)
+        body = json.dumps(payload).encode("utf-8")
+
+        # Keep a bounded window of bodies to retry
+        if len(self._history) < 1000:
+            self._history.append((body, count))
+        else:
+            self._history[self.random.randrange(1000)] = (body, count)
+        return body, count
+
+    def batch(self, posts: int) -> List[Tuple[bytes, int]]:
+        """Generate `posts` bodies up front so generation stays out of the timings."""
+        return [self.next() for _ in range(posts)]
+
+    def _pick(self, kinds: List[str], weights: List[float]) -> str:
+        return self.random.choices(kinds, weights)[0]
+
+    def _id(self) -> str:
+        self._sequence += 1
+        return f"{self.run_id}.{self._sequence}"
+
+    def _sender(self) -> str:
+        return f"+2547{self.random.randrange(self.senders):08d}"
+
+    def _split(self, items: list) -> List[list]:
+        per_entry = max(1, -(-len(items) // self.entries))
+        return [items[i:i + per_entry] for i in range(0, len(items), per_entry)]
+
+    def _whatsapp_payload(self, kinds: List[str]) -> dict:
+        now = int(time.time())
+        entries = []
+        for chunk in self._split(kinds):
+            messages, statuses, contacts = [], [], []
+            for kind in chunk:
+                if kind == "status" and self._whatsapp_ids:
+                    statuses.append({
+                        "id": self.random.choice(self._whatsapp_ids),
+                        "status": self.random.choice(("sent", "delivered", "read")),
+                        "timestamp": str(now),
+                        "recipient_id": self._sender().lstrip("+"),
+                    })
+                    continue
+                message = self._whatsapp_message("text" if kind == "status" else kind, now)
+                messages.append(message)
+                contacts.append({"profile": {"name": "Customer"}, "wa_id": message["from"].lstrip("+")})
+            value = {
+                "messaging_product": "whatsapp",
+                "metadata": {"display_phone_number": "15550783881", "phone_number_id": "106540352242922"},
+            }
+            if messages:
+                value["contacts"] = contacts
+                value["messages"] = messages
+            if statuses:
+                value["statuses"] = statuses
+            entries.append({"id": "102290129340398", "changes": [{"field": "messages", "value": value}]})
+        return {"object": "whatsapp_business_account", "entry": entries}
+
+    def _whatsapp_message(self, kind: str, now: int) -> dict:
+        message_id = f"wamid.{self._id()}"
+        if len(self._whatsapp_ids) < 10000:
+            self._whatsapp_ids.append(message_id)
+        message = {"from": self._sender(), "id": message_id, "timestamp": str(now), "type": kind}
+        if kind == "text":
+            message["text"] = {"body": self.random.choice((
+                "Habari, nahitaji msaada na akaunti yangu",
+                "Hello, my payment has not reflected yet. Reference QWE12345",
+                "Asante sana 🙏",
+            ))}
+        elif kind == "image":
+            message["image"] = {"caption": "Receipt", "mime_type": "image/jpeg",
+                                "sha256": "Xj1pZzH0YQkq0YI2mJ6xk1Jt3b4n9bQz8r1Yw1pQmFc=",
+                                "id": str(1000000000000000 + self._sequence)}
+        else:
+            message["document"] = {"filename": f"statement_{self._sequence}.pdf", "mime_type": "application/pdf",
+                                   "sha256": "m5kL0pQ8wV2sY7bN4cR1tE6uI9oA3dF0gH2jK5lZ8xC=",
+                                   "id": str(2000000000000000 + self._sequence)}
+        return message
+
+    def _facebook_payload(self, kinds: List[str]) -> dict:
+        now = int(time.time() * 1000)
+        entries = []
+        for chunk in self._split(kinds):
+            events = []
+            for kind in chunk:
+                event = {"sender": {"id": self._sender().lstrip("+")}, "recipient": {"id": "105000000000001"},
+                         "timestamp": now}
+                if kind == "fb_text":
+                    event["message"] = {"mid": f"m_{self._id()}", "text": "Hi, is the shop open today?"}
+                elif kind == "fb_attachment":
+                    event["message"] = {"mid": f"m_{self._id()}", "attachments": [
+                        {"type": "image", "payload": {"url": "https://scontent.example/photo.jpg"}}]}
+                else:
+                    event["postback"] = {"mid": f"m_{self._id()}", "title": "Talk to an agent",
+                                         "payload": "AGENT_REQUEST"}
+                events.append(event)
+            entries.append({"id": "105000000000001", "time": now, "messaging": events})
+        return {"object": "page", "entry": entries}
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Webhook Capture Replay for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Replays webhook traffic recorded with INGEST_CAPTURE_DIR, either in-process
+through WebhookHandler (against a scratch SQLite database unless DATABASE_URL
+is set) or over HTTP against a running server, at the original pace (1x), N
+times faster, or as fast as possible, and reports throughput and latency
+percentiles.
+
+Usage:
+    python benchmarks/replay_capture.py captures/ [--speed 1|N|max] [--concurrency 8]
+    python benchmarks/replay_capture.py captures/ --target http://localhost:5000/webhook --speed max
+"""
+
+import argparse
+import hashlib
+import hmac
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from common import latency_summary, use_scratch_database
+
+use_scratch_database()
+
+from src.services import CapturedRequest, read_capture  # noqa: E402
+from src.utils import json_codec  # noqa: E402
+
+
+def rewrite_ids(data: Dict[str, Any], suffix: str) -> int:
+    """
+    Make message ids unique for this run so replays are not deduplicated
+    against earlier runs. Returns the number of messages in the payload.
+    """
+    messages = 0
+    for entry in data.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            for message in value.get("messages") or []:
+                messages += 1
+                if message.get("id"):
+                    message["id"] += suffix
+            for status in value.get("statuses") or []:
+                if status.get("id"):
+                    status["id"] += suffix
+        for event in entry.get("messaging") or []:
+            messages += 1
+            message = event.get("message") or event.get("postback") or {}
+            if message.get("mid"):
+                message["mid"] += suffix
+    return messages
+
+
+def prepare(items: List[CapturedRequest], suffix: Optional[str], secret: Optional[str]) -> List[Tuple[float, Dict[str, str], bytes, int]]:
+    """Decode, optionally rewrite and re-sign captured deliveries: (offset, headers, body, messages)."""
+    prepared = []
+    t0 = items[0].arrived_at if items else 0.0
+    for item in items:
+        headers = dict(item.headers)
+        body = item.body
+        data = json_codec.loads(body)
+        if suffix:
+            messages = rewrite_ids(data, suffix)
+            body = json_codec.dumps_bytes(data)
+            headers.pop("X-Hub-Signature-256", None)
+        else:
+            messages = rewrite_ids(json_codec.loads(body), "")
+        if secret:
+            headers["X-Hub-Signature-256"] = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        prepared.append((item.arrived_at - t0, headers, body, messages))
+    return prepared
+
+
+def in_process_sender() -> Callable[[Dict[str, str], bytes], bool]:
+    """Push bodies straight through WebhookHandler."""
+    from src.database import init_database
+    from src.api.webhook_app import webhook_handler
+
+    init_database()
+
+    def send(headers: Dict[str, str], body: bytes) -> bool:
+        webhook_handler.handle_payload(json_codec.loads(body))
+        return True
+    return send
+
+
+def http_sender(url: str) -> Callable[[Dict[str, str], bytes], bool]:
+    """POST bodies to a running server, one keep-alive session per thread."""
+    import requests
+    local = threading.local()
+
+    def send(headers: Dict[str, str], body: bytes) -> bool:
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        return session.post(url, data=body, headers=headers, timeout=30).status_code == 200
+    return send
+
+
+def replay(prepared, send, speed: float, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def run(headers: Dict[str, str], body: bytes) -> None:
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            ok = send(headers, body)
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for offset, headers, body, _ in prepared:
+            if speed:
+                # Hold the recorded inter-arrival gaps, compressed by `speed`
+                delay = offset / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(run, headers, body)
+    elapsed = time.perf_counter() - start
+
+    messages = sum(p[3] for p in prepared)
+    report = {
+        "requests": len(prepared),
+        "messages": messages,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "req_per_s": len(prepared) / elapsed if elapsed else 0.0,
+        "msgs_per_s": messages / elapsed if elapsed else 0.0,
+    }
+    report.update(latency_summary(latencies))
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("captures", nargs="+", help="capture segment files or directories")
+    parser.add_argument("--target", default="inprocess", help="'inprocess' or a /webhook URL")
+    parser.add_argument("--speed", default="max", help="1 for real time, N for N times faster, max for no pacing")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight")
+    parser.add_argument("--limit", type=int, default=0, help="replay at most this many deliveries")
+    parser.add_argument("--keep-ids", action="store_true", help="do not make message ids unique per run")
+    parser.add_argument("--secret", default=None, help="app secret to re-sign bodies for an HTTP target")
+    args = parser.parse_args()
+
+    items = sorted(read_capture(args.captures), key=lambda item: item.arrived_at)
+    if args.limit:
+        items = items[:args.limit]
+    if not items:
+        parser.error("no captured deliveries found")
+
+    suffix = None if args.keep_ids else f".replay{int(time.time())}"
+    prepared = prepare(items, suffix, args.secret)
+    send = in_process_sender() if args.target == "inprocess" else http_sender(args.target)
+    speed = 0.0 if args.speed == "max" else float(args.speed)
+
+    report = replay(prepared, send, speed, args.concurrency)
+    if args.target == "inprocess":
+        from src.services import get_status_coalescer
+        get_status_coalescer().flush()
+
+    print(f"target={args.target} speed={args.speed} concurrency={args.concurrency}")
+    print(f"requests={report['requests']} messages={report['messages']} errors={report['errors']} "
+          f"elapsed={report['elapsed_s']:.2f}s")
+    print(f"throughput: {report['req_per_s']:.0f} req/s, {report['msgs_per_s']:.0f} msgs/s")
+    print(f"latency: p50={report['p50_ms']:.2f}ms p95={report['p95_ms']:.2f}ms "
+          f"p99={report['p99_ms']:.2f}ms max={report['max_ms']:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,3 @@
-import requests
-import json
 import logging
 from config import (
     WHATSAPP_ACCESS_TOKEN,
@@ -7,21 +5,35 @@ from config import (
     FACEBOOK_PAGE_ACCESS_TOKEN,
     FACEBOOK_PAGE_ID
 )
+from src.services.blocklist import get_blocklist
+from src.services.graph_batch import get_graph_sender
 
 logger = logging.getLogger(__name__)
 
+
+def opted_out(platform, recipient):
+    """Error result for a recipient on the opt-out blocklist, or None if they may be messaged"""
+    if get_blocklist().is_blocked(recipient, platform):
+        logger.warning(f"{platform} message to {recipient} not sent: recipient opted out")
+        return {"success": False, "error": "recipient_opted_out"}
+    return None
+
 class WhatsAppMessenger:
     """Handle sending messages via WhatsApp Business API"""
     
     def __init__(self):
         self.token = WHATSAPP_ACCESS_TOKEN
         self.phone_id = WHATSAPP_PHONE_ID
-        self.base_url = "https://graph.facebook.com/v18.0"
+        self.graph = get_graph_sender()
         
     def send_text_message(self, recipient_phone, message_text):
         """Send a text message to a WhatsApp user"""
         try:
-            url = f"{self.base_url}/{self.phone_id}/messages"
+            blocked = opted_out("WhatsApp", recipient_phone)
+            if blocked:
+                return blocked
+            
+            path = f"{self.phone_id}/messages"
             
             payload = {
                 "messaging_product": "whatsapp",
@@ -30,12 +42,7 @@ class WhatsAppMessenger:
                 "text": {"body": message_text}
             }
             
-            headers = {
-                "Authorization": f"Bearer {self.token}",
-                "Content-Type": "application/json"
-            }
-            
-            response = requests.post(url, json=payload, headers=headers)
+            response = self.graph.post(path, payload, token=self.token)
             
             if response.status_code in (200, 201):
                 logger.info(f"WhatsApp message sent successfully to {recipient_phone}")
@@ -51,7 +58,11 @@ class WhatsAppMessenger:
     def send_template_message(self, recipient_phone, template_name, language_code="en_US", components=None):
         """Send a template message to a WhatsApp user"""
         try:
-            url = f"{self.base_url}/{self.phone_id}/messages"
+            blocked = opted_out("WhatsApp", recipient_phone)
+            if blocked:
+                return blocked
+            
+            path = f"{self.phone_id}/messages"
             
             payload = {
                 "messaging_product": "whatsapp",
@@ -66,12 +77,7 @@ class WhatsAppMessenger:
             if components:
                 payload["template"]["components"] = components
             
-            headers = {
-                "Authorization": f"Bearer {self.token}",
-                "Content-Type": "application/json"
-            }
-            
-            response = requests.post(url, json=payload, headers=headers)
+            response = self.graph.post(path, payload, token=self.token)
             
             if response.status_code in (200, 201):
                 logger.info(f"WhatsApp template message sent successfully to {recipient_phone}")
@@ -90,21 +96,23 @@ class FacebookMessenger:
     def __init__(self):
         self.token = FACEBOOK_PAGE_ACCESS_TOKEN
         self.page_id = FACEBOOK_PAGE_ID
-        self.base_url = "https://graph.facebook.com/v18.0"
+        self.graph = get_graph_sender()
         
     def send_text_message(self, recipient_id, message_text):
         """Send a text message to a Facebook user"""
         try:
-            url = f"{self.base_url}/{self.page_id}/messages"
+            blocked = opted_out("Facebook", recipient_id)
+            if blocked:
+                return blocked
+            
+            path = f"{self.page_id}/messages"
             
             payload = {
                 "recipient": {"id": recipient_id},
                 "message": {"text": message_text}
             }
             
-            params = {"access_token": self.token}
-            
-            response = requests.post(url, json=payload, params=params)
+            response = self.graph.post(path, payload, token=self.token, token_in_query=True)
             
             if response.status_code in (200, 201):
                 logger.info(f"Facebook message sent successfully to {recipient_id}")
@@ -120,7 +128,11 @@ class FacebookMessenger:
     def send_quick_replies(self, recipient_id, message_text, quick_replies):
         """Send a message with quick reply buttons"""
         try:
-            url = f"{self.base_url}/{self.page_id}/messages"
+            blocked = opted_out("Facebook", recipient_id)
+            if blocked:
+                return blocked
+            
+            path = f"{self.page_id}/messages"
             
             payload = {
                 "recipient": {"id": recipient_id},
@@ -130,9 +142,7 @@ class FacebookMessenger:
                 }
             }
             
-            params = {"access_token": self.token}
-            
-            response = requests.post(url, json=payload, params=params)
+            response = self.graph.post(path, payload, token=self.token, token_in_query=True)
             
             if response.status_code in (200, 201):
                 logger.info(f"Facebook quick reply message sent successfully to {recipient_id}")
@@ -147,16 +157,34 @@ class FacebookMessenger:
 
 # Example usage functions
 
+_whatsapp_messenger = None
+_facebook_messenger = None
+
+
+def get_whatsapp_messenger():
+    """Shared WhatsAppMessenger, created on first use"""
+    global _whatsapp_messenger
+    if _whatsapp_messenger is None:
+        _whatsapp_messenger = WhatsAppMessenger()
+    return _whatsapp_messenger
+
+
+def get_facebook_messenger():
+    """Shared FacebookMessenger, created on first use"""
+    global _facebook_messenger
+    if _facebook_messenger is None:
+        _facebook_messenger = FacebookMessenger()
+    return _facebook_messenger
+
+
 def send_whatsapp_reply(phone_number, message):
     """Helper function to send WhatsApp reply"""
-    messenger = WhatsAppMessenger()
-    return messenger.send_text_message(phone_number, message)
+    return get_whatsapp_messenger().send_text_message(phone_number, message)
 
 
 def send_facebook_reply(user_id, message):
     """Helper function to send Facebook reply"""
-    messenger = FacebookMessenger()
-    return messenger.send_text_message(user_id, message)
+    return get_facebook_messenger().send_text_message(user_id, message)
 
 
 def send_auto_reply(platform, recipient, message):
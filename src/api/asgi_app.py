@@ -0,0 +1,294 @@
+"""
+ASGI Webhook Application for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Async variant of the webhook service. /webhook, /send and /health run on the
+event loop with an async database driver and an async HTTP client, so one
+process holds thousands of concurrent webhook deliveries and sends instead
+of one per sync worker. Payload parsing is the same WebhookHandler used by
+the Flask app, and every other route is served by the Flask app itself,
+mounted as WSGI, so both services expose identical routes.
+
+Run with:
+    uvicorn src.api.asgi_app:app --host 0.0.0.0 --port $PORT
+"""
+
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+import asyncio
+import logging
+import time
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Mount, Route
+from werkzeug.exceptions import BadRequest, Unauthorized
+
+from ..config import config
+from ..database import init_database
+from ..services.agent_registry import get_agent_registry
+from ..services.async_message_service import AsyncMessageService
+from ..services.graph_batch import get_graph_batcher
+from ..services.graph_client import AsyncGraphClient
+from ..services.service_window import get_service_window
+from ..services.blocklist import get_blocklist
+from ..services.outbound_service import SendError, SendResult, enqueue_claimed, enqueue_send, parse_send_response
+from ..utils import json_codec
+from ..utils.metrics import stage
+from .webhook_app import (
+    app as flask_app,
+    webhook_handler,
+    webhook_shedder,
+    ingest_spool,
+    webhook_capture,
+    webhook_stage_metrics,
+    finish_stage_trace,
+    validate_send_request,
+    check_agent_initials,
+    whatsapp_text_request,
+    send_payload,
+    sent_message_record,
+    OUTSIDE_WINDOW,
+    OPTED_OUT,
+    send_outcome,
+    record_direct_send,
+    health_details,
+)
+
+logger = logging.getLogger(__name__)
+
+class CodecJSONResponse(JSONResponse):
+    """JSON response rendered with the shared JSON codec."""
+
+    def render(self, content: Any) -> bytes:
+        return json_codec.dumps_bytes(content)
+
+
+def json_response(body: Dict[str, Any], status_code: int = 200) -> Response:
+    return CodecJSONResponse(body, status_code=status_code)
+
+
+async def read_body(request: Request, limit: int) -> Optional[bytes]:
+    """Read the request body, or return None as soon as it exceeds `limit` bytes."""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        return None
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def webhook(request: Request) -> Response:
+    """
+    Main webhook endpoint for Meta platforms.
+    Handles both verification and message processing.
+    """
+    if request.method == "GET":
+        verify_token = request.query_params.get("hub.verify_token")
+        challenge = request.query_params.get("hub.challenge")
+        if not verify_token or not challenge:
+            logger.warning("Missing verification parameters")
+            return json_response({"error": "Bad request", "signature": "8598"}, 400)
+        try:
+            return PlainTextResponse(webhook_handler.handle_verification(verify_token, challenge))
+        except Unauthorized:
+            return json_response({"error": "Unauthorized", "signature": "8598"}, 401)
+
+    # Shed load before reading the body or touching the database
+    if not webhook_shedder.try_acquire():
+        logger.warning(f"Webhook shed - In flight: {webhook_shedder.in_flight}")
+        retry_after = webhook_shedder.retry_after
+        return CodecJSONResponse(
+            {"error": "Overloaded", "retry_after": retry_after, "signature": "8598"},
+            status_code=503,
+            headers={"Retry-After": str(retry_after)}
+        )
+    trace = webhook_stage_metrics.start()
+    try:
+        return await receive_webhook(request)
+    finally:
+        webhook_shedder.release()
+        finish_stage_trace(trace)
+
+
+async def receive_webhook(request: Request) -> Response:
+    """Verify, parse and process (or spool) one webhook delivery."""
+    arrived_at = time.time()
+    try:
+        # Reject oversized and forged bodies on the raw bytes, before any parsing
+        with stage("read_body"):
+            body = await read_body(request, config.webhook.max_body_bytes)
+        if body is None:
+            logger.warning(f"Webhook payload too large - Content-Length: {request.headers.get('content-length')}")
+            return json_response({"error": "Payload too large", "signature": "8598"}, 413)
+
+        with stage("verify_signature"):
+            verified = webhook_handler.verify_signature(body, request.headers.get("X-Hub-Signature-256"))
+        if not verified:
+            logger.warning("Webhook signature verification failed")
+            return json_response({"error": "Invalid signature", "signature": "8598"}, 401)
+
+        if webhook_capture is not None:
+            with stage("capture"):
+                webhook_capture.record(body, request.headers, arrived_at)
+
+        if not body:
+            logger.warning("Empty webhook payload")
+            return json_response({"error": "Empty payload", "signature": "8598"}, 400)
+
+        if ingest_spool is not None:
+            # Durably spool the raw body and ack before any parsing or DB work
+            with stage("spool_append"):
+                await asyncio.to_thread(ingest_spool.append, body)
+            return json_response({"status": "ok", "signature": "8598"})
+
+        try:
+            with stage("parse_json"):
+                data = json_codec.loads(body)
+        except ValueError:
+            return json_response({"error": "Invalid JSON", "signature": "8598"}, 400)
+        if not data or not isinstance(data, dict):
+            logger.warning("Empty webhook payload")
+            return json_response({"error": "Empty payload", "signature": "8598"}, 400)
+
+        logger.info(f"Received webhook data - Object: {data.get('object')}")
+
+        store: AsyncMessageService = request.app.state.store
+        records = webhook_handler.collect_records([data], resolve_agents=False)
+        if records:
+            with stage("resolve_agent"):
+                await store.assign_agents(records)
+            await store.log_messages(records)
+
+        return json_response({"status": "ok", "signature": "8598"})
+
+    except BadRequest as e:
+        logger.warning(f"Bad request: {e}")
+        return json_response({"error": str(e)}, 400)
+    except Exception as e:
+        logger.error(f"Webhook processing error: {e}")
+        return json_response({"error": "Internal server error"}, 500)
+
+
+async def send_message(request: Request) -> Response:
+    """
+    Send a WhatsApp message via Cloud API and log it as an outgoing message.
+    Expected JSON body: {"agent": "AgentName", "to": "+2547...", "text": "..."}
+    """
+    try:
+        try:
+            data = json_codec.loads(await request.body())
+        except ValueError:
+            return json_response({"error": "Bad request", "signature": "8598"}, 400)
+
+        fields, status = validate_send_request(data if isinstance(data, dict) else None)
+        if status != 200:
+            return json_response(fields, status)
+
+        store: AsyncMessageService = request.app.state.store
+        registry = get_agent_registry()
+        if registry.stale():
+            # Version check (and reload when it moved) on the async driver, off the loop
+            await store.run_sync(registry.sync)
+        error = check_agent_initials(fields["initials"], fields["agent"])
+        if error:
+            return json_response(error, 400)
+
+        blocklist = get_blocklist()
+        if blocklist.stale():
+            await store.run_sync(blocklist.sync)
+        # Filter hits only: the exact check is one indexed lookup
+        if blocklist.might_block(fields["to"]) and await store.run_sync(blocklist.confirm, fields["to"]):
+            return json_response(OPTED_OUT, 403)
+
+        window = get_service_window()
+        if window.stale():
+            await store.run_sync(window.sync)
+        payload = send_payload(fields)
+        if payload is None:
+            return json_response(OUTSIDE_WINDOW, 422)
+        url, headers, _ = whatsapp_text_request(fields["to"], fields["text"])
+        record = sent_message_record(fields, None, status="queued", payload=payload)
+        if config.outbound.mode == "queue":
+            message = await asyncio.to_thread(enqueue_send, record, payload)
+            return json_response({"status": "queued", "id": message.id, "type": payload["type"], "signature": "8598"}, 202)
+
+        # Commit the message and its outbox row, then call the WhatsApp Cloud API
+        claim = await asyncio.to_thread(enqueue_claimed, record, payload)
+        client: AsyncGraphClient = request.app.state.http
+        batcher = get_graph_batcher()
+        try:
+            if batcher is not None:
+                resp = await asyncio.wait_for(asyncio.wrap_future(batcher.submit(
+                    f"{config.whatsapp.phone_id}/messages", payload, token=config.whatsapp.access_token
+                )), batcher.result_timeout)
+            else:
+                resp = await client.post(url, payload, headers=headers)
+            result = SendResult(claim, message_id=parse_send_response("WhatsApp", resp.status_code, resp.text))
+        except Exception as e:
+            # Read timeouts may have reached Meta and are not resent, as on the sync path
+            error = SendError.from_transport_error("WhatsApp", e)
+            result = SendResult(claim, error=str(error), permanent=error.permanent, deferred=error.deferred,
+                                indeterminate=error.indeterminate)
+        await asyncio.to_thread(record_direct_send, result)
+        body, status = send_outcome(result)
+        return json_response(dict(body, type=payload["type"]), status)
+
+    except Exception as e:
+        logger.error(f"/send error: {e}")
+        return json_response({"error": "internal_error", "signature": "8598"}, 500)
+
+
+async def health_check(request: Request) -> Response:
+    """
+    Health check endpoint for monitoring.
+    """
+    try:
+        db_healthy = await request.app.state.store.health_check()
+        details = health_details(db_healthy)
+        details["server"] = "asgi"
+        return json_response(details, 200 if db_healthy else 503)
+    except Exception as e:
+        logger.error(f"Health check error: {e}")
+        return json_response({"status": "unhealthy", "error": str(e), "signature": "8598"}, 503)
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    await asyncio.to_thread(init_database)
+    await asyncio.to_thread(get_service_window().refresh, True)
+    await asyncio.to_thread(get_blocklist().refresh, True)
+    app.state.store = AsyncMessageService()
+    app.state.http = AsyncGraphClient()
+    logger.info("ASGI webhook service started - Signature: 8598")
+    try:
+        yield
+    finally:
+        await app.state.http.aclose()
+        await app.state.store.close()
+
+
+app = Starlette(
+    routes=[
+        Route("/webhook", webhook, methods=["GET", "POST"]),
+        Route("/send", send_message, methods=["POST"]),
+        Route("/health", health_check, methods=["GET"]),
+        # Reports, team management and the home page are served by the Flask app
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    logger.info("Starting HCTC-CRM ASGI Webhook Server - Signature: 8598")
+    uvicorn.run(app, host=config.webhook.host, port=config.webhook.port)
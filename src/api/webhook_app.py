@@ -7,52 +7,39 @@ with comprehensive error handling, logging, and security features.
 """
 
 from flask import Flask, request, jsonify, abort, send_file
-from werkzeug.exceptions import BadRequest, Unauthorized, InternalServerError
+from werkzeug.exceptions import BadRequest, Unauthorized, InternalServerError, RequestEntityTooLarge
+import atexit
 import logging
 import json
 import hashlib
 import hmac
 import time
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, timezone
+from time import perf_counter_ns
 
 from ..config import config
-from ..services import get_message_service
+from ..services import get_message_service, get_status_coalescer, IngestSpool, SpoolWorkerPool, CaptureWriter
+from ..services import GraphMediaClient, MediaStore, MediaResolverPool, get_media_asset
+from ..services import (
+    GraphOutboundSender, OutboundWorkerPool, SendResult, enqueue_claimed, enqueue_send, get_outbound_send
+)
+from ..services.agent_registry import INITIALS_VERSION, bump_version, get_agent_registry
+from ..services.campaign_service import CampaignRunner, get_campaign_service, iter_csv_numbers
+from ..services.graph_batch import get_graph_batcher
+from ..services.graph_client import get_graph_client, graph_url
+from ..services.service_window import get_service_window
+from ..services.blocklist import get_blocklist
+from ..services.extraction import (
+    PayloadExtractor, InboundMessage, StatusUpdate, WHATSAPP_OBJECT, FACEBOOK_OBJECT
+)
 from ..utils.logging import setup_logging
 from ..utils.security import validate_webhook_signature, sanitize_input
 from ..utils.security import is_valid_phone_number
-from ..utils.validators import validate_whatsapp_payload, validate_facebook_payload
 from ..utils import extract_initials_and_strip
-@app.route('/team/initials', methods=['POST'])
-def register_initials():
-    """Register or update initials mapping. JSON: {initials, agent}
-    Enforces uniqueness for both initials and agent.
-    """
-    try:
-        from ..database import get_db_session, AgentInitial
-        data = request.get_json(force=True)
-        initials = (data.get('initials') or '').strip().upper()
-        agent = (data.get('agent') or '').strip()
-        if not initials or not agent:
-            return jsonify({"error": "initials and agent required", "signature": "8598"}), 400
-        with get_db_session() as s:
-            # Ensure neither initials nor agent is already taken by someone else
-            existing_i = s.query(AgentInitial).filter(AgentInitial.initials == initials).first()
-            if existing_i and existing_i.agent != agent:
-                return jsonify({"error": "initials_taken", "by": existing_i.agent, "signature": "8598"}), 409
-            existing_a = s.query(AgentInitial).filter(AgentInitial.agent == agent).first()
-            if existing_a and existing_a.initials != initials:
-                return jsonify({"error": "agent_already_has_initials", "initials": existing_a.initials, "signature": "8598"}), 409
-            if existing_i:
-                existing_i.agent = agent
-            elif existing_a:
-                existing_a.initials = initials
-            else:
-                s.add(AgentInitial(initials=initials, agent=agent))
-        return jsonify({"status": "ok", "signature": "8598"}), 200
-    except Exception as e:
-        logger.error(f"/team/initials error: {e}")
-        return jsonify({"error": "internal_error", "signature": "8598"}), 500
+from ..utils.json_codec import CodecJSONProvider
+from ..utils.backpressure import LoadShedder
+from ..utils.metrics import StageMetrics, stage, add_stage
 
 # Setup logging
 setup_logging()
@@ -60,6 +47,7 @@ logger = logging.getLogger(__name__)
 
 # Create Flask application
 app = Flask(__name__)
+app.json = CodecJSONProvider(app)
 app.secret_key = config.webhook.secret_key
 
 # Disable Flask's default logging to use our custom logger
@@ -75,6 +63,8 @@ class WebhookHandler:
     
     def __init__(self):
         self.message_service = get_message_service()
+        self.status_coalescer = get_status_coalescer()
+        self.extractor = PayloadExtractor(skip=self.message_service.is_known_message)
         self.signature = "8598"
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
     
@@ -106,6 +96,95 @@ class WebhookHandler:
             self.logger.error(f"Webhook verification error: {e}")
             raise Unauthorized("Verification failed")
     
+    def verify_signature(self, body: bytes, signature: Optional[str]) -> bool:
+        """
+        Verify Meta's X-Hub-Signature-256 header against the raw request body.
+        
+        Verification is skipped when no app secret is configured or when
+        WEBHOOK_REQUIRE_SIGNATURE is false.
+        """
+        secret = config.facebook.app_secret
+        if not secret or not config.webhook.require_signature:
+            return True
+        return validate_webhook_signature(body, signature, secret)
+    
+    def handle_payload(self, data: Dict[str, Any]) -> None:
+        """
+        Route a webhook payload to the platform-specific handler.
+        
+        Args:
+            data: Decoded webhook payload
+            
+        Raises:
+            BadRequest: If the object type is unknown or the payload is invalid
+        """
+        self.handle_payloads([data])
+    
+    def handle_payloads(self, payloads: List[Dict[str, Any]], apply_statuses: bool = False) -> int:
+        """
+        Extract messages from one or more webhook payloads and persist them
+        with a single batched call.
+        
+        Args:
+            payloads: Decoded webhook payloads
+            apply_statuses: Write status callbacks before returning instead of
+                buffering them in the coalescer
+            
+        Returns:
+            int: Number of messages written
+            
+        Raises:
+            BadRequest: If any payload is invalid
+        """
+        records = self.collect_records(payloads, apply_statuses=apply_statuses)
+        if not records:
+            return 0
+        return self.message_service.log_messages(records)
+    
+    def collect_records(self, payloads: List[Dict[str, Any]], resolve_agents: bool = True,
+                        apply_statuses: bool = False) -> List[InboundMessage]:
+        """
+        Extract message records from webhook payloads and hand their status
+        callbacks to the coalescer. Nothing is written to the messages table.
+        
+        Args:
+            payloads: Decoded webhook payloads
+            resolve_agents: Resolve handling agents now; when False records
+                that need one carry agent=None for the caller to fill in
+            apply_statuses: Write status callbacks now instead of handing
+                them to the coalescer
+            
+        Raises:
+            BadRequest: If any payload is invalid
+        """
+        records: List[InboundMessage] = []
+        statuses: List[StatusUpdate] = []
+        for data in payloads:
+            self._extract_into(data, records, statuses)
+        self._finish_records(records, resolve_agents)
+        
+        # Status callbacks are coalesced and written in the background
+        if statuses and apply_statuses:
+            with stage("status_apply"):
+                self.status_coalescer.apply(statuses)
+        elif statuses:
+            with stage("status_submit"):
+                self.status_coalescer.submit(statuses)
+        return records
+    
+    def extract_records(self, data: Dict[str, Any], resolve_agents: bool = True) -> List[InboundMessage]:
+        """
+        Extract message records from a webhook payload without persisting them.
+        Status callbacks in the payload are ignored.
+        
+        Raises:
+            BadRequest: If the object type is unknown or the payload is invalid
+        """
+        records: List[InboundMessage] = []
+        self._extract_into(data, records, [])
+        self._finish_records(records, resolve_agents)
+        return records
+    
     def handle_whatsapp_message(self, data: Dict[str, Any]) -> None:
         """
         Handle incoming WhatsApp message.
@@ -116,22 +195,8 @@ class WebhookHandler:
         Raises:
             BadRequest: If payload is invalid
         """
-        try:
-            # Validate payload structure
-            if not validate_whatsapp_payload(data):
-                raise BadRequest("Invalid WhatsApp payload structure")
-            
-            entry = data["entry"][0]
-            changes = entry["changes"]
-            
-            for change in changes:
-                if change["value"].get("messages"):
-                    for message in change["value"]["messages"]:
-                        self._process_whatsapp_message(message, change["value"])
-                        
-        except Exception as e:
-            self.logger.error(f"Error processing WhatsApp message: {e}")
-            raise
+        self._require_object(data, WHATSAPP_OBJECT)
+        self.handle_payloads([data])
     
     def handle_facebook_message(self, data: Dict[str, Any]) -> None:
         """
@@ -143,151 +208,222 @@ class WebhookHandler:
         Raises:
             BadRequest: If payload is invalid
         """
-        try:
-            # Validate payload structure
-            if not validate_facebook_payload(data):
-                raise BadRequest("Invalid Facebook payload structure")
-            
-            entry = data["entry"][0]
-            
-            if "messaging" in entry:
-                for messaging_event in entry["messaging"]:
-                    self._process_facebook_message(messaging_event)
-                    
-        except Exception as e:
-            self.logger.error(f"Error processing Facebook message: {e}")
-            raise
+        self._require_object(data, FACEBOOK_OBJECT)
+        self.handle_payloads([data])
     
-    def _process_whatsapp_message(self, message: Dict[str, Any], value: Dict[str, Any]) -> None:
-        """Process individual WhatsApp message."""
-        try:
-            sender = message["from"]
-            timestamp = message["timestamp"]
-            message_id = message.get("id")
-            
-            # Extract message content based on type
-            if message["type"] == "text":
-                content = message["text"]["body"]
-                message_type = "text"
-            elif message["type"] == "image":
-                content = f"[Image message] ID: {message['image']['id']}"
-                message_type = "image"
-            elif message["type"] == "document":
-                content = f"[Document] {message['document'].get('filename', 'Unknown')}"
-                message_type = "document"
-            elif message["type"] == "audio":
-                content = "[Audio message]"
-                message_type = "audio"
-            elif message["type"] == "video":
-                content = "[Video message]"
-                message_type = "video"
-            else:
-                content = f"[{message['type'].title()} message]"
-                message_type = message["type"]
-            
-            # Resolve handling agent for incoming based on conversation
-            handling_agent = self.message_service.resolve_incoming_agent(sender, "WhatsApp")
-
-            # Prepare extra data
-            extra_data = {
-                "phone_number_id": value.get("metadata", {}).get("phone_number_id"),
-                "display_phone_number": value.get("metadata", {}).get("display_phone_number"),
-                "message_type": message["type"]
-            }
-            
-            # Log message
-            self.message_service.log_message(
-                agent=handling_agent,
-                platform="WhatsApp",
-                recipient=sender,
-                content=sanitize_input(content),
-                message_type=message_type,
-                message_id=message_id,
-                sender_id=sender,
-                is_incoming=True,
-                status="received",
-                extra_data=extra_data
-            )
-            
-            self.logger.info(f"WhatsApp message processed - From: {sender}, Type: {message_type}")
-            
-        except Exception as e:
-            self.logger.error(f"Error processing individual WhatsApp message: {e}")
-            raise
+    def _require_object(self, data: Dict[str, Any], expected: str) -> None:
+        if not isinstance(data, dict):
+            raise BadRequest("Webhook payload is not a JSON object")
+        if data.get("object") != expected:
+            raise BadRequest(f"Unknown object type: {data.get('object')}")
     
-    def _process_facebook_message(self, messaging_event: Dict[str, Any]) -> None:
-        """Process individual Facebook Messenger message."""
+    def _extract_into(self, data: Dict[str, Any], records: List[InboundMessage], statuses: List[StatusUpdate]) -> None:
+        """Run the single-pass extractor over one payload, timed as the extract stage."""
+        before = len(records)
         try:
-            sender = messaging_event["sender"]["id"]
-            timestamp = messaging_event["timestamp"]
-            
-            if "message" in messaging_event:
-                message = messaging_event["message"]
-                message_id = message.get("mid")
-                
-                if "text" in message:
-                    content = message["text"]
-                    message_type = "text"
-                elif "attachments" in message:
-                    content = f"[Attachment] Type: {message['attachments'][0]['type']}"
-                    message_type = "attachment"
-                else:
-                    content = "[Unknown message type]"
-                    message_type = "unknown"
-                
-                # Resolve handling agent based on conversation
-                handling_agent = self.message_service.resolve_incoming_agent(sender, "Facebook")
-
-                # Prepare extra data
-                extra_data = {
-                    "recipient_id": messaging_event.get("recipient", {}).get("id"),
-                    "message_type": message_type
-                }
-                
-                # Log message
-                self.message_service.log_message(
-                    agent=handling_agent,
-                    platform="Facebook",
-                    recipient=sender,
-                    content=sanitize_input(content),
-                    message_type=message_type,
-                    message_id=message_id,
-                    sender_id=sender,
-                    is_incoming=True,
-                    status="received",
-                    extra_data=extra_data
-                )
-                
-                self.logger.info(f"Facebook message processed - From: {sender}, Type: {message_type}")
-                
-            elif "postback" in messaging_event:
-                # Handle postback events
-                postback = messaging_event["postback"]
-                content = f"[Postback] {postback['title']}: {postback['payload']}"
-                
-                self.message_service.log_message(
-                    agent="Agent1",
-                    platform="Facebook",
-                    recipient=sender,
-                    content=sanitize_input(content),
-                    message_type="postback",
-                    message_id=postback.get("mid"),
-                    sender_id=sender,
-                    is_incoming=True,
-                    status="received",
-                    extra_data={"postback_title": postback['title'], "postback_payload": postback['payload']}
-                )
-                
-                self.logger.info(f"Facebook postback processed - From: {sender}")
-                
+            with stage("extract"):
+                self.extractor.extract_into(data, records, statuses)
+        except ValueError as e:
+            self.logger.warning(f"Rejected webhook payload: {e}")
+            raise BadRequest(str(e))
         except Exception as e:
-            self.logger.error(f"Error processing individual Facebook message: {e}")
+            kind = data.get("object") if isinstance(data, dict) else type(data).__name__
+            self.logger.error(f"Error processing {kind} payload: {e}")
             raise
+        self.logger.info(
+            f"Webhook payload processed - Object: {data.get('object')}, "
+            f"Entries: {len(data['entry'])}, Messages: {len(records) - before}"
+        )
+    
+    def _finish_records(self, records: List[InboundMessage], resolve_agents: bool) -> None:
+        """Sanitize content and, if asked, resolve the handling agent of each record."""
+        for record in records:
+            record.content = self._sanitize(record.content)
+            if resolve_agents and record.agent is None:
+                record.agent = self._resolve_agent(record.sender, record.platform)
+    
+    def _resolve_agent(self, sender: str, platform: str) -> str:
+        """resolve_incoming_agent, timed as the resolve_agent stage."""
+        started = perf_counter_ns()
+        agent = self.message_service.resolve_incoming_agent(sender, platform)
+        add_stage("resolve_agent", perf_counter_ns() - started)
+        return agent
+    
+    def _sanitize(self, content: str) -> str:
+        """sanitize_input, timed as the sanitize stage."""
+        started = perf_counter_ns()
+        content = sanitize_input(content)
+        add_stage("sanitize", perf_counter_ns() - started)
+        return content
 
 
 # Initialize webhook handler
 webhook_handler = WebhookHandler()
 
+# In spool mode /webhook only persists the raw body; workers do the rest
+ingest_spool: Optional[IngestSpool] = None
+spool_workers: Optional[SpoolWorkerPool] = None
+if config.ingest.mode == "spool":
+    ingest_spool = IngestSpool(config.ingest.spool_path)
+    spool_workers = SpoolWorkerPool(
+        ingest_spool,
+        # Statuses are written before the batch is acked, not buffered in memory
+        lambda payloads: webhook_handler.handle_payloads(payloads, apply_statuses=True),
+        workers=config.ingest.workers,
+        batch_size=config.ingest.batch_size,
+        poll_interval=config.ingest.poll_interval,
+        lease_seconds=config.ingest.lease_seconds,
+        max_attempts=config.ingest.max_attempts
+    )
+    spool_workers.start()
+
+# Optional raw traffic capture for replay (see benchmarks/replay_capture.py)
+webhook_capture: Optional[CaptureWriter] = None
+if config.ingest.capture_dir:
+    webhook_capture = CaptureWriter(
+        config.ingest.capture_dir,
+        segment_bytes=config.ingest.capture_segment_bytes,
+        segment_seconds=config.ingest.capture_segment_seconds
+    )
+    atexit.register(webhook_capture.close)
+
+# Media downloads run in the background, off the /webhook request path
+media_workers: Optional[MediaResolverPool] = None
+if config.media.enabled:
+    media_workers = MediaResolverPool(
+        MediaStore(config.media.store_dir),
+        GraphMediaClient(),
+        workers=config.media.workers,
+        batch_size=config.media.batch_size,
+        poll_interval=config.media.poll_interval,
+        lease_seconds=config.media.lease_seconds,
+        max_attempts=config.media.max_attempts,
+        max_bytes=config.media.max_bytes
+    )
+    media_workers.start()
+
+# Outbox relay: delivers queued sends under per-sender rate limits and picks up
+# rows whose /send request died before recording the outcome
+outbound_workers = OutboundWorkerPool(
+    GraphOutboundSender(),
+    workers=config.outbound.workers,
+    batch_size=config.outbound.batch_size,
+    poll_interval=config.outbound.poll_interval,
+    lease_seconds=config.outbound.lease_seconds,
+    max_attempts=config.outbound.max_attempts,
+    retry_backoff=config.outbound.retry_backoff,
+    retry_backoff_max=config.outbound.retry_backoff_max
+)
+if config.outbound.relay or config.outbound.mode == "queue":
+    outbound_workers.start()
+
+# Campaign sends run in the background; pick up campaigns left running by a restart
+campaign_runner = CampaignRunner(
+    GraphOutboundSender(),
+    chunk_size=config.campaign.chunk_size,
+    lease_seconds=config.campaign.lease_seconds,
+    max_attempts=config.campaign.max_attempts,
+    retry_backoff=config.campaign.retry_backoff,
+    retry_backoff_max=config.campaign.retry_backoff_max
+)
+try:
+    campaign_runner.resume_running()
+except Exception as e:
+    # e.g. tables not created yet on a fresh database; nothing can be running then
+    logger.warning(f"Could not resume running campaigns: {type(e).__name__}")
+
+# Load open customer-service windows now rather than on the first /send
+try:
+    get_service_window().refresh(force=True)
+except Exception as e:
+    logger.warning(f"Could not warm the service window index: {type(e).__name__}")
+
+# Load the opt-out filter now rather than on the first send
+try:
+    get_blocklist().refresh(force=True)
+except Exception as e:
+    logger.warning(f"Could not load the opt-out blocklist: {type(e).__name__}")
+
+# Bounded in-flight /webhook work; past the high-water mark requests get 503 + Retry-After
+webhook_shedder = LoadShedder(
+    high_water=config.webhook.max_in_flight,
+    retry_after=config.webhook.retry_after,
+    queue_depth=(lambda: ingest_spool.depth()["pending"]) if ingest_spool is not None else None,
+    queue_high_water=config.ingest.spool_high_water
+)
+
+
+# Per-stage latency histograms of /webhook requests
+webhook_stage_metrics = StageMetrics(enabled=config.webhook.stage_timing)
+
+
+def finish_stage_trace(trace) -> None:
+    """Fold a finished /webhook trace into the histograms and optionally log it."""
+    trace = webhook_stage_metrics.finish(trace)
+    if trace is not None and config.webhook.log_stage_timings:
+        logger.info("Webhook stage timings", extra={"extra_data": {"stages_us": trace.as_micros()}})
+
+
+def overloaded_response():
+    """503 telling Meta to retry the delivery later."""
+    response = jsonify({"error": "Overloaded", "retry_after": webhook_shedder.retry_after, "signature": "8598"})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(webhook_shedder.retry_after)
+    return response
+
+
+def receive_webhook():
+    """Verify, parse and process (or spool) one webhook delivery."""
+    arrived_at = time.time()
+    try:
+        # Reject oversized and forged bodies on the raw bytes, before any parsing
+        request.max_content_length = config.webhook.max_body_bytes
+        try:
+            with stage("read_body"):
+                body = request.get_data()
+        except RequestEntityTooLarge:
+            logger.warning(f"Webhook payload too large - Content-Length: {request.content_length}")
+            return jsonify({"error": "Payload too large", "signature": "8598"}), 413
+        
+        with stage("verify_signature"):
+            verified = webhook_handler.verify_signature(body, request.headers.get("X-Hub-Signature-256"))
+        if not verified:
+            logger.warning("Webhook signature verification failed")
+            return jsonify({"error": "Invalid signature", "signature": "8598"}), 401
+        
+        if webhook_capture is not None:
+            with stage("capture"):
+                webhook_capture.record(body, request.headers, arrived_at)
+        
+        if ingest_spool is not None:
+            # Durably spool the raw body and ack before any parsing or DB work
+            if not body:
+                logger.warning("Empty webhook payload")
+                abort(400, "Empty payload")
+            with stage("spool_append"):
+                ingest_spool.append(body)
+            return jsonify({"status": "ok", "signature": "8598"}), 200
+        
+        with stage("parse_json"):
+            data = request.get_json()
+        if not data:
+            logger.warning("Empty webhook payload")
+            abort(400, "Empty payload")
+        
+        logger.info(f"Received webhook data - Object: {data.get('object')}")
+        
+        # Route to appropriate handler
+        webhook_handler.handle_payload(data)
+        
+        return jsonify({"status": "ok", "signature": "8598"}), 200
+        
+    except BadRequest as e:
+        logger.warning(f"Bad request: {e}")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Webhook processing error: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
 
 @app.route('/webhook', methods=['GET', 'POST'])
 def webhook():
@@ -308,38 +444,89 @@ def webhook():
             return webhook_handler.handle_verification(verify_token, challenge)
         
         elif request.method == 'POST':
-            # Message processing
+            # Shed load before reading the body or touching the database
+            if not webhook_shedder.try_acquire():
+                logger.warning(f"Webhook shed - In flight: {webhook_shedder.in_flight}")
+                return overloaded_response()
+            trace = webhook_stage_metrics.start()
             try:
-                data = request.get_json()
-                if not data:
-                    logger.warning("Empty webhook payload")
-                    abort(400, "Empty payload")
-                
-                logger.info(f"Received webhook data - Object: {data.get('object')}")
-                
-                # Route to appropriate handler
-                if data.get("object") == "whatsapp_business_account":
-                    webhook_handler.handle_whatsapp_message(data)
-                elif data.get("object") == "page":
-                    webhook_handler.handle_facebook_message(data)
-                else:
-                    logger.warning(f"Unknown webhook object type: {data.get('object')}")
-                    abort(400, f"Unknown object type: {data.get('object')}")
-                
-                return jsonify({"status": "ok", "signature": "8598"}), 200
-                
-            except BadRequest as e:
-                logger.warning(f"Bad request: {e}")
-                return jsonify({"error": str(e)}), 400
-            except Exception as e:
-                logger.error(f"Webhook processing error: {e}")
-                return jsonify({"error": "Internal server error"}), 500
+                return receive_webhook()
+            finally:
+                webhook_shedder.release()
+                finish_stage_trace(trace)
     
     except Exception as e:
         logger.error(f"Webhook endpoint error: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
 
+@app.route('/team/initials', methods=['POST'])
+def register_initials():
+    """Register or update initials mapping. JSON: {initials, agent}
+    Enforces uniqueness for both initials and agent.
+    """
+    try:
+        from ..database import get_db_session, AgentInitial
+        data = request.get_json(force=True)
+        initials = (data.get('initials') or '').strip().upper()
+        agent = (data.get('agent') or '').strip()
+        if not initials or not agent:
+            return jsonify({"error": "initials and agent required", "signature": "8598"}), 400
+        with get_db_session() as s:
+            # Ensure neither initials nor agent is already taken by someone else
+            existing_i = s.query(AgentInitial).filter(AgentInitial.initials == initials).first()
+            if existing_i and existing_i.agent != agent:
+                return jsonify({"error": "initials_taken", "by": existing_i.agent, "signature": "8598"}), 409
+            existing_a = s.query(AgentInitial).filter(AgentInitial.agent == agent).first()
+            if existing_a and existing_a.initials != initials:
+                return jsonify({"error": "agent_already_has_initials", "initials": existing_a.initials, "signature": "8598"}), 409
+            if existing_i:
+                existing_i.agent = agent
+            elif existing_a:
+                existing_a.initials = initials
+            else:
+                s.add(AgentInitial(initials=initials, agent=agent))
+            # Other processes reload their registry when they see the new version
+            bump_version(s, INITIALS_VERSION)
+            s.commit()
+        get_agent_registry().invalidate()
+        return jsonify({"status": "ok", "signature": "8598"}), 200
+    except Exception as e:
+        logger.error(f"/team/initials error: {e}")
+        return jsonify({"error": "internal_error", "signature": "8598"}), 500
+
+
+def health_details(db_healthy: bool) -> Dict[str, Any]:
+    """Build the /health body. Shared by the Flask and ASGI services."""
+    health_status = {
+        "status": "healthy" if db_healthy else "unhealthy",
+        "service": "HCTC-CRM Webhook",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "version": "2.0.0",
+        "signature": "8598",
+        "database": "connected" if db_healthy else "disconnected",
+        "ingest": {"mode": config.ingest.mode},
+        "caches": get_message_service().get_cache_stats(),
+        "statuses": get_status_coalescer().stats(),
+        "backpressure": webhook_shedder.stats(),
+        "graph": get_graph_client().stats()
+    }
+    if get_graph_batcher() is not None:
+        health_status["graph"]["batch"] = get_graph_batcher().stats()
+    if webhook_capture is not None:
+        health_status["ingest"]["capture"] = webhook_capture.stats()
+    if ingest_spool is not None:
+        health_status["ingest"]["spool"] = ingest_spool.depth()
+    if media_workers is not None:
+        health_status["media"] = media_workers.stats()
+    health_status["outbound"] = outbound_workers.stats()
+    health_status["initials"] = get_agent_registry().stats()
+    health_status["service_window"] = get_service_window().stats()
+    health_status["opt_outs"] = get_blocklist().stats()
+    health_status["campaigns"] = campaign_runner.stats()
+    return health_status
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """
@@ -350,17 +537,8 @@ def health_check():
         from ..database import db_manager
         db_healthy = db_manager.health_check()
         
-        health_status = {
-            "status": "healthy" if db_healthy else "unhealthy",
-            "service": "HCTC-CRM Webhook",
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "version": "2.0.0",
-            "signature": "8598",
-            "database": "connected" if db_healthy else "disconnected"
-        }
-        
         status_code = 200 if db_healthy else 503
-        return jsonify(health_status), status_code
+        return jsonify(health_details(db_healthy)), status_code
         
     except Exception as e:
         logger.error(f"Health check error: {e}")
@@ -371,6 +549,39 @@ def health_check():
         }), 503
 
 
+@app.route('/internal/webhook-stages', methods=['GET'])
+def webhook_stages():
+    """Per-stage /webhook latency histograms of this process. ?reset=true clears them after reading."""
+    stages = webhook_stage_metrics.snapshot()
+    if request.args.get('reset', '').lower() == 'true':
+        webhook_stage_metrics.reset()
+    return jsonify({
+        "enabled": webhook_stage_metrics.enabled,
+        "stages": stages,
+        "signature": "8598"
+    }), 200
+
+
+@app.route('/media/<path:message_id>', methods=['GET'])
+def message_media(message_id: str):
+    """
+    Downloaded media of an incoming message.
+    ?info=true returns the media record instead of the file.
+    """
+    try:
+        asset = get_media_asset(message_id)
+        if asset is None:
+            return jsonify({"error": "not_found", "signature": "8598"}), 404
+        path = asset.pop("storage_path")
+        if request.args.get('info', '').lower() == 'true' or asset["status"] != "stored":
+            status_code = 200 if asset["status"] in ("stored", "failed") else 202
+            return jsonify({"media": asset, "signature": "8598"}), status_code
+        return send_file(path, mimetype=asset["mime_type"] or "application/octet-stream")
+    except Exception as e:
+        logger.error(f"/media error: {e}")
+        return jsonify({"error": "internal_error", "signature": "8598"}), 500
+
+
 @app.route('/', methods=['GET'])
 def home():
     """
@@ -424,82 +635,387 @@ def home():
     """
 
 
+def validate_send_request(data: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], int]:
+    """
+    Validate a /send body and split the ^XX initials token off the text.
+    Shared by the Flask and ASGI services. An optional "template" (a name,
+    or {name, language?, components?}) is sent instead of the text when the
+    recipient is outside the customer-service window.
+    
+    Returns:
+        ({agent, to, text, initials, template}, 200) or (error body, 400)
+    """
+    agent = sanitize_input((data or {}).get('agent', ''))
+    to = sanitize_input((data or {}).get('to', ''))
+    text = (data or {}).get('text', '')
+    template = (data or {}).get('template')
+    if isinstance(template, str):
+        template = {"name": template}
+    if template is not None:
+        if not isinstance(template, dict) or not str(template.get('name') or '').strip():
+            return {"error": "template must be a name or {name, language?, components?}", "signature": "8598"}, 400
+        if template.get('components') is not None and not isinstance(template['components'], list):
+            return {"error": "template components must be a list", "signature": "8598"}, 400
+        template = {k: v for k, v in {
+            "name": str(template['name']).strip(),
+            "language": {"code": template.get('language') or "en_US"},
+            "components": template.get('components'),
+        }.items() if v is not None}
+
+    if not agent or not to or not text:
+        return {"error": "agent, to, and text are required", "signature": "8598"}, 400
+
+    if not is_valid_phone_number(to):
+        return {"error": "invalid phone number format (E.164)", "signature": "8598"}, 400
+
+    # Extract initials from content and strip token for sending/logging
+    cleaned_text, initials = extract_initials_and_strip(text)
+    if not initials:
+        return {"error": "initials_required", "message": "Prefix or suffix message with ^XX", "signature": "8598"}, 400
+
+    return {"agent": agent, "to": to, "text": cleaned_text, "initials": initials, "template": template}, 200
+
+
+def check_agent_initials(initials: str, agent: str) -> Optional[Dict[str, Any]]:
+    """
+    Enforce the initials mapping: initials must exist and map to agent.
+    Reads the in-memory registry. Returns an error body or None.
+    """
+    expected = get_agent_registry().agent_for(initials)
+    if not expected:
+        return {"error": "unknown_initials", "signature": "8598"}
+    if expected != agent:
+        return {"error": "initials_agent_mismatch", "expected_agent": expected, "signature": "8598"}
+    return None
+
+
+def whatsapp_text_request(to: str, text: str) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+    """Return (url, headers, payload) for a WhatsApp Cloud API text message."""
+    url = graph_url(f"{config.whatsapp.phone_id}/messages")
+    headers = {
+        "Authorization": f"Bearer {config.whatsapp.access_token}",
+        "Content-Type": "application/json",
+    }
+    payload = {
+        "messaging_product": "whatsapp",
+        "to": to.lstrip('+'),
+        "type": "text",
+        "text": {"body": text},
+    }
+    return url, headers, payload
+
+
+def send_payload(fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    WhatsApp payload for a validated /send: the free-form text while the
+    recipient's customer-service window is open, else the request's template.
+    Outside the window without a template the text is attempted, or None is
+    returned when SERVICE_WINDOW_ENFORCE is on.
+    """
+    if get_service_window().is_open(fields["to"]):
+        return whatsapp_text_request(fields["to"], fields["text"])[2]
+    if fields.get("template"):
+        return {"messaging_product": "whatsapp", "to": fields["to"].lstrip('+'), "type": "template",
+                "template": fields["template"]}
+    if config.window.enforce:
+        return None
+    return whatsapp_text_request(fields["to"], fields["text"])[2]
+
+
+OUTSIDE_WINDOW = {
+    "error": "outside_service_window",
+    "message": "The customer has not messaged in the last 24 hours; include a template",
+    "signature": "8598"
+}
+
+OPTED_OUT = {
+    "error": "recipient_opted_out",
+    "message": "The recipient has opted out of messages",
+    "signature": "8598"
+}
+
+
+def sent_message_record(fields: Dict[str, Any], message_id: Optional[str], status: str = "sent",
+                        payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Build the outgoing message record logged after a successful (or queued) /send."""
+    initials = fields["initials"]
+    extra_data = {"provider": "cloud_api", "agent_initials": initials} if initials else {"provider": "cloud_api"}
+    content, message_type = sanitize_input(fields["text"]), "text"
+    if payload is not None and payload.get("type") == "template":
+        name = payload["template"]["name"]
+        content, message_type = f"[Template] {name}", "template"
+        extra_data["template"] = name
+    return {
+        "agent": fields["agent"],
+        "platform": "WhatsApp",
+        "recipient": fields["to"],
+        "content": content,
+        "message_type": message_type,
+        "message_id": message_id,
+        "sender_id": None,
+        "is_incoming": False,
+        "status": status,
+        "extra_data": extra_data
+    }
+
+
+def record_direct_send(result: SendResult) -> SendResult:
+    """
+    Record the outcome of a send made inline by /send. Without a relay in
+    this process nothing would retry a row left queued, so a retryable
+    failure fails the send instead.
+    """
+    if result.error is not None and not result.indeterminate and not outbound_workers.running():
+        result.permanent, result.deferred = True, False
+    return outbound_workers.record([result])[0]
+
+
+def send_outcome(result: SendResult) -> Tuple[Dict[str, Any], int]:
+    """Response body and status of a direct-mode /send from its recorded SendResult."""
+    local_id = result.claim.message_pk
+    if result.status == "sent":
+        return {"status": "ok", "message_id": result.message_id, "id": local_id, "signature": "8598"}, 200
+    if result.status == "failed":
+        logger.error(f"WhatsApp send failed: {result.error}")
+        return {"error": "send_failed", "details": result.error, "id": local_id, "signature": "8598"}, 502
+    if result.status == "unconfirmed":
+        # Meta may have accepted it; sending again could deliver it twice
+        logger.warning(f"WhatsApp send unconfirmed: {result.error}")
+        return {"status": "unconfirmed", "id": local_id, "signature": "8598"}, 202
+    # Retryable failure (or the row was taken over): the relay delivers it
+    return {"status": "queued", "id": local_id, "signature": "8598"}, 202
+
+
 @app.route('/send', methods=['POST'])
 def send_message():
     """
     Send a WhatsApp message via Cloud API and log it as an outgoing message.
-    Expected JSON body: {"agent": "AgentName", "to": "+2547...", "text": "..."}
+    Expected JSON body: {"agent": "AgentName", "to": "+2547...", "text": "...", "template"?: ...}
+    The text goes out while the customer-service window is open, the template
+    once it has closed; the response's "type" says which was sent. Recipients
+    who opted out get 403.
+
+    The message is stored as 'queued' with an outbox row before Meta is
+    called. In direct mode the send happens inline: 200 on success, 202 if a
+    retryable failure left it to this process's relay (502 without one) or a timed-out response left it
+    'unconfirmed' (not resent). With SEND_MODE=queue 202 is
+    returned straight away. Poll GET /send/<id> for the outcome.
     """
     try:
         data = request.get_json(force=True, silent=False)
-        agent = sanitize_input((data or {}).get('agent', ''))
-        to = sanitize_input((data or {}).get('to', ''))
-        text = (data or {}).get('text', '')
+        fields, status = validate_send_request(data)
+        if status != 200:
+            return jsonify(fields), status
+
+        error = check_agent_initials(fields["initials"], fields["agent"])
+        if error:
+            return jsonify(error), 400
+
+        if get_blocklist().is_blocked(fields["to"]):
+            return jsonify(OPTED_OUT), 403
+        payload = send_payload(fields)
+        if payload is None:
+            return jsonify(OUTSIDE_WINDOW), 422
+        if config.outbound.mode == "queue":
+            message = enqueue_send(sent_message_record(fields, None, status="queued", payload=payload), payload)
+            return jsonify({"status": "queued", "id": message.id, "type": payload["type"], "signature": "8598"}), 202
+
+        # The message and its outbox row are committed before Meta is called, then
+        # sent inline over the shared keep-alive pool and the outcome recorded
+        claim = enqueue_claimed(sent_message_record(fields, None, status="queued", payload=payload), payload)
+        result = outbound_workers.deliver(claim)
+        record_direct_send(result)
+        body, status = send_outcome(result)
+        return jsonify(dict(body, type=payload["type"])), status
+
+    except Exception as e:
+        logger.error(f"/send error: {e}")
+        return jsonify({"error": "internal_error", "signature": "8598"}), 500
 
-        if not agent or not to or not text:
-            return jsonify({"error": "agent, to, and text are required", "signature": "8598"}), 400
 
-        if not is_valid_phone_number(to):
-            return jsonify({"error": "invalid phone number format (E.164)", "signature": "8598"}), 400
+@app.route('/send/<int:local_id>', methods=['GET'])
+def send_status(local_id: int):
+    """Outbox state of a message sent or queued by /send."""
+    send = get_outbound_send(local_id)
+    if send is None:
+        return jsonify({"error": "not_found", "signature": "8598"}), 404
+    return jsonify({"send": send, "signature": "8598"}), 200
 
-        # Extract initials from content and strip token for sending/logging
-        cleaned_text, initials = extract_initials_and_strip(text)
-        # Enforce initials mapping: initials must exist and map to agent
-        from ..database import get_db_session, AgentInitial
-        if not initials:
-            return jsonify({"error": "initials_required", "message": "Prefix or suffix message with ^XX", "signature": "8598"}), 400
-        with get_db_session() as s:
-            rec = s.query(AgentInitial).filter(AgentInitial.initials == initials).first()
-            if not rec:
-                return jsonify({"error": "unknown_initials", "signature": "8598"}), 400
-            if rec.agent != agent:
-                return jsonify({"error": "initials_agent_mismatch", "expected_agent": rec.agent, "signature": "8598"}), 400
-
-        # Call WhatsApp Cloud API
-        import requests
-        url = f"https://graph.facebook.com/v18.0/{config.whatsapp.phone_id}/messages"
-        headers = {
-            "Authorization": f"Bearer {config.whatsapp.access_token}",
-            "Content-Type": "application/json",
-        }
-        payload = {
-            "messaging_product": "whatsapp",
-            "to": to.lstrip('+'),
-            "type": "text",
-            "text": {"body": cleaned_text},
-        }
-
-        resp = requests.post(url, headers=headers, json=payload, timeout=20)
-        if resp.status_code >= 400:
-            logger.error(f"WhatsApp send failed: {resp.status_code} {resp.text}")
-            return jsonify({"error": "send_failed", "details": resp.text, "signature": "8598"}), 502
-
-        # Log outgoing message
+
+@app.route('/conversations/window', methods=['GET', 'POST'])
+def service_window_state():
+    """
+    Who is inside the customer-service window, answered from memory.
+    GET ?platform=WhatsApp&limit=500: recipients with an open window, soonest to close first.
+    POST {"recipients": [...], "platform"?}: open (with expiry) and closed among the given recipients.
+    """
+    try:
+        if request.method == 'GET':
+            platform = request.args.get('platform') or "WhatsApp"
+            limit = max(1, min(int(request.args.get('limit', 500)), 10000))
+            entries = get_service_window().open_recipients(platform, limit=limit)
+            return jsonify({
+                "platform": platform,
+                "open": [{"recipient": recipient, "expires_at": expires.isoformat()} for recipient, expires in entries],
+                "signature": "8598"
+            }), 200
+
+        data = request.get_json(force=True, silent=True)
+        recipients = data.get('recipients') if isinstance(data, dict) else None
+        if not isinstance(recipients, list) or len(recipients) > 10000:
+            return jsonify({"error": "recipients list (up to 10000) required", "signature": "8598"}), 400
+        platform = data.get('platform') or "WhatsApp"
+        state = get_service_window().lookup([str(r) for r in recipients], platform)
+        return jsonify({
+            "platform": platform,
+            "open": [{"recipient": r, "expires_at": expires.isoformat()} for r, expires in state.items() if expires],
+            "closed": [r for r, expires in state.items() if expires is None],
+            "signature": "8598"
+        }), 200
+    except ValueError:
+        return jsonify({"error": "invalid limit", "signature": "8598"}), 400
+    except Exception as e:
+        logger.error(f"/conversations/window error: {e}")
+        return jsonify({"error": "internal_error", "signature": "8598"}), 500
+
+
+@app.route('/optouts', methods=['POST'])
+def import_opt_outs():
+    """
+    Opt recipients out: JSON {"recipients": [...], "platform"?, "reason"?} or a
+    CSV body (text/csv, ?platform=&reason=) read like campaign recipient lists.
+    """
+    try:
+        if request.mimetype in ('text/csv', 'application/csv', 'text/plain'):
+            import io
+            numbers = iter_csv_numbers(io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline=''))
+            platform, reason, source = request.args.get('platform'), request.args.get('reason'), "import"
+        else:
+            data = request.get_json(force=True, silent=True)
+            numbers = (data or {}).get('recipients') if isinstance(data, dict) else None
+            if not isinstance(numbers, list):
+                return jsonify({"error": "recipients list or CSV body required", "signature": "8598"}), 400
+            platform, reason, source = data.get('platform'), data.get('reason'), "api"
+        if platform not in (None, "WhatsApp", "Facebook"):
+            return jsonify({"error": "platform must be WhatsApp or Facebook", "signature": "8598"}), 400
+        report = get_blocklist().add(numbers, platform or "WhatsApp", source=source, reason=reason)
+        return jsonify({"import": report, "signature": "8598"}), 200
+    except Exception as e:
+        logger.error(f"/optouts error: {e}")
+        return jsonify({"error": "internal_error", "signature": "8598"}), 500
+
+
+@app.route('/optouts/<recipient>', methods=['GET', 'DELETE'])
+def opt_out_state(recipient: str):
+    """Whether a recipient has opted out (?platform=WhatsApp); DELETE opts them back in."""
+    platform = request.args.get('platform') or "WhatsApp"
+    blocklist = get_blocklist()
+    if request.method == 'DELETE':
+        if not blocklist.remove(recipient, platform):
+            return jsonify({"error": "not_found", "signature": "8598"}), 404
+        return jsonify({"recipient": recipient, "opted_out": False, "signature": "8598"}), 200
+    return jsonify({"recipient": recipient, "opted_out": blocklist.is_blocked(recipient, platform),
+                    "signature": "8598"}), 200
+
+
+@app.route('/campaigns', methods=['POST'])
+def create_campaign():
+    """
+    Create a WhatsApp template campaign.
+    JSON: {name, agent, template, language?, components?, text?, concurrency?, recipients?: [...]}
+    With "text", recipients inside their customer-service window get the text instead of the template.
+    """
+    try:
+        data = request.get_json(force=True, silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "invalid JSON", "signature": "8598"}), 400
+        service = get_campaign_service()
         try:
-            message_id = (resp.json() or {}).get('messages', [{}])[0].get('id')
-        except Exception:
-            message_id = None
-
-        get_message_service().log_message(
-            agent=agent,
-            platform="WhatsApp",
-            recipient=to,
-            content=sanitize_input(cleaned_text),
-            message_type="text",
-            message_id=message_id,
-            sender_id=None,
-            is_incoming=False,
-            status="sent",
-            extra_data={"provider": "cloud_api", "agent_initials": initials} if initials else {"provider": "cloud_api"}
-        )
+            campaign = service.create_campaign(
+                data.get('name'), data.get('agent'), data.get('template'),
+                language_code=data.get('language') or "en_US",
+                components=data.get('components'),
+                concurrency=data.get('concurrency'),
+                text=data.get('text')
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e), "signature": "8598"}), 400
+        body = {"campaign": campaign, "signature": "8598"}
+        if data.get('recipients'):
+            body["import"] = service.add_recipients(campaign["id"], data['recipients'])
+        return jsonify(body), 201
+    except Exception as e:
+        logger.error(f"/campaigns error: {e}")
+        return jsonify({"error": "internal_error", "signature": "8598"}), 500
 
-        return jsonify({"status": "ok", "message_id": message_id, "signature": "8598"}), 200
 
+@app.route('/campaigns/<int:campaign_id>/recipients', methods=['POST'])
+def add_campaign_recipients(campaign_id: int):
+    """
+    Add recipients: JSON {"recipients": [...]} or a CSV body (text/csv),
+    streamed and imported in chunks. A header row naming a phone column
+    (phone, to, recipient, number, msisdn, wa_id) selects it; otherwise the
+    first column is used.
+    """
+    try:
+        if request.mimetype in ('text/csv', 'application/csv', 'text/plain'):
+            import io
+            numbers = iter_csv_numbers(io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline=''))
+        else:
+            data = request.get_json(force=True, silent=True)
+            numbers = (data or {}).get('recipients') if isinstance(data, dict) else None
+            if not isinstance(numbers, list):
+                return jsonify({"error": "recipients list or CSV body required", "signature": "8598"}), 400
+        try:
+            report = get_campaign_service().add_recipients(campaign_id, numbers)
+        except ValueError as e:
+            return jsonify({"error": str(e), "signature": "8598"}), 409
+        if report is None:
+            return jsonify({"error": "not_found", "signature": "8598"}), 404
+        return jsonify({"import": report, "signature": "8598"}), 200
     except Exception as e:
-        logger.error(f"/send error: {e}")
+        logger.error(f"/campaigns/{campaign_id}/recipients error: {e}")
         return jsonify({"error": "internal_error", "signature": "8598"}), 500
 
 
+@app.route('/campaigns/<int:campaign_id>/<action>', methods=['POST'])
+def campaign_action(campaign_id: int, action: str):
+    """Start, pause or resume a campaign."""
+    target = {"start": "running", "resume": "running", "pause": "paused"}.get(action)
+    if target is None:
+        return jsonify({"error": "unknown action", "signature": "8598"}), 404
+    service = get_campaign_service()
+    if not service.set_status(campaign_id, target):
+        progress = service.get_progress(campaign_id)
+        if progress is None:
+            return jsonify({"error": "not_found", "signature": "8598"}), 404
+        return jsonify({"error": f"cannot {action} a {progress['status']} campaign", "signature": "8598"}), 409
+    if target == "running":
+        campaign_runner.start(campaign_id)
+    return jsonify({"campaign": service.get_progress(campaign_id), "signature": "8598"}), 200
+
+
+@app.route('/campaigns/<int:campaign_id>', methods=['GET'])
+def campaign_progress(campaign_id: int):
+    """Campaign state with progress and throughput."""
+    progress = get_campaign_service().get_progress(campaign_id)
+    if progress is None:
+        return jsonify({"error": "not_found", "signature": "8598"}), 404
+    return jsonify({"campaign": progress, "signature": "8598"}), 200
+
+
+@app.route('/campaigns/<int:campaign_id>/recipients', methods=['GET'])
+def campaign_recipients(campaign_id: int):
+    """Per-recipient results. Query params: status, limit (max 1000), offset."""
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({"error": "invalid limit or offset", "signature": "8598"}), 400
+    recipients = get_campaign_service().get_recipients(campaign_id, request.args.get('status'), limit, offset)
+    return jsonify({"recipients": recipients, "count": len(recipients), "signature": "8598"}), 200
+
+
 @app.route('/reports/agent-daily-excel', methods=['GET'])
 def agent_daily_excel():
     """
@@ -517,7 +1033,6 @@ def agent_daily_excel():
         from ..database import get_db_session, Message
         from datetime import datetime, timedelta
         import pandas as pd
-        import json as _json
         from io import BytesIO
 
         agent_name = request.args.get('agent')
@@ -549,22 +1064,9 @@ def agent_daily_excel():
                 .all()
             )
 
-        # Determine initials and phone numbers
-        initials = None
-        phone_numbers = []
-        for m in rows:
-            if m.recipient and m.recipient not in phone_numbers:
-                phone_numbers.append(m.recipient)
-            if not initials and m.extra_data:
-                try:
-                    ed = _json.loads(m.extra_data)
-                    val = (ed or {}).get('agent_initials')
-                    if val:
-                        initials = val
-                except Exception:
-                    pass
-
-        display = f"{initials} {agent_name}".strip() if initials else agent_name
+        # Phone numbers handled, in first-contact order
+        phone_numbers = list(dict.fromkeys(m.recipient for m in rows if m.recipient))
+        display = get_agent_registry().display(agent_name)
         messages_handled = len(rows)
         phones_cell = "\n".join(phone_numbers)
 
@@ -51,6 +51,27 @@ class FacebookConfig:
     base_url: str = "https://graph.facebook.com"
 
 
+@dataclass
+class GraphConfig:
+    """Shared Graph API HTTP client settings."""
+    base_url: str = "https://graph.facebook.com"
+    api_version: str = "v18.0"
+    pool_size: int = 20  # keep-alive connections per host per process
+    connect_timeout: float = 3.05  # seconds
+    read_timeout: float = 20.0  # seconds
+    max_retries: int = 3  # on 429, 5xx and connection failures
+    backoff_base: float = 0.25  # seconds; full jitter up to base * 2**attempt
+    backoff_max: float = 8.0  # seconds
+    batch_window_ms: float = 0.0  # coalesce sends arriving within this window into batch requests; 0 disables
+    batch_max: int = 50  # requests per batch (Graph's limit)
+    batch_workers: int = 4  # concurrent batch requests
+    breaker_failures: int = 5  # consecutive failures that open an endpoint's circuit
+    breaker_open_seconds: float = 30.0  # fail fast this long before a trial call
+    concurrency_min: int = 2  # adaptive in-flight limit floor; the ceiling is pool_size
+    latency_target_ms: float = 3000.0  # slower calls shrink the in-flight limit
+    limit_wait: float = 2.0  # seconds a call waits for an in-flight slot before failing fast
+
+
 @dataclass
 class WebhookConfig:
     """Webhook configuration settings."""
@@ -59,6 +80,104 @@ class WebhookConfig:
     port: int = 5000
     host: str = "0.0.0.0"
     debug: bool = False
+    max_body_bytes: int = 1048576  # larger /webhook bodies are rejected unread
+    require_signature: bool = True  # enforced whenever META_APP_SECRET is set
+    max_in_flight: int = 32  # concurrent /webhook POSTs per process before shedding; 0 disables
+    retry_after: int = 1  # seconds, sent with 503 when shedding
+    stage_timing: bool = True  # per-stage /webhook latency histograms
+    log_stage_timings: bool = False  # attach each request's stage breakdown to its log line
+
+
+@dataclass
+class IngestConfig:
+    """Webhook ingestion pipeline settings."""
+    mode: str = "inline"  # inline | spool
+    spool_path: str = "webhook_spool.db"
+    workers: int = 2
+    batch_size: int = 50
+    poll_interval: float = 0.5  # seconds
+    lease_seconds: int = 60
+    max_attempts: int = 5
+    dedup_cache_size: int = 100000  # recently seen platform message ids
+    agent_cache_size: int = 50000  # (recipient, platform) -> handling agent
+    agent_cache_ttl: int = 300  # seconds
+    status_window: float = 1.0  # seconds status callbacks are coalesced for
+    status_batch_size: int = 500  # flush early once this many messages are pending
+    status_unmatched_ttl: float = 60.0  # seconds a status for an unknown message id is retried
+    spool_high_water: int = 50000  # pending spool bodies before /webhook sheds; 0 disables
+    capture_dir: str = ""  # record raw /webhook traffic here for replay; empty disables
+    capture_segment_bytes: int = 67108864  # rotate capture segments at 64MB uncompressed
+    capture_segment_seconds: int = 3600
+
+
+@dataclass
+class MediaConfig:
+    """Background media download settings."""
+    enabled: bool = False  # queue media messages for download at ingestion
+    store_dir: str = "media_store"  # content-addressed files, sharded by sha256
+    workers: int = 4  # concurrent downloads per process
+    batch_size: int = 10
+    poll_interval: float = 1.0  # seconds
+    lease_seconds: int = 300
+    max_attempts: int = 5
+    max_bytes: int = 104857600  # 100MB, the largest media Meta delivers
+
+
+@dataclass
+class OutboundConfig:
+    """Outgoing send queue settings."""
+    mode: str = "direct"  # direct (send inside /send) | queue (202 + background workers)
+    relay: bool = True  # run the outbox relay here (always in queue mode); without it direct /send fails retryable sends
+    workers: int = 4  # concurrent sends per process
+    batch_size: int = 20
+    poll_interval: float = 0.25  # seconds
+    lease_seconds: int = 60
+    max_attempts: int = 5
+    retry_backoff: float = 2.0  # seconds, doubled per attempt
+    retry_backoff_max: float = 300.0
+    whatsapp_rate: float = 80.0  # sends/second per phone number id, per process; 0 disables
+    whatsapp_burst: float = 8.0  # tokens banked; keep well under one second of rate
+    facebook_rate: float = 40.0  # sends/second per page id, per process; 0 disables
+    facebook_burst: float = 4.0
+
+
+@dataclass
+class CampaignConfig:
+    """Bulk template campaign settings."""
+    concurrency: int = 8  # default in-flight sends per campaign
+    max_concurrency: int = 32
+    chunk_size: int = 100  # recipients claimed and recorded per transaction
+    lease_seconds: int = 120
+    max_attempts: int = 3
+    import_chunk_size: int = 1000  # recipients inserted per statement when importing
+    retry_backoff: float = 2.0  # seconds before a failed send is retried, doubled per attempt
+    retry_backoff_max: float = 300.0
+
+
+@dataclass
+class TeamConfig:
+    """Agent team settings."""
+    initials_check_interval: float = 2.0  # seconds between checks of the initials registry version
+
+
+@dataclass
+class WindowConfig:
+    """WhatsApp customer-service window tracking."""
+    hours: float = 24.0  # free-form replies are allowed this long after the customer's last message
+    margin_seconds: int = 300  # treat the window as closed this much earlier than Meta does
+    check_interval: float = 5.0  # seconds between pulls of inbound times recorded by other processes
+    enforce: bool = False  # /send outside the window without a template: 422 instead of sending text
+
+
+@dataclass
+class OptOutConfig:
+    """Opt-out (blocklist) handling."""
+    keywords: str = "STOP,STOPALL,UNSUBSCRIBE,OPTOUT,OPT OUT"  # a whole inbound message matching one opts out
+    optin_keywords: str = "START,UNSTOP"  # ... or opts back in
+    error_rate: float = 0.001  # Bloom filter false positives; each costs one confirming lookup
+    min_capacity: int = 100000  # Bloom filter sized for at least this many numbers
+    check_interval: float = 5.0  # seconds between pulls of opt-outs recorded by other processes
+    rebuild_interval: float = 3600.0  # seconds between background rebuilds that drop opted-in numbers
 
 
 @dataclass
@@ -111,13 +230,124 @@ class Config:
             app_secret=os.getenv("META_APP_SECRET", "")
         )
         
+        # Graph API client configuration
+        self.graph = GraphConfig(
+            base_url=os.getenv("GRAPH_BASE_URL", "https://graph.facebook.com").rstrip("/"),
+            api_version=os.getenv("GRAPH_API_VERSION", "v18.0"),
+            pool_size=int(os.getenv("GRAPH_POOL_SIZE", "20")),
+            connect_timeout=float(os.getenv("GRAPH_CONNECT_TIMEOUT", "3.05")),
+            read_timeout=float(os.getenv("GRAPH_READ_TIMEOUT", "20")),
+            max_retries=int(os.getenv("GRAPH_MAX_RETRIES", "3")),
+            backoff_base=float(os.getenv("GRAPH_BACKOFF_BASE", "0.25")),
+            backoff_max=float(os.getenv("GRAPH_BACKOFF_MAX", "8")),
+            batch_window_ms=float(os.getenv("GRAPH_BATCH_WINDOW_MS", "0")),
+            batch_max=int(os.getenv("GRAPH_BATCH_MAX", "50")),
+            batch_workers=int(os.getenv("GRAPH_BATCH_WORKERS", "4")),
+            breaker_failures=int(os.getenv("GRAPH_BREAKER_FAILURES", "5")),
+            breaker_open_seconds=float(os.getenv("GRAPH_BREAKER_OPEN_SECONDS", "30")),
+            concurrency_min=int(os.getenv("GRAPH_CONCURRENCY_MIN", "2")),
+            latency_target_ms=float(os.getenv("GRAPH_LATENCY_TARGET_MS", "3000")),
+            limit_wait=float(os.getenv("GRAPH_LIMIT_WAIT", "2"))
+        )
+        
         # Webhook configuration
         self.webhook = WebhookConfig(
             verify_token=os.getenv("WEBHOOK_VERIFY_TOKEN", "callcenter_verify_123"),
             secret_key=os.getenv("FLASK_SECRET_KEY", "your_secret_key_here"),
             port=int(os.getenv("PORT", "5000")),
             host=os.getenv("HOST", "0.0.0.0"),
-            debug=self.environment == Environment.DEVELOPMENT
+            debug=self.environment == Environment.DEVELOPMENT,
+            max_body_bytes=int(os.getenv("WEBHOOK_MAX_BODY_BYTES", "1048576")),
+            require_signature=os.getenv("WEBHOOK_REQUIRE_SIGNATURE", "true").lower() == "true",
+            max_in_flight=int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "32")),
+            retry_after=int(os.getenv("WEBHOOK_RETRY_AFTER", "1")),
+            stage_timing=os.getenv("WEBHOOK_STAGE_TIMING", "true").lower() == "true",
+            log_stage_timings=os.getenv("WEBHOOK_LOG_STAGE_TIMINGS", "false").lower() == "true"
+        )
+        
+        # Ingestion configuration
+        self.ingest = IngestConfig(
+            mode=os.getenv("INGEST_MODE", "inline").lower(),
+            spool_path=os.getenv("INGEST_SPOOL_PATH", "webhook_spool.db"),
+            workers=int(os.getenv("INGEST_WORKERS", "2")),
+            batch_size=int(os.getenv("INGEST_BATCH_SIZE", "50")),
+            lease_seconds=int(os.getenv("INGEST_LEASE_SECONDS", "60")),
+            max_attempts=int(os.getenv("INGEST_MAX_ATTEMPTS", "5")),
+            poll_interval=float(os.getenv("INGEST_POLL_INTERVAL", "0.5")),
+            dedup_cache_size=int(os.getenv("INGEST_DEDUP_CACHE_SIZE", "100000")),
+            agent_cache_size=int(os.getenv("INGEST_AGENT_CACHE_SIZE", "50000")),
+            agent_cache_ttl=int(os.getenv("INGEST_AGENT_CACHE_TTL", "300")),
+            status_window=float(os.getenv("INGEST_STATUS_WINDOW", "1.0")),
+            status_batch_size=int(os.getenv("INGEST_STATUS_BATCH_SIZE", "500")),
+            status_unmatched_ttl=float(os.getenv("INGEST_STATUS_UNMATCHED_TTL", "60")),
+            spool_high_water=int(os.getenv("INGEST_SPOOL_HIGH_WATER", "50000")),
+            capture_dir=os.getenv("INGEST_CAPTURE_DIR", ""),
+            capture_segment_bytes=int(os.getenv("INGEST_CAPTURE_SEGMENT_BYTES", "67108864")),
+            capture_segment_seconds=int(os.getenv("INGEST_CAPTURE_SEGMENT_SECONDS", "3600"))
+        )
+        
+        # Media download configuration
+        self.media = MediaConfig(
+            enabled=os.getenv("MEDIA_ENABLED", "false").lower() == "true",
+            store_dir=os.getenv("MEDIA_STORE_DIR", "media_store"),
+            workers=int(os.getenv("MEDIA_WORKERS", "4")),
+            batch_size=int(os.getenv("MEDIA_BATCH_SIZE", "10")),
+            poll_interval=float(os.getenv("MEDIA_POLL_INTERVAL", "1.0")),
+            lease_seconds=int(os.getenv("MEDIA_LEASE_SECONDS", "300")),
+            max_attempts=int(os.getenv("MEDIA_MAX_ATTEMPTS", "5")),
+            max_bytes=int(os.getenv("MEDIA_MAX_BYTES", "104857600"))
+        )
+        
+        # Outgoing send queue configuration
+        self.outbound = OutboundConfig(
+            mode=os.getenv("SEND_MODE", "direct").lower(),
+            relay=os.getenv("SEND_RELAY", "true").lower() == "true",
+            workers=int(os.getenv("SEND_WORKERS", "4")),
+            batch_size=int(os.getenv("SEND_BATCH_SIZE", "20")),
+            poll_interval=float(os.getenv("SEND_POLL_INTERVAL", "0.25")),
+            lease_seconds=int(os.getenv("SEND_LEASE_SECONDS", "60")),
+            max_attempts=int(os.getenv("SEND_MAX_ATTEMPTS", "5")),
+            retry_backoff=float(os.getenv("SEND_RETRY_BACKOFF", "2.0")),
+            retry_backoff_max=float(os.getenv("SEND_RETRY_BACKOFF_MAX", "300")),
+            whatsapp_rate=float(os.getenv("SEND_WHATSAPP_RATE", "80")),
+            whatsapp_burst=float(os.getenv("SEND_WHATSAPP_BURST", "8")),
+            facebook_rate=float(os.getenv("SEND_FACEBOOK_RATE", "40")),
+            facebook_burst=float(os.getenv("SEND_FACEBOOK_BURST", "4"))
+        )
+        
+        # Campaign configuration
+        self.campaign = CampaignConfig(
+            concurrency=int(os.getenv("CAMPAIGN_CONCURRENCY", "8")),
+            max_concurrency=int(os.getenv("CAMPAIGN_MAX_CONCURRENCY", "32")),
+            chunk_size=int(os.getenv("CAMPAIGN_CHUNK_SIZE", "100")),
+            lease_seconds=int(os.getenv("CAMPAIGN_LEASE_SECONDS", "120")),
+            max_attempts=int(os.getenv("CAMPAIGN_MAX_ATTEMPTS", "3")),
+            import_chunk_size=int(os.getenv("CAMPAIGN_IMPORT_CHUNK_SIZE", "1000")),
+            retry_backoff=float(os.getenv("CAMPAIGN_RETRY_BACKOFF", "2.0")),
+            retry_backoff_max=float(os.getenv("CAMPAIGN_RETRY_BACKOFF_MAX", "300"))
+        )
+        
+        # Team configuration
+        self.team = TeamConfig(
+            initials_check_interval=float(os.getenv("INITIALS_CHECK_INTERVAL", "2.0"))
+        )
+        
+        # Customer-service window configuration
+        self.window = WindowConfig(
+            hours=float(os.getenv("SERVICE_WINDOW_HOURS", "24")),
+            margin_seconds=int(os.getenv("SERVICE_WINDOW_MARGIN", "300")),
+            check_interval=float(os.getenv("SERVICE_WINDOW_CHECK_INTERVAL", "5")),
+            enforce=os.getenv("SERVICE_WINDOW_ENFORCE", "false").lower() == "true"
+        )
+        
+        # Opt-out configuration
+        self.opt_out = OptOutConfig(
+            keywords=os.getenv("OPT_OUT_KEYWORDS", "STOP,STOPALL,UNSUBSCRIBE,OPTOUT,OPT OUT"),
+            optin_keywords=os.getenv("OPT_IN_KEYWORDS", "START,UNSTOP"),
+            error_rate=float(os.getenv("OPT_OUT_ERROR_RATE", "0.001")),
+            min_capacity=int(os.getenv("OPT_OUT_MIN_CAPACITY", "100000")),
+            check_interval=float(os.getenv("OPT_OUT_CHECK_INTERVAL", "5")),
+            rebuild_interval=float(os.getenv("OPT_OUT_REBUILD_INTERVAL", "3600"))
         )
         
         # Dashboard configuration
@@ -170,6 +400,15 @@ class Config:
 
         return url
 
+    def get_async_database_url(self) -> str:
+        """Get database URL for the async engine used by the ASGI service.
+        SQLite goes through aiosqlite; psycopg3 URLs are used as-is (async mode).
+        """
+        url = self.get_database_url()
+        if url.startswith("sqlite://"):
+            url = url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+        return url
+
 
 # Global configuration instance
 config = Config()
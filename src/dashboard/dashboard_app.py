@@ -20,15 +20,13 @@ from dash import dcc, html, dash_table, Input, Output, State, callback_context
 import plotly.graph_objs as go
 import plotly.express as px
 import pandas as pd
-import json as _json
 from datetime import datetime, date, timedelta
 from typing import List, Dict, Any
 import logging
 
 from src.config import config
-from src.services import get_message_service
+from src.services import get_message_service, get_agent_registry
 from src.utils.logging import setup_logging, get_logger
-from src.utils import format_agent_display
 
 # Setup logging
 setup_logging()
@@ -350,23 +348,11 @@ def update_dashboard(n_intervals, refresh_clicks, platform, agent, start_date,
             search_text or '', message_types or []
         )
         
-        # Prepare display data with agent initials when available
-        def _safe_load_extra(val):
-            try:
-                return _json.loads(val) if isinstance(val, str) and val else (val or {})
-            except Exception:
-                return {}
-
+        # Prepare display data with agent initials from the registry, once per agent
+        registry = get_agent_registry()
         working_df = filtered_df.copy()
-        if 'extra_data' in working_df.columns:
-            working_df['__extra_dict'] = working_df['extra_data'].apply(_safe_load_extra)
-            working_df['__agent_initials'] = working_df['__extra_dict'].apply(lambda d: (d or {}).get('agent_initials'))
-        else:
-            working_df['__agent_initials'] = None
-
-        working_df['agent_display'] = working_df.apply(
-            lambda r: format_agent_display(r.get('agent', ''), r.get('__agent_initials')), axis=1
-        )
+        displays = {agent: registry.display(agent) for agent in working_df['agent'].dropna().unique()}
+        working_df['agent_display'] = working_df['agent'].map(displays).fillna('')
 
         # Prepare table data
         table_data = working_df.copy()
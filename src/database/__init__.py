@@ -3,7 +3,7 @@ Database package for HCTC-CRM
 Copyright (c) 2025 - Signature: 8598
 """
 
-from .models import Message, Agent, Conversation, SystemLog, AgentSchedule, AgentLeave, AgentEscalation, AgentInitial, Base
+from .models import Message, Agent, Conversation, SystemLog, AgentSchedule, AgentLeave, AgentEscalation, AgentInitial, CacheVersion, MediaAsset, OutboundSend, Campaign, CampaignRecipient, OptOut, Base
 from .connection import (
     DatabaseManager, 
     db_manager, 
@@ -12,9 +12,10 @@ from .connection import (
     get_session, 
     get_db_session
 )
+from .dialects import upsert_insert
 
 __all__ = [
-    "Message", "Agent", "Conversation", "SystemLog", "AgentSchedule", "AgentLeave", "AgentEscalation", "AgentInitial", "Base",
+    "Message", "Agent", "Conversation", "SystemLog", "AgentSchedule", "AgentLeave", "AgentEscalation", "AgentInitial", "CacheVersion", "MediaAsset", "OutboundSend", "Campaign", "CampaignRecipient", "OptOut", "Base",
     "DatabaseManager", "db_manager", "get_database_manager", 
-    "init_database", "get_session", "get_db_session"
+    "init_database", "get_session", "get_db_session", "upsert_insert"
 ]
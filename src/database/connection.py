@@ -18,6 +18,7 @@ from threading import Lock
 
 from ..config import config
 from .models import Base
+from .migrations import run_migrations
 
 logger = logging.getLogger(__name__)
 
@@ -114,6 +115,10 @@ class DatabaseManager:
         """Create all database tables."""
         try:
             Base.metadata.create_all(bind=self.engine)
+            # Background workers may have pooled SQLite connections whose schema
+            # cache predates the new tables; run migrations on fresh ones
+            self.engine.dispose()
+            run_migrations(self.engine)
             logger.info("Database tables created successfully - Signature: 8598")
         except Exception as e:
             logger.error(f"Failed to create database tables: {e}")
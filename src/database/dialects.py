@@ -0,0 +1,24 @@
+"""
+Dialect helpers for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Builds INSERT statements that support ON CONFLICT clauses on the databases
+we deploy to (SQLite in development, PostgreSQL in production).
+"""
+
+from typing import Any, Optional
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+
+_UPSERT_INSERTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+
+def upsert_insert(session: Session, model: Any) -> Optional[Any]:
+    """Return a dialect-specific INSERT supporting ON CONFLICT, or None if unsupported."""
+    factory = _UPSERT_INSERTS.get(session.get_bind().dialect.name)
+    return factory(model) if factory else None
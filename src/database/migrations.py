@@ -0,0 +1,152 @@
+"""
+Schema migrations for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Lightweight, idempotent upgrades for databases created by older releases.
+`create_all` only creates missing tables, so changes to existing tables are
+applied here. Every step checks the live schema first and is safe to rerun.
+"""
+
+from typing import Dict, List
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_UNIQUE_INDEX = "uq_conversation_recipient_platform"
+LEGACY_CONVERSATION_INDEX = "idx_recipient_platform"
+
+
+def merge_duplicate_conversations(conn: Connection) -> int:
+    """
+    Collapse duplicate (recipient, platform) conversation rows into one.
+
+    The most recent row survives and keeps its agent; message counts are
+    summed and the earliest created_at is preserved.
+
+    Returns:
+        int: Number of rows removed
+    """
+    groups = conn.execute(text(
+        "SELECT recipient, platform FROM conversations "
+        "GROUP BY recipient, platform HAVING COUNT(*) > 1"
+    )).fetchall()
+
+    removed = 0
+    for recipient, platform in groups:
+        rows = conn.execute(text(
+            "SELECT id, message_count, created_at, is_active FROM conversations "
+            "WHERE recipient = :recipient AND platform = :platform "
+            "ORDER BY last_message_at DESC, id DESC"
+        ), {"recipient": recipient, "platform": platform}).fetchall()
+
+        keep = rows[0]
+        extra_ids = [r.id for r in rows[1:]]
+        conn.execute(text(
+            "UPDATE conversations SET message_count = :count, created_at = :created_at, "
+            "is_active = :is_active WHERE id = :id"
+        ), {
+            "count": sum(r.message_count or 0 for r in rows),
+            "created_at": min(r.created_at for r in rows),
+            "is_active": any(r.is_active for r in rows),
+            "id": keep.id,
+        })
+        conn.execute(
+            text("DELETE FROM conversations WHERE id = :id"),
+            [{"id": row_id} for row_id in extra_ids]
+        )
+        removed += len(extra_ids)
+
+    if removed:
+        logger.warning(f"Merged {removed} duplicate conversation rows across {len(groups)} recipients")
+    return removed
+
+
+def ensure_conversation_unique_key(engine: Engine) -> bool:
+    """
+    Make (recipient, platform) unique on the conversations table.
+
+    Returns:
+        bool: True if the schema was changed
+    """
+    inspector = inspect(engine)
+    if "conversations" not in inspector.get_table_names():
+        return False
+
+    indexes = {ix["name"]: ix for ix in inspector.get_indexes("conversations")}
+    if CONVERSATION_UNIQUE_INDEX in indexes:
+        return False
+
+    with engine.begin() as conn:
+        merge_duplicate_conversations(conn)
+        if LEGACY_CONVERSATION_INDEX in indexes:
+            conn.execute(text(f"DROP INDEX {LEGACY_CONVERSATION_INDEX}"))
+        conn.execute(text(
+            f"CREATE UNIQUE INDEX {CONVERSATION_UNIQUE_INDEX} ON conversations (recipient, platform)"
+        ))
+
+    logger.info("Conversations now unique on (recipient, platform) - Signature: 8598")
+    return True
+
+
+def ensure_columns(engine: Engine, table: str, columns: Dict[str, str]) -> List[str]:
+    """
+    Add nullable columns missing from an existing table.
+
+    Args:
+        table: Table name
+        columns: Column name -> SQL type, e.g. {"read_at": "TIMESTAMP"}
+
+    Returns:
+        List[str]: Names of the columns that were added
+    """
+    inspector = inspect(engine)
+    if table not in inspector.get_table_names():
+        return []
+
+    present = {col["name"] for col in inspector.get_columns(table)}
+    missing = [name for name in columns if name not in present]
+    if missing:
+        with engine.begin() as conn:
+            for name in missing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {columns[name]}"))
+        logger.info(f"Added columns to {table}: {', '.join(missing)} - Signature: 8598")
+    return missing
+
+
+def ensure_last_inbound(engine: Engine) -> bool:
+    """
+    Add conversations.last_inbound_at and its index, filling the new column
+    once from each conversation's latest incoming message.
+
+    Returns:
+        bool: True if the column was added
+    """
+    added = ensure_columns(engine, "conversations", {"last_inbound_at": "TIMESTAMP"})
+    if "conversations" not in inspect(engine).get_table_names():
+        return False
+    with engine.begin() as conn:
+        if added:
+            conn.execute(text(
+                "UPDATE conversations SET last_inbound_at = ("
+                "SELECT MAX(m.timestamp) FROM messages m WHERE m.recipient = conversations.recipient "
+                "AND m.platform = conversations.platform AND m.is_incoming = :incoming)"
+            ), {"incoming": True})
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_last_inbound ON conversations (last_inbound_at)"))
+    return bool(added)
+
+
+def run_migrations(engine: Engine) -> None:
+    """Apply all pending schema upgrades."""
+    ensure_conversation_unique_key(engine)
+    ensure_columns(engine, "messages", {
+        "sent_at": "TIMESTAMP",
+        "delivered_at": "TIMESTAMP",
+        "read_at": "TIMESTAMP",
+        "failed_at": "TIMESTAMP",
+    })
+    ensure_last_inbound(engine)
+    ensure_columns(engine, "campaigns", {"text": "TEXT"})
+    ensure_columns(engine, "campaign_recipients", {"available_at": "TIMESTAMP", "message_pk": "INTEGER"})
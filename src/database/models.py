@@ -10,7 +10,8 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, foreign
 from datetime import datetime, timezone
 from typing import Optional, Dict, Any
-import json
+
+from ..utils import json_codec
 
 Base = declarative_base()
 
@@ -34,6 +35,11 @@ class Message(Base):
     is_incoming = Column(Boolean, default=True, nullable=False, index=True)
     status = Column(String(50), nullable=True, index=True)
     extra_data = Column(Text, nullable=True)
+    # Delivery status transition times reported by the platform (outgoing messages)
+    sent_at = Column(DateTime, nullable=True)
+    delivered_at = Column(DateTime, nullable=True)
+    read_at = Column(DateTime, nullable=True)
+    failed_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
 
@@ -60,6 +66,10 @@ class Message(Base):
             'is_incoming': self.is_incoming,
             'status': self.status,
             'extra_data': self.extra_data,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None,
+            'delivered_at': self.delivered_at.isoformat() if self.delivered_at else None,
+            'read_at': self.read_at.isoformat() if self.read_at else None,
+            'failed_at': self.failed_at.isoformat() if self.failed_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -68,15 +78,15 @@ class Message(Base):
         """Parse extra_data JSON string to dictionary."""
         if self.extra_data:
             try:
-                return json.loads(self.extra_data)
-            except (json.JSONDecodeError, TypeError):
+                return json_codec.loads(self.extra_data)
+            except (ValueError, TypeError):
                 return None
         return None
 
     def set_extra_data(self, data: Dict[str, Any]) -> None:
         """Set extra_data from dictionary."""
         if data:
-            self.extra_data = json.dumps(data, ensure_ascii=False)
+            self.extra_data = json_codec.dumps(data)
         else:
             self.extra_data = None
 
@@ -135,16 +145,19 @@ class Conversation(Base):
     platform = Column(String(50), nullable=False, index=True)
     agent = Column(String(100), nullable=True, index=True)
     last_message_at = Column(DateTime, nullable=False, index=True)
+    last_inbound_at = Column(DateTime, nullable=True)  # customer's last message; opens the 24h service window
     message_count = Column(Integer, default=0, nullable=False)
     is_active = Column(Boolean, default=True, nullable=False, index=True)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
 
-    # Indexes for better query performance
+    # Indexes for better query performance. (recipient, platform) is unique so
+    # conversation tracking can be a single INSERT ... ON CONFLICT DO UPDATE.
     __table_args__ = (
-        Index('idx_recipient_platform', 'recipient', 'platform'),
+        Index('uq_conversation_recipient_platform', 'recipient', 'platform', unique=True),
         Index('idx_agent_active', 'agent', 'is_active'),
         Index('idx_last_message', 'last_message_at'),
+        Index('idx_last_inbound', 'last_inbound_at'),
     )
 
     def to_dict(self) -> Dict[str, Any]:
@@ -155,6 +168,7 @@ class Conversation(Base):
             'platform': self.platform,
             'agent': self.agent,
             'last_message_at': self.last_message_at.isoformat() if self.last_message_at else None,
+            'last_inbound_at': self.last_inbound_at.isoformat() if self.last_inbound_at else None,
             'message_count': self.message_count,
             'is_active': self.is_active,
             'created_at': self.created_at.isoformat() if self.created_at else None,
@@ -333,3 +347,221 @@ class AgentInitial(Base):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
         }
+
+
+class MediaAsset(Base):
+    """
+    Downloaded media of an incoming message, stored by content hash.
+    Signature: 8598
+    """
+    __tablename__ = 'media_assets'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    message_id = Column(String(100), nullable=False, unique=True, index=True)  # platform message id
+    platform = Column(String(50), nullable=False)
+    media_id = Column(String(255), nullable=True)  # WhatsApp media id, resolved through Graph
+    source_url = Column(Text, nullable=True)  # direct URL (Messenger attachments)
+    mime_type = Column(String(100), nullable=True)
+    sha256 = Column(String(64), nullable=True, index=True)
+    file_size = Column(Integer, nullable=True)
+    storage_path = Column(String(500), nullable=True)
+    status = Column(String(20), nullable=False, default='pending')  # pending/resolving/stored/failed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    claimed_at = Column(DateTime, nullable=True)
+    resolved_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
+
+    __table_args__ = (
+        Index('idx_media_status_claimed', 'status', 'claimed_at'),
+    )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'message_id': self.message_id,
+            'platform': self.platform,
+            'media_id': self.media_id,
+            'mime_type': self.mime_type,
+            'sha256': self.sha256,
+            'file_size': self.file_size,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'resolved_at': self.resolved_at.isoformat() if self.resolved_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+class CacheVersion(Base):
+    """
+    Version counter of data cached in every process. Writers bump it in the
+    same transaction as the change; readers compare it to reload.
+    Signature: 8598
+    """
+    __tablename__ = 'cache_versions'
+
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
+
+
+class OutboundSend(Base):
+    """
+    Outbox row of an outgoing message. The message row is written with status
+    'queued' in the same transaction; whoever holds the claim (the /send
+    request or a relay worker) sends and updates both.
+    Signature: 8598
+    """
+    __tablename__ = 'outbound_sends'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    message_pk = Column(Integer, ForeignKey('messages.id'), nullable=False, unique=True)  # messages.id
+    platform = Column(String(50), nullable=False)
+    sender_key = Column(String(100), nullable=False, index=True)  # WhatsApp phone_id or Messenger page id
+    recipient = Column(String(100), nullable=False)
+    payload = Column(Text, nullable=False)  # Graph API request body (JSON)
+    status = Column(String(20), nullable=False, default='queued')  # queued/sending/sent/failed/unconfirmed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    available_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    claimed_at = Column(DateTime, nullable=True)
+    sent_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
+
+    __table_args__ = (
+        Index('idx_outbound_status_available', 'status', 'available_at'),
+    )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'message_pk': self.message_pk,
+            'platform': self.platform,
+            'sender_key': self.sender_key,
+            'recipient': self.recipient,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'available_at': self.available_at.isoformat() if self.available_at else None,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+class Campaign(Base):
+    """
+    Bulk WhatsApp template send to a recipient list.
+    Signature: 8598
+    """
+    __tablename__ = 'campaigns'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(200), nullable=False)
+    agent = Column(String(100), nullable=False, index=True)  # logged as the sender of every message
+    platform = Column(String(50), nullable=False, default='WhatsApp')
+    template_name = Column(String(200), nullable=False)
+    language_code = Column(String(20), nullable=False, default='en_US')
+    components = Column(Text, nullable=True)  # template components (JSON)
+    text = Column(Text, nullable=True)  # free-form body for recipients inside their service window
+    status = Column(String(20), nullable=False, default='draft', index=True)  # draft/running/paused/completed
+    concurrency = Column(Integer, nullable=False, default=8)
+    total = Column(Integer, nullable=False, default=0)
+    duplicates = Column(Integer, nullable=False, default=0)
+    invalid = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    active_seconds = Column(Integer, nullable=False, default=0)  # running time before the current run
+    started_at = Column(DateTime, nullable=True)
+    resumed_at = Column(DateTime, nullable=True)  # start of the current run
+    finished_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'agent': self.agent,
+            'platform': self.platform,
+            'template_name': self.template_name,
+            'language_code': self.language_code,
+            'components': json_codec.loads(self.components) if self.components else None,
+            'text': self.text,
+            'status': self.status,
+            'concurrency': self.concurrency,
+            'total': self.total,
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'sent': self.sent,
+            'failed': self.failed,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+class CampaignRecipient(Base):
+    """
+    Per-recipient result of a campaign.
+    Signature: 8598
+    """
+    __tablename__ = 'campaign_recipients'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    campaign_id = Column(Integer, ForeignKey('campaigns.id'), nullable=False)
+    recipient = Column(String(50), nullable=False)  # E.164 with leading +
+    status = Column(String(20), nullable=False, default='pending')  # pending/sending/sent/failed/opted_out/unconfirmed
+    message_id = Column(String(100), nullable=True)  # wamid of the sent template
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    claimed_at = Column(DateTime, nullable=True)
+    available_at = Column(DateTime, nullable=True)  # a pending row is not claimed before this
+    message_pk = Column(Integer, ForeignKey('messages.id'), nullable=True)  # outgoing message, logged 'queued' before the send
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint('campaign_id', 'recipient', name='uq_campaign_recipient'),
+        Index('idx_campaign_recipient_status', 'campaign_id', 'status'),
+    )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'recipient': self.recipient,
+            'status': self.status,
+            'message_id': self.message_id,
+            'attempts': self.attempts,
+            'error': self.error,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None,
+        }
+
+
+class OptOut(Base):
+    """
+    Recipient who must not be messaged: a STOP-style reply or a compliance
+    list import. Opting back in deletes the row.
+    Signature: 8598
+    """
+    __tablename__ = 'opt_outs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    platform = Column(String(50), nullable=False)
+    recipient = Column(String(100), nullable=False)  # digits without '+' for WhatsApp, the PSID for Messenger
+    source = Column(String(20), nullable=False)  # keyword/import/api
+    reason = Column(String(200), nullable=True)  # the keyword received, or the import's label
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False, index=True)
+
+    __table_args__ = (
+        UniqueConstraint('platform', 'recipient', name='uq_opt_out_recipient'),
+    )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'platform': self.platform,
+            'recipient': self.recipient,
+            'source': self.source,
+            'reason': self.reason,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
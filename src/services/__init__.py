@@ -4,5 +4,40 @@ Copyright (c) 2025 - Signature: 8598
 """
 
 from .message_service import MessageService, message_service, get_message_service
+from .ingest_spool import IngestSpool, SpoolWorkerPool
+from .status_service import StatusCoalescer, status_coalescer, get_status_coalescer
+from .capture import CaptureWriter, CapturedRequest, read_capture
+from .graph_client import GraphClient, AsyncGraphClient, GraphRetryPolicy, GraphUnavailable, graph_client, get_graph_client
+from .graph_batch import GraphBatcher, BatchResponse, graph_batcher, get_graph_batcher, get_graph_sender
+from .extraction import PayloadExtractor, InboundMessage, StatusUpdate
+from .media_service import (
+    MediaClient, GraphMediaClient, StubMediaClient, MediaInfo, MediaError, MediaStore, MediaResolverPool,
+    get_media_asset
+)
+from .outbound_service import (
+    OutboundSender, GraphOutboundSender, StubOutboundSender, SendError, OutboundWorkerPool, OutboxClaim,
+    SendResult, enqueue_send, enqueue_claimed, parse_send_response, get_outbound_send, get_send_limiters
+)
+from .agent_registry import AgentRegistry, agent_registry, get_agent_registry, bump_version
+from .campaign_service import CampaignService, CampaignRunner, campaign_service, get_campaign_service
+from .service_window import ServiceWindowIndex, service_window, get_service_window
+from .blocklist import Blocklist, blocklist, get_blocklist
 
-__all__ = ["MessageService", "message_service", "get_message_service"]
+__all__ = [
+    "MessageService", "message_service", "get_message_service",
+    "IngestSpool", "SpoolWorkerPool",
+    "StatusCoalescer", "status_coalescer", "get_status_coalescer",
+    "CaptureWriter", "CapturedRequest", "read_capture",
+    "GraphClient", "AsyncGraphClient", "GraphRetryPolicy", "GraphUnavailable", "graph_client", "get_graph_client",
+    "GraphBatcher", "BatchResponse", "graph_batcher", "get_graph_batcher", "get_graph_sender",
+    "PayloadExtractor", "InboundMessage", "StatusUpdate",
+    "MediaClient", "GraphMediaClient", "StubMediaClient", "MediaInfo", "MediaError", "MediaStore",
+    "MediaResolverPool", "get_media_asset",
+    "OutboundSender", "GraphOutboundSender", "StubOutboundSender", "SendError", "OutboundWorkerPool",
+    "OutboxClaim", "SendResult", "enqueue_send", "enqueue_claimed", "parse_send_response", "get_outbound_send",
+    "get_send_limiters",
+    "AgentRegistry", "agent_registry", "get_agent_registry", "bump_version",
+    "CampaignService", "CampaignRunner", "campaign_service", "get_campaign_service",
+    "ServiceWindowIndex", "service_window", "get_service_window",
+    "Blocklist", "blocklist", "get_blocklist"
+]
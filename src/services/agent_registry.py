@@ -0,0 +1,106 @@
+"""
+Agent Initials Registry for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Process-wide copy of the agent_initials table (^XX initials <-> agent name).
+It is loaded once and kept current through a counter in cache_versions that
+/team/initials bumps in the same transaction as the mapping change: at most
+every `check_interval` seconds a reader compares the counter (one primary-key
+read) and reloads the table only when it moved. /send validation, report
+display names and the dashboard read the mapping from memory.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+import logging
+import time
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from ..config import config
+from ..database import AgentInitial, CacheVersion, upsert_insert
+from ..utils.agents import format_agent_display
+from ..utils.refreshing import RefreshingIndex
+
+logger = logging.getLogger(__name__)
+
+INITIALS_VERSION = "agent_initials"
+
+
+def bump_version(session: Session, name: str) -> None:
+    """Increment a cache_versions counter inside the caller's transaction."""
+    now = datetime.now(timezone.utc)
+    insert = upsert_insert(session, CacheVersion)
+    if insert is not None:
+        session.execute(insert.values(name=name, version=1, updated_at=now).on_conflict_do_update(
+            index_elements=[CacheVersion.name],
+            set_={"version": CacheVersion.__table__.c.version + 1, "updated_at": now}
+        ))
+        return
+    result = session.execute(update(CacheVersion).where(CacheVersion.name == name).values(
+        version=CacheVersion.version + 1, updated_at=now
+    ))
+    if not result.rowcount:
+        session.add(CacheVersion(name=name, version=1, updated_at=now))
+        session.flush()
+
+
+class AgentRegistry(RefreshingIndex):
+    """
+    In-memory initials <-> agent mapping, refreshed on a version check.
+    Signature: 8598
+    """
+
+    def __init__(self, check_interval: float = 2.0, clock: Callable[[], float] = time.monotonic):
+        super().__init__(check_interval, clock)
+        # (initials -> agent, agent -> initials), swapped as one reference
+        self._maps: Tuple[Dict[str, str], Dict[str, str]] = ({}, {})
+        self._version: Optional[int] = None  # None until the first load
+        self.checks = 0
+        self.loads = 0
+
+    def loaded(self) -> bool:
+        return self._version is not None
+
+    def _sync(self, session: Session, now: float, force: bool) -> None:
+        # Check the version and reload the mapping only if it moved
+        version = session.query(CacheVersion.version).filter(CacheVersion.name == INITIALS_VERSION).scalar() or 0
+        self.checks += 1
+        if force or version != self._version:
+            rows = session.query(AgentInitial.initials, AgentInitial.agent).all()
+            self._maps = ({initials: agent for initials, agent in rows},
+                          {agent: initials for initials, agent in rows})
+            self._version = version
+            self.loads += 1
+
+    def invalidate(self) -> None:
+        """Force a reload on the next lookup (after a change committed by this process)."""
+        self._version = None
+
+    def agent_for(self, initials: str) -> Optional[str]:
+        """Agent registered for `initials`, or None."""
+        self.refresh()
+        return self._maps[0].get((initials or "").upper())
+
+    def initials_for(self, agent: str) -> Optional[str]:
+        """Initials registered for `agent`, or None."""
+        self.refresh()
+        return self._maps[1].get(agent)
+
+    def display(self, agent: str) -> str:
+        """Agent display name, "BM AgentName" when the agent has initials."""
+        return format_agent_display(agent, self.initials_for(agent))
+
+    def stats(self) -> Dict[str, Any]:
+        """Loaded version, mapping size and check/load counters."""
+        return {"version": self._version, "agents": len(self._maps[0]), "checks": self.checks, "loads": self.loads}
+
+
+# Global agent registry instance
+agent_registry = AgentRegistry(check_interval=config.team.initials_check_interval)
+
+
+def get_agent_registry() -> AgentRegistry:
+    """Get the global agent initials registry."""
+    return agent_registry
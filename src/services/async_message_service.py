@@ -0,0 +1,113 @@
+"""
+Async Message Service for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Asyncio front end to MessageService for the ASGI webhook service. Writes go
+through an async engine (aiosqlite / psycopg async) while the batch
+preparation, upsert statements and caches are shared with the synchronous
+MessageService, so both services persist exactly the same rows.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+
+from ..config import config
+from ..utils.metrics import stage
+from .extraction import InboundMessage
+from .message_service import MessageService, get_message_service
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class AsyncMessageService:
+    """
+    Async persistence for webhook ingestion and /send logging.
+    Signature: 8598
+    """
+
+    def __init__(self, message_service: Optional[MessageService] = None, database_url: Optional[str] = None):
+        self.message_service = message_service or get_message_service()
+        url = database_url or config.get_async_database_url()
+        options: Dict[str, Any] = {"echo": config.database.echo, "pool_pre_ping": True}
+        if not url.startswith("sqlite"):
+            options.update(
+                pool_size=config.database.pool_size,
+                max_overflow=config.database.max_overflow,
+                pool_timeout=config.database.pool_timeout,
+                pool_recycle=config.database.pool_recycle
+            )
+        self.engine: AsyncEngine = create_async_engine(url, **options)
+        self.session_factory = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    async def run_sync(self, fn: Callable[..., T], *args: Any) -> T:
+        """Run `fn(session, *args)` with a synchronous Session on the async driver and commit."""
+        async with self.session_factory() as session:
+            result = await session.run_sync(fn, *args)
+            await session.commit()
+        return result
+
+    async def assign_agents(self, records: List[InboundMessage]) -> None:
+        """Fill in the handling agent of records extracted with resolve_agents=False."""
+        service = self.message_service
+        resolved: Dict[tuple, str] = {}
+        for record in records:
+            if record.agent:
+                continue
+            key = (record.sender, record.platform)
+            agent = resolved.get(key) or service.cached_incoming_agent(*key)
+            if agent is None:
+                try:
+                    async with self.session_factory() as session:
+                        found = (await session.execute(service.conversation_agent_query(*key))).scalar()
+                    agent = service.cache_incoming_agent(*key, found)
+                except Exception as e:
+                    self.logger.error(f"assign_agents error: {e}")
+                    agent = "Unassigned"
+            resolved[key] = agent
+            record.agent = agent
+
+    async def log_messages(self, records: List[Any]) -> int:
+        """
+        Log a batch of messages in a single transaction. Same semantics as
+        MessageService.log_messages.
+
+        Returns:
+            int: Number of messages written
+        """
+        service = self.message_service
+        with stage("normalize"):
+            rows, batch_ids = service.prepare_batch(records)
+        if not rows:
+            return 0
+
+        try:
+            async with self.session_factory() as session:
+                rows = await session.run_sync(service.write_batch, rows)
+                with stage("commit"):
+                    await session.commit()
+            service.remember_batch(batch_ids, rows)
+            self.logger.info(f"Logged message batch - Count: {len(rows)}")
+            return len(rows)
+        except Exception as e:
+            self.logger.error(f"Failed to log message batch: {e}")
+            raise
+
+    async def health_check(self) -> bool:
+        """Return True if the database answers a trivial query."""
+        try:
+            async with self.engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            return True
+        except Exception as e:
+            self.logger.error(f"Database health check failed: {e}")
+            return False
+
+    async def close(self) -> None:
+        """Dispose of the async connection pool."""
+        await self.engine.dispose()
@@ -0,0 +1,385 @@
+"""
+Opt-Out Blocklist for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Recipients who replied STOP (or were imported from a compliance list) must
+not be messaged again, and every outbound path checks the list: /send, the
+outbox relay, messaging.py and campaigns. Blocklist answers from an
+in-memory Bloom filter, so the common case (not opted out) costs a few
+bit tests and no query whatever the list size. A filter hit is confirmed
+against the exact set, the opt_outs table, with one indexed lookup
+(campaigns confirm a whole chunk with one IN query), which also keeps
+opted-in numbers, whose bits cannot be cleared, from being reported.
+
+The filter is loaded once, then kept current incrementally: opt-outs
+committed by this process are added as they commit, and opt-outs recorded by
+other processes are pulled every `check_interval` seconds by created_at.
+When it fills past its capacity, or every `rebuild_interval` seconds to drop
+opted-in numbers, a background thread builds a new filter and swaps it in;
+senders keep using the old one meanwhile.
+"""
+
+from datetime import datetime, timezone
+from threading import Thread
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+import logging
+import re
+import time
+
+from sqlalchemy import delete, func, insert, select, tuple_
+from sqlalchemy.orm import Session
+
+from ..config import config
+from ..database import OptOut, get_db_session, upsert_insert
+from ..utils.bloom import BloomFilter
+from ..utils.refreshing import RefreshingIndex
+from ..utils.security import is_valid_phone_number
+from ..utils.timestamps import utc_epoch
+
+logger = logging.getLogger(__name__)
+
+# Numbers per transaction when importing a list, and per IN query when confirming filter hits
+CHUNK_SIZE = 1000
+
+_KEY_NOISE = str.maketrans("", "", " -().\t")
+_NOT_LETTERS = re.compile(r"[^A-Z ]+")
+
+
+def opt_out_key(recipient: Any, platform: str = "WhatsApp") -> str:
+    """
+    Blocklist key of a recipient: inbound WhatsApp ids have no '+', /send
+    numbers do, and imported lists may dial out with '00'.
+    """
+    key = str(recipient or "").strip().translate(_KEY_NOISE).lstrip("+")
+    if platform == "WhatsApp" and key.startswith("00"):
+        key = key[2:]
+    return key
+
+
+def _keywords(value: str) -> Set[str]:
+    return {" ".join(_NOT_LETTERS.sub("", word.upper()).split()) for word in value.split(",") if word.strip()}
+
+
+class Blocklist(RefreshingIndex):
+    """
+    Bloom-filtered opt-out membership, confirmed against the opt_outs table.
+    Signature: 8598
+    """
+
+    def __init__(
+        self,
+        error_rate: float = 0.001,
+        min_capacity: int = 100000,
+        check_interval: float = 5.0,
+        rebuild_interval: float = 3600.0,
+        keywords: str = "STOP",
+        optin_keywords: str = "START",
+        clock: Callable[[], float] = time.time
+    ):
+        super().__init__(check_interval, clock)
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self.rebuild_interval = rebuild_interval
+        self.keywords = _keywords(keywords)
+        self.optin_keywords = _keywords(optin_keywords)
+        self._filter: Optional[BloomFilter] = None  # None until warmed
+        self._watermark = 0.0  # newest created_at pulled from the database
+        self._built_at = 0.0
+        self._removed = 0  # opt-ins since the filter was built; their bits are still set
+        self._rebuild: Optional[Thread] = None
+        self._added_during_rebuild: List[str] = []
+        self._stats = {"checks": 0, "filter_hits": 0, "blocked": 0, "pulls": 0, "loads": 0, "rebuilds": 0}
+
+    # ---- keywords ----
+
+    def classify(self, text: Optional[str]) -> Optional[bool]:
+        """True if a message opts out, False if it opts back in, None otherwise. Matches whole messages only."""
+        if not text or len(text) > 40:
+            return None
+        word = " ".join(_NOT_LETTERS.sub("", text.upper()).split())
+        if word in self.keywords:
+            return True
+        if word in self.optin_keywords:
+            return False
+        return None
+
+    def record_keywords(self, session: Session, rows: List[Dict[str, Any]]) -> int:
+        """
+        Apply the STOP/START replies among inserted message rows on `session`
+        without committing, so they commit with the messages. Call
+        note_rows() once committed. Returns the number of changes.
+        """
+        opt_outs, opt_ins = {}, set()
+        for row in rows:
+            if not row.get("is_incoming"):
+                continue
+            kind = self.classify(row.get("content"))
+            if kind is None:
+                continue
+            key = (row["platform"], opt_out_key(row["recipient"], row["platform"]))
+            if kind:
+                opt_outs[key] = (row.get("content") or "").strip()[:200]
+                opt_ins.discard(key)
+            else:
+                opt_ins.add(key)
+                opt_outs.pop(key, None)
+        changed = 0
+        if opt_outs:
+            changed += self._insert(session, [
+                {"platform": platform, "recipient": key, "source": "keyword", "reason": reason,
+                 "created_at": datetime.now(timezone.utc)}
+                for (platform, key), reason in opt_outs.items()
+            ])
+        if opt_ins:
+            changed += session.execute(delete(OptOut).where(
+                tuple_(OptOut.platform, OptOut.recipient).in_(list(opt_ins))
+            )).rowcount
+        return changed
+
+    def note_rows(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """Apply the STOP/START replies of a committed message batch to the filter."""
+        for row in rows:
+            if row.get("is_incoming"):
+                kind = self.classify(row.get("content"))
+                if kind:
+                    self.note(row["platform"], [row["recipient"]])
+                elif kind is False:
+                    self._removed += 1
+
+    # ---- loading ----
+
+    def loaded(self) -> bool:
+        return self._filter is not None
+
+    def _sync(self, session: Session, now: float, force: bool) -> None:
+        # Load the filter, or pull opt-outs newer than the last pull
+        if self._filter is None or force:
+            self._filter, watermark = self._build(session)
+            self._watermark = watermark or now
+            self._built_at, self._removed = now, 0
+            self._stats["loads"] += 1
+        else:
+            rows = session.execute(select(OptOut.platform, OptOut.recipient, OptOut.created_at).where(
+                OptOut.created_at >= self.pull_since(self._watermark)
+            )).all()
+            for platform, recipient, created_at in rows:
+                self._add(f"{platform}:{recipient}")
+                self._watermark = max(self._watermark, utc_epoch(created_at))
+            self._stats["pulls"] += 1
+        if self._rebuild_due(now):
+            self._start_rebuild()
+
+    def rebuild(self) -> None:
+        """Build a fresh filter from the table and swap it in. Lookups continue on the old one meanwhile."""
+        started = self.clock()
+        try:
+            with get_db_session() as session:
+                fresh, watermark = self._build(session)
+        except Exception as e:
+            self.logger.warning(f"Opt-out filter rebuild failed: {e}")
+            with self._lock:
+                self._added_during_rebuild = []
+                self._built_at = started
+            return
+        with self._lock:
+            for member in self._added_during_rebuild:
+                fresh.add(member)
+            self._added_during_rebuild = []
+            self._filter = fresh
+            # Pull again from the start of the build for rows committed while it streamed
+            self._watermark = min(watermark or started, started)
+            self._checked_at = 0.0
+            self._built_at, self._removed = started, 0
+            self._stats["rebuilds"] += 1
+        self.logger.info(f"Opt-out filter rebuilt - Numbers: {len(fresh)}, Seconds: {self.clock() - started:.2f}")
+
+    def _build(self, session: Session) -> Tuple[BloomFilter, float]:
+        count = session.query(func.count(OptOut.id)).scalar() or 0
+        fresh = BloomFilter(max(self.min_capacity, count * 2), self.error_rate)
+        watermark = 0.0
+        rows = session.execute(
+            select(OptOut.platform, OptOut.recipient, OptOut.created_at).execution_options(yield_per=CHUNK_SIZE * 10)
+        )
+        for platform, recipient, created_at in rows:
+            fresh.add(f"{platform}:{recipient}")
+            watermark = max(watermark, utc_epoch(created_at))
+        return fresh, watermark
+
+    def _rebuild_due(self, now: float) -> bool:
+        current = self._filter
+        if current is None or (self._rebuild is not None and self._rebuild.is_alive()):
+            return False
+        return (len(current) > current.capacity
+                or now - self._built_at >= self.rebuild_interval
+                or self._removed > max(100, len(current) // 10))
+
+    def _start_rebuild(self) -> None:
+        self._added_during_rebuild = []
+        self._rebuild = Thread(target=self.rebuild, name="opt-out-rebuild", daemon=True)
+        self._rebuild.start()
+
+    def _add(self, member: str) -> None:
+        # Callers hold the lock: concurrent bit writes to one byte could lose a bit
+        self._filter.add(member)
+        if self._rebuild is not None and self._rebuild.is_alive():
+            self._added_during_rebuild.append(member)
+
+    # ---- changes ----
+
+    def note(self, platform: str, recipients: Iterable[str]) -> None:
+        """Add opt-outs committed by this process to the filter."""
+        with self._lock:
+            if self._filter is None:
+                return  # the first load reads them
+            for recipient in recipients:
+                self._add(f"{platform}:{opt_out_key(recipient, platform)}")
+
+    def add(self, recipients: Iterable[Any], platform: str = "WhatsApp", source: str = "api",
+            reason: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Opt recipients out, one transaction per chunk. WhatsApp numbers are
+        normalized and validated; numbers already opted out count as existing.
+
+        Returns:
+            Dict[str, Any]: Import counts
+        """
+        report: Dict[str, Any] = {"received": 0, "added": 0, "existing": 0, "invalid": 0, "invalid_samples": []}
+        chunk: List[str] = []
+        for raw in recipients:
+            report["received"] += 1
+            key = opt_out_key(raw, platform)
+            if not key or (platform == "WhatsApp" and not (is_valid_phone_number(key) and len(key) >= 7)):
+                report["invalid"] += 1
+                if len(report["invalid_samples"]) < 10:
+                    report["invalid_samples"].append(str(raw)[:50])
+                continue
+            chunk.append(key)
+            if len(chunk) >= CHUNK_SIZE:
+                self._add_chunk(chunk, platform, source, reason, report)
+                chunk = []
+        self._add_chunk(chunk, platform, source, reason, report)
+        return report
+
+    def _add_chunk(self, keys: List[str], platform: str, source: str, reason: Optional[str],
+                   report: Dict[str, Any]) -> None:
+        unique = list(dict.fromkeys(keys))
+        inserted = 0
+        if unique:
+            now = datetime.now(timezone.utc)
+            with get_db_session() as session:
+                inserted = self._insert(session, [
+                    {"platform": platform, "recipient": key, "source": source,
+                     "reason": (reason or "")[:200] or None, "created_at": now}
+                    for key in unique
+                ])
+                session.commit()
+            self.note(platform, unique)
+        report["added"] += inserted
+        report["existing"] += len(keys) - inserted
+
+    @staticmethod
+    def _insert(session: Session, rows: List[Dict[str, Any]]) -> int:
+        """Insert opt-out rows, ignoring recipients already opted out. Returns how many were new."""
+        stmt = upsert_insert(session, OptOut)
+        if stmt is None:
+            stored = set(session.query(OptOut.platform, OptOut.recipient).filter(
+                tuple_(OptOut.platform, OptOut.recipient).in_([(r["platform"], r["recipient"]) for r in rows])
+            ).all())
+            rows = [row for row in rows if (row["platform"], row["recipient"]) not in stored]
+            if rows:
+                session.execute(insert(OptOut), rows)
+            return len(rows)
+        stmt = stmt.on_conflict_do_nothing(index_elements=["platform", "recipient"])
+        return len(session.execute(stmt.returning(OptOut.id), rows).all())
+
+    def remove(self, recipient: str, platform: str = "WhatsApp") -> bool:
+        """Opt a recipient back in. Returns False if they were not opted out."""
+        with get_db_session() as session:
+            removed = session.execute(delete(OptOut).where(
+                OptOut.platform == platform, OptOut.recipient == opt_out_key(recipient, platform)
+            )).rowcount
+            session.commit()
+        if removed:
+            self._removed += 1
+        return bool(removed)
+
+    # ---- lookups ----
+
+    def might_block(self, recipient: str, platform: str = "WhatsApp") -> bool:
+        """Filter-only check: False means not opted out; True needs confirm()."""
+        self.refresh()
+        self._stats["checks"] += 1
+        hit = f"{platform}:{opt_out_key(recipient, platform)}" in self._filter
+        if hit:
+            self._stats["filter_hits"] += 1
+        return hit
+
+    def confirm(self, session: Session, recipient: str, platform: str = "WhatsApp") -> bool:
+        """Exact check of a filter hit with `session`."""
+        blocked = session.query(OptOut.id).filter(
+            OptOut.platform == platform, OptOut.recipient == opt_out_key(recipient, platform)
+        ).first() is not None
+        if blocked:
+            self._stats["blocked"] += 1
+        return blocked
+
+    def is_blocked(self, recipient: str, platform: str = "WhatsApp") -> bool:
+        """True if the recipient has opted out. Queries only on a filter hit."""
+        if not self.might_block(recipient, platform):
+            return False
+        with get_db_session() as session:
+            return self.confirm(session, recipient, platform)
+
+    def blocked_among(self, recipients: Iterable[str], platform: str = "WhatsApp") -> Set[str]:
+        """The opted-out recipients among `recipients`, as given. One query per chunk of filter hits."""
+        self.refresh()
+        current = self._filter
+        hits: Dict[str, List[str]] = {}
+        checked = 0
+        for recipient in recipients:
+            checked += 1
+            key = opt_out_key(recipient, platform)
+            if f"{platform}:{key}" in current:
+                hits.setdefault(key, []).append(recipient)
+        self._stats["checks"] += checked
+        self._stats["filter_hits"] += len(hits)
+        if not hits:
+            return set()
+        keys = list(hits)
+        blocked: Set[str] = set()
+        with get_db_session() as session:
+            for start in range(0, len(keys), CHUNK_SIZE):
+                stored = session.query(OptOut.recipient).filter(
+                    OptOut.platform == platform, OptOut.recipient.in_(keys[start:start + CHUNK_SIZE])
+                )
+                for (key,) in stored:
+                    blocked.update(hits[key])
+        self._stats["blocked"] += len(blocked)
+        return blocked
+
+    def stats(self) -> Dict[str, Any]:
+        """Filter size and fill, lookup counters and rebuild state."""
+        current = self._filter
+        return dict(
+            self._stats,
+            filter=current.stats() if current is not None else None,
+            rebuilding=self._rebuild is not None and self._rebuild.is_alive(),
+            removed_since_build=self._removed,
+            watermark=datetime.fromtimestamp(self._watermark, timezone.utc).isoformat() if self._watermark else None,
+        )
+
+
+# Global opt-out blocklist
+blocklist = Blocklist(
+    error_rate=config.opt_out.error_rate,
+    min_capacity=config.opt_out.min_capacity,
+    check_interval=config.opt_out.check_interval,
+    rebuild_interval=config.opt_out.rebuild_interval,
+    keywords=config.opt_out.keywords,
+    optin_keywords=config.opt_out.optin_keywords
+)
+
+
+def get_blocklist() -> Blocklist:
+    """Get the global opt-out blocklist."""
+    return blocklist
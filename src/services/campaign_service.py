@@ -0,0 +1,604 @@
+"""
+Campaign Service for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Bulk WhatsApp template sends. A campaign holds a template and its
+components, and optionally a free-form text that recipients still inside
+their customer-service window get instead (checked in memory per send against
+the service window index); recipients are imported from JSON lists or streamed CSV in
+chunks, normalized to E.164, validated and deduplicated against the
+campaign by one INSERT ... ON CONFLICT DO NOTHING per chunk, so lists of any
+size are imported in bounded memory. A runner then claims recipients a chunk
+at a time, commits a 'queued' outgoing message per recipient before calling
+Meta, fans the sends out over a bounded thread pool through the outbound
+sender and the shared per-number rate limiters, and records every chunk's
+results (recipient rows, campaign counters and message statuses) in one
+transaction. Retryable failures wait out an exponential backoff before they
+are claimed again. Recipients who opted out are checked per chunk against
+the blocklist and marked 'opted_out' without a send. Campaigns can be paused
+and resumed; progress and throughput are derived from the counters.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import csv
+import logging
+import threading
+
+from sqlalchemy import and_, bindparam, func, insert, or_, update
+
+from ..config import config
+from ..database import Campaign, CampaignRecipient, Message, get_db_session, upsert_insert
+from ..utils import json_codec
+from ..utils.rate_limit import KeyedRateLimiter
+from ..utils.security import is_valid_phone_number, sanitize_input
+from ..utils.timestamps import as_utc
+from .message_service import get_message_service
+from .outbound_service import OutboundSender, SendError, get_send_limiters, sender_key_for
+from .service_window import get_service_window
+from .blocklist import get_blocklist
+
+logger = logging.getLogger(__name__)
+
+# CSV header names recognised as the phone number column
+PHONE_COLUMNS = ("phone", "phone_number", "to", "recipient", "number", "msisdn", "wa_id")
+
+_PHONE_NOISE = str.maketrans("", "", " -().\t")
+
+
+def normalize_recipient(raw: Any) -> Optional[str]:
+    """Normalize a phone number to E.164 with a leading '+', or None if it is not one."""
+    if raw is None:
+        return None
+    number = str(raw).strip().translate(_PHONE_NOISE)
+    if number.startswith("00"):
+        number = number[2:]
+    if not number.startswith("+"):
+        number = "+" + number
+    return number if is_valid_phone_number(number) and len(number) >= 8 else None
+
+
+def iter_csv_numbers(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Yield the phone number column of CSV lines. A first row naming one of
+    PHONE_COLUMNS is a header; otherwise the first column is used.
+    """
+    reader = csv.reader(lines)
+    column = 0
+    for index, row in enumerate(reader):
+        if not row:
+            continue
+        if index == 0:
+            header = [cell.strip().lower() for cell in row]
+            match = next((i for i, name in enumerate(header) if name in PHONE_COLUMNS), None)
+            if match is not None:
+                column = match
+                continue
+        if column < len(row):
+            yield row[column]
+
+
+class CampaignService:
+    """
+    Campaign records: creation, recipient import, state changes and progress.
+    Signature: 8598
+    """
+
+    # Allowed transitions: target status -> statuses it can be reached from
+    TRANSITIONS = {
+        "running": ("draft", "paused"),
+        "paused": ("running",),
+    }
+
+    def __init__(self):
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+
+    def create_campaign(
+        self,
+        name: str,
+        agent: str,
+        template_name: str,
+        language_code: str = "en_US",
+        components: Optional[List[Dict[str, Any]]] = None,
+        concurrency: Optional[int] = None,
+        text: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Create a draft campaign. `text`, when given, is sent instead of the
+        template to recipients whose customer-service window is open.
+
+        Raises:
+            ValueError: If a required field is missing or components is not a list
+        """
+        name, agent, template_name = sanitize_input(name or ""), sanitize_input(agent or ""), (template_name or "").strip()
+        if not name or not agent or not template_name:
+            raise ValueError("name, agent and template are required")
+        if components is not None and not isinstance(components, list):
+            raise ValueError("components must be a list")
+        concurrency = max(1, min(int(concurrency or config.campaign.concurrency), config.campaign.max_concurrency))
+        with get_db_session() as session:
+            campaign = Campaign(
+                name=name[:200],
+                agent=agent[:100],
+                template_name=template_name[:200],
+                language_code=(language_code or "en_US")[:20],
+                components=json_codec.dumps(components) if components else None,
+                text=(str(text).strip() or None) if text else None,
+                concurrency=concurrency,
+            )
+            session.add(campaign)
+            session.commit()
+            self.logger.info(f"Campaign created - ID: {campaign.id}, Template: {template_name}")
+            return campaign.to_dict()
+
+    def add_recipients(self, campaign_id: int, numbers: Iterable[Any]) -> Optional[Dict[str, Any]]:
+        """
+        Normalize, validate and insert recipients, one transaction per chunk.
+        Numbers already in the campaign (or repeated in the input) count as
+        duplicates.
+
+        Returns:
+            Optional[Dict[str, Any]]: Import counts, or None if the campaign does not exist
+
+        Raises:
+            ValueError: If the campaign is already completed
+        """
+        with get_db_session() as session:
+            status = session.query(Campaign.status).filter(Campaign.id == campaign_id).scalar()
+        if status is None:
+            return None
+        if status == "completed":
+            raise ValueError("campaign is completed")
+
+        report: Dict[str, Any] = {"received": 0, "accepted": 0, "duplicates": 0, "invalid": 0, "invalid_samples": []}
+        chunk: List[str] = []
+        invalid = 0
+        for raw in numbers:
+            report["received"] += 1
+            number = normalize_recipient(raw)
+            if number is None:
+                invalid += 1
+                if len(report["invalid_samples"]) < 10:
+                    report["invalid_samples"].append(str(raw)[:50])
+                continue
+            chunk.append(number)
+            if len(chunk) >= config.campaign.import_chunk_size:
+                self._insert_chunk(campaign_id, chunk, invalid, report)
+                chunk, invalid = [], 0
+        self._insert_chunk(campaign_id, chunk, invalid, report)
+        return report
+
+    def _insert_chunk(self, campaign_id: int, numbers: List[str], invalid: int, report: Dict[str, Any]) -> None:
+        """Insert one chunk of normalized numbers and add its counts to the campaign and `report`."""
+        unique = list(dict.fromkeys(numbers))
+        inserted = 0
+        with get_db_session() as session:
+            if unique:
+                rows = [{"campaign_id": campaign_id, "recipient": number, "status": "pending", "attempts": 0}
+                        for number in unique]
+                stmt = upsert_insert(session, CampaignRecipient)
+                if stmt is None:
+                    stored = {r for (r,) in session.query(CampaignRecipient.recipient).filter(
+                        CampaignRecipient.campaign_id == campaign_id, CampaignRecipient.recipient.in_(unique))}
+                    rows = [row for row in rows if row["recipient"] not in stored]
+                    if rows:
+                        session.execute(insert(CampaignRecipient), rows)
+                    inserted = len(rows)
+                else:
+                    stmt = stmt.on_conflict_do_nothing(index_elements=["campaign_id", "recipient"])
+                    inserted = len(session.execute(stmt.returning(CampaignRecipient.id), rows).all())
+            duplicates = len(numbers) - inserted
+            session.execute(update(Campaign).where(Campaign.id == campaign_id).values(
+                total=Campaign.total + inserted,
+                duplicates=Campaign.duplicates + duplicates,
+                invalid=Campaign.invalid + invalid,
+            ))
+            session.commit()
+        report["accepted"] += inserted
+        report["duplicates"] += duplicates
+        report["invalid"] += invalid
+
+    def set_status(self, campaign_id: int, status: str) -> bool:
+        """Move a campaign to 'running' or 'paused'. Returns False if the transition is not allowed."""
+        allowed = self.TRANSITIONS.get(status)
+        if not allowed:
+            return False
+        now = datetime.now(timezone.utc)
+        with get_db_session() as session:
+            campaign = session.get(Campaign, campaign_id)
+            if campaign is None or campaign.status not in allowed:
+                return False
+            values: Dict[str, Any] = {"status": status}
+            if status == "running":
+                values.update(resumed_at=now, finished_at=None)
+                if campaign.started_at is None:
+                    values["started_at"] = now
+            else:
+                values.update(active_seconds=self._active_seconds(campaign, now), resumed_at=None)
+            # Conditional on the status read above; a concurrent change wins
+            result = session.execute(update(Campaign).where(
+                Campaign.id == campaign_id, Campaign.status == campaign.status
+            ).values(**values))
+            session.commit()
+            return bool(result.rowcount)
+
+    def complete(self, campaign_id: int) -> bool:
+        """Mark a running campaign completed once no recipient is pending or in flight."""
+        now = datetime.now(timezone.utc)
+        with get_db_session() as session:
+            open_rows = session.query(func.count(CampaignRecipient.id)).filter(
+                CampaignRecipient.campaign_id == campaign_id,
+                CampaignRecipient.status.in_(("pending", "sending"))
+            ).scalar()
+            if open_rows:
+                return False
+            campaign = session.get(Campaign, campaign_id)
+            if campaign is None or campaign.status != "running":
+                return False
+            session.execute(update(Campaign).where(Campaign.id == campaign_id, Campaign.status == "running").values(
+                status="completed", finished_at=now, resumed_at=None,
+                active_seconds=self._active_seconds(campaign, now)
+            ))
+            session.commit()
+        self.logger.info(f"Campaign completed - ID: {campaign_id}")
+        return True
+
+    def get_progress(self, campaign_id: int) -> Optional[Dict[str, Any]]:
+        """Campaign record with recipient counts by status, percent done, throughput and ETA."""
+        now = datetime.now(timezone.utc)
+        with get_db_session() as session:
+            campaign = session.get(Campaign, campaign_id)
+            if campaign is None:
+                return None
+            counts = dict(session.query(CampaignRecipient.status, func.count()).filter(
+                CampaignRecipient.campaign_id == campaign_id
+            ).group_by(CampaignRecipient.status).all())
+            result = campaign.to_dict()
+            active = self._active_seconds(campaign, now)
+
+        done = campaign.sent + campaign.failed
+        remaining = counts.get("pending", 0) + counts.get("sending", 0)
+        throughput = campaign.sent / active if active else 0.0
+        result["progress"] = {
+            "by_status": counts,
+            "done": done,
+            "remaining": remaining,
+            "percent": round(100.0 * done / campaign.total, 1) if campaign.total else 0.0,
+            "active_seconds": round(active, 1),
+            "sends_per_second": round(throughput, 2),
+            "eta_seconds": round(remaining / throughput, 1) if throughput and remaining else None,
+        }
+        return result
+
+    def get_recipients(self, campaign_id: int, status: Optional[str] = None, limit: int = 100,
+                       offset: int = 0) -> List[Dict[str, Any]]:
+        """Per-recipient results, optionally filtered by status."""
+        with get_db_session() as session:
+            query = session.query(CampaignRecipient).filter(CampaignRecipient.campaign_id == campaign_id)
+            if status:
+                query = query.filter(CampaignRecipient.status == status)
+            rows = query.order_by(CampaignRecipient.id).offset(offset).limit(limit).all()
+            return [row.to_dict() for row in rows]
+
+    @staticmethod
+    def _active_seconds(campaign: Campaign, now: datetime) -> float:
+        """Running time across all runs, including the current one."""
+        active = float(campaign.active_seconds or 0)
+        if campaign.status == "running" and campaign.resumed_at is not None:
+            active += max(0.0, (now - as_utc(campaign.resumed_at)).total_seconds())
+        return active
+
+
+class CampaignRunner:
+    """
+    Sends running campaigns in the background.
+    Signature: 8598
+
+    One thread per running campaign claims `chunk_size` recipients with a
+    lease and sends them over a pool of the campaign's `concurrency`
+    threads, each waiting for a token of the sending number before calling
+    Meta. Each recipient's outgoing message is committed as 'queued' before
+    its send, so no send goes unlogged. Results are written per chunk, so
+    pausing takes effect after the chunk in flight. A crashed run's claims
+    are sent again once their lease expires, reusing their queued messages;
+    like the outbox relay, delivery is at least once. A send whose response
+    timed out is marked 'unconfirmed' rather than retried.
+    """
+
+    def __init__(
+        self,
+        sender: OutboundSender,
+        limiters: Optional[Dict[str, KeyedRateLimiter]] = None,
+        chunk_size: int = 100,
+        lease_seconds: int = 120,
+        max_attempts: int = 3,
+        poll_interval: float = 1.0,
+        defer_seconds: Optional[float] = None,
+        retry_backoff: float = 2.0,
+        retry_backoff_max: float = 300.0
+    ):
+        self.sender = sender
+        self.limiters = limiters if limiters is not None else get_send_limiters()
+        self.chunk_size = max(1, chunk_size)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        # Sends refused by an open Graph circuit wait out its open period without spending an attempt
+        self.defer_seconds = config.graph.breaker_open_seconds if defer_seconds is None else defer_seconds
+        self.retry_backoff = retry_backoff  # seconds, doubled per attempt
+        self.retry_backoff_max = retry_backoff_max
+        self.service = get_campaign_service()
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._stop = threading.Event()
+        self._runs: Dict[int, threading.Thread] = {}
+        self._lock = threading.Lock()
+        self._stats = {"sent": 0, "failed": 0, "retried": 0, "deferred": 0, "opted_out": 0, "unconfirmed": 0}
+
+    def start(self, campaign_id: int) -> None:
+        """Run a campaign in a background thread unless this process already runs it."""
+        with self._lock:
+            thread = self._runs.get(campaign_id)
+            if thread is not None and thread.is_alive():
+                return
+            self._stop.clear()
+            thread = threading.Thread(target=self.run, args=(campaign_id,), name=f"campaign-{campaign_id}", daemon=True)
+            self._runs[campaign_id] = thread
+            thread.start()
+
+    def resume_running(self) -> int:
+        """Start every campaign left in 'running' (after a restart). Returns how many."""
+        with get_db_session() as session:
+            ids = [cid for (cid,) in session.query(Campaign.id).filter(Campaign.status == "running")]
+        for campaign_id in ids:
+            self.start(campaign_id)
+        return len(ids)
+
+    def stop(self, timeout: Optional[float] = 5.0) -> None:
+        """Stop all runs after their current chunk."""
+        self._stop.set()
+        with self._lock:
+            threads = list(self._runs.values())
+            self._runs = {}
+        for thread in threads:
+            thread.join(timeout)
+
+    def run(self, campaign_id: int) -> None:
+        """Send a campaign until it is completed, paused or the runner stops."""
+        with get_db_session() as session:
+            campaign = session.get(Campaign, campaign_id)
+            if campaign is None:
+                return
+            template = {"name": campaign.template_name, "language": {"code": campaign.language_code}}
+            if campaign.components:
+                template["components"] = json_codec.loads(campaign.components)
+            agent, platform, concurrency, text = campaign.agent, campaign.platform, campaign.concurrency, campaign.text
+
+        sender_key = sender_key_for(platform)
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"campaign-{campaign_id}-send") as pool:
+            while not self._stop.is_set():
+                try:
+                    if not self._is_running(campaign_id):
+                        break
+                    batch = self.claim(campaign_id, self.chunk_size)
+                    if not batch:
+                        if self.service.complete(campaign_id):
+                            break
+                        # Remaining rows are leased by another process or backing off
+                        self._stop.wait(self.poll_interval)
+                        continue
+                    blocked = get_blocklist().blocked_among([row[1] for row in batch], platform)
+                    results = [self._opted_out(row) for row in batch if row[1] in blocked]
+                    sends = self.log_queued(campaign_id, agent, platform, template["name"], text, [
+                        (row, self.payload(row[1], platform, template, text)) for row in batch if row[1] not in blocked
+                    ])
+                    results += pool.map(lambda send: self._send_one(send[0], platform, sender_key, send[1]), sends)
+                    self.record(campaign_id, results)
+                    if any(result["deferred"] for result in results):
+                        # Graph is refusing calls; the next chunk would only be deferred too
+                        self._stop.wait(self.defer_seconds)
+                except Exception as e:
+                    self.logger.error(f"Campaign {campaign_id} run error: {e}")
+                    self._stop.wait(self.poll_interval)
+
+    def claim(self, campaign_id: int, limit: int) -> List[Tuple[int, str, int, Optional[int]]]:
+        """Lease up to `limit` recipients. Returns (id, recipient, attempts, message_pk) tuples."""
+        now = datetime.now(timezone.utc)
+        ready = and_(CampaignRecipient.campaign_id == campaign_id, or_(
+            and_(CampaignRecipient.status == "pending",
+                 or_(CampaignRecipient.available_at.is_(None), CampaignRecipient.available_at <= now)),
+            and_(CampaignRecipient.status == "sending",
+                 CampaignRecipient.claimed_at < now - timedelta(seconds=self.lease_seconds))
+        ))
+        with get_db_session() as session:
+            ids = [rid for (rid,) in session.query(CampaignRecipient.id).filter(ready)
+                   .order_by(CampaignRecipient.id).limit(limit)]
+            if not ids:
+                return []
+            # Conditional on `ready`, so rows another runner won in between are skipped
+            claimed = session.execute(
+                update(CampaignRecipient).where(CampaignRecipient.id.in_(ids), ready)
+                .values(status="sending", claimed_at=now)
+                .returning(CampaignRecipient.id, CampaignRecipient.recipient, CampaignRecipient.attempts,
+                           CampaignRecipient.message_pk)
+            ).all()
+            session.commit()
+        return [tuple(row) for row in claimed]
+
+    @staticmethod
+    def payload(recipient: str, platform: str, template: Dict[str, Any], text: Optional[str] = None) -> Dict[str, Any]:
+        """The campaign's text while the recipient's service window is open, else its template."""
+        if text and get_service_window().is_open(recipient, platform):
+            return {"messaging_product": "whatsapp", "to": recipient.lstrip("+"), "type": "text", "text": {"body": text}}
+        return {"messaging_product": "whatsapp", "to": recipient.lstrip("+"), "type": "template", "template": template}
+
+    def log_queued(self, campaign_id: int, agent: str, platform: str, template_name: str, text: Optional[str],
+                   sends: List[Tuple[Tuple[int, str, int, Optional[int]], Dict[str, Any]]]
+                   ) -> List[Tuple[Tuple[int, str, int, Optional[int]], Dict[str, Any]]]:
+        """
+        Commit a 'queued' outgoing message for each claimed recipient before
+        any of them is sent, in one transaction. Recipients reclaimed after a
+        crash reuse the message written for them then.
+
+        Returns:
+            The sends, each row carrying its message_pk
+        """
+        if not sends:
+            return sends
+        service = get_message_service()
+        now = datetime.now(timezone.utc)
+        new, reused = [], []
+        for row, payload in sends:
+            extra_data = {"provider": "cloud_api", "campaign_id": campaign_id}
+            if payload["type"] == "text":
+                content = text
+            else:
+                content, extra_data["template"] = f"[Template] {template_name}", template_name
+            if row[3] is None:
+                new.append({"agent": agent, "platform": platform, "recipient": row[1], "content": content,
+                            "message_type": payload["type"], "is_incoming": False, "extra_data": extra_data})
+            else:
+                reused.append({"b_pk": row[3], "b_content": content, "b_type": payload["type"],
+                               "b_extra": json_codec.dumps(extra_data)})
+
+        messages = Message.__table__
+        with get_db_session() as session:
+            new = service.stage_queued(session, new)
+            pks = iter(row["id"] for row in new)
+            sends = [((row[0], row[1], row[2], next(pks)) if row[3] is None else row, payload)
+                     for row, payload in sends]
+            if new:
+                table = CampaignRecipient.__table__
+                session.connection().execute(
+                    update(table).where(table.c.id == bindparam("b_id")).values(message_pk=bindparam("b_pk")),
+                    [{"b_id": row[0], "b_pk": row[3]} for row, _ in sends]
+                )
+            if reused:
+                # The window may have changed since; the log follows what is sent now
+                session.connection().execute(update(messages).where(
+                    messages.c.id == bindparam("b_pk"), messages.c.status == "queued"
+                ).values(content=bindparam("b_content"), message_type=bindparam("b_type"),
+                         extra_data=bindparam("b_extra"), updated_at=now), reused)
+            session.commit()
+        service.remember_batch(set(), new)
+        return sends
+
+    def record(self, campaign_id: int, results: List[Dict[str, Any]]) -> None:
+        """Write one chunk's outcomes, campaign counters and message statuses in one transaction."""
+        now = datetime.now(timezone.utc)
+        params, outcomes = [], []
+        sent = dead = retried = deferred = opted_out = unconfirmed = 0
+        for result in results:
+            attempts = result["attempts"] + 1
+            available_at = None
+            if result["skipped"]:
+                status, attempts = "pending", result["attempts"]
+            elif result["deferred"]:
+                status, attempts = "pending", result["attempts"]
+                available_at = now + timedelta(seconds=self.defer_seconds)
+                deferred += 1
+            elif result.get("indeterminate"):
+                # Meta may have accepted it: held for reconciliation, never resent
+                status = "unconfirmed"
+                unconfirmed += 1
+            elif result.get("opted_out"):
+                status, attempts = "opted_out", result["attempts"]
+                dead += 1
+                opted_out += 1
+            elif result["error"] is None:
+                status = "sent"
+                sent += 1
+            elif result["permanent"] or attempts >= self.max_attempts:
+                status = "failed"
+                dead += 1
+            else:
+                status = "pending"
+                retried += 1
+                delay = min(self.retry_backoff_max, self.retry_backoff * (2 ** (attempts - 1)))
+                available_at = now + timedelta(seconds=delay)
+            params.append({
+                "b_id": result["id"], "b_status": status, "b_message_id": result["message_id"],
+                "b_attempts": attempts, "b_error": result["error"], "b_sent_at": now if status == "sent" else None,
+                "b_available_at": available_at,
+            })
+            if result["message_pk"] is not None and status not in ("pending", "unconfirmed"):
+                done = status == "sent"
+                outcomes.append({
+                    "b_pk": result["message_pk"], "b_status": "sent" if done else "failed",
+                    "b_message_id": result["message_id"], "b_sent_at": now if done else None,
+                    "b_failed_at": None if done else now,
+                })
+
+        table = CampaignRecipient.__table__
+        stmt = update(table).where(table.c.id == bindparam("b_id")).values(
+            status=bindparam("b_status"), message_id=bindparam("b_message_id"), attempts=bindparam("b_attempts"),
+            error=bindparam("b_error"), sent_at=bindparam("b_sent_at"), available_at=bindparam("b_available_at"),
+            claimed_at=None
+        )
+        messages = Message.__table__
+        with get_db_session() as session:
+            session.connection().execute(stmt, params)
+            session.execute(update(Campaign).where(Campaign.id == campaign_id).values(
+                sent=Campaign.sent + sent, failed=Campaign.failed + dead
+            ))
+            if outcomes:
+                # A message leaves 'queued' once, as in the outbox
+                session.connection().execute(update(messages).where(
+                    messages.c.id == bindparam("b_pk"), messages.c.status == "queued"
+                ).values(status=bindparam("b_status"), message_id=bindparam("b_message_id"),
+                         sent_at=bindparam("b_sent_at"), failed_at=bindparam("b_failed_at"), updated_at=now),
+                    outcomes)
+            session.commit()
+        with self._lock:
+            self._stats["sent"] += sent
+            self._stats["failed"] += dead
+            self._stats["retried"] += retried
+            self._stats["deferred"] += deferred
+            self._stats["opted_out"] += opted_out
+            self._stats["unconfirmed"] += unconfirmed
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters since start and the campaigns running in this process."""
+        with self._lock:
+            running = [cid for cid, thread in self._runs.items() if thread.is_alive()]
+            return dict(self._stats, running=running)
+
+    def _is_running(self, campaign_id: int) -> bool:
+        with get_db_session() as session:
+            return session.query(Campaign.status).filter(Campaign.id == campaign_id).scalar() == "running"
+
+    @staticmethod
+    def _opted_out(row: Tuple[int, str, int, Optional[int]]) -> Dict[str, Any]:
+        recipient_id, recipient, attempts, message_pk = row
+        return {"id": recipient_id, "recipient": recipient, "attempts": attempts, "message_pk": message_pk,
+                "type": "template", "message_id": None, "error": "recipient opted out", "permanent": True,
+                "deferred": False, "skipped": False, "opted_out": True}
+
+    def _send_one(self, row: Tuple[int, str, int, Optional[int]], platform: str, sender_key: str,
+                  payload: Dict[str, Any]) -> Dict[str, Any]:
+        recipient_id, recipient, attempts, message_pk = row
+        result = {"id": recipient_id, "recipient": recipient, "attempts": attempts, "message_pk": message_pk,
+                  "type": payload["type"], "message_id": None, "error": None, "permanent": False,
+                  "deferred": False, "skipped": False}
+        limiter = self.limiters.get(platform)
+        while limiter is not None and not limiter.acquire(sender_key, timeout=self.poll_interval):
+            if self._stop.is_set():
+                result["skipped"] = True
+                return result
+        try:
+            result["message_id"] = self.sender.deliver(platform, sender_key, payload)
+        except SendError as e:
+            result.update(error=str(e)[:1000], permanent=e.permanent, deferred=e.deferred,
+                          indeterminate=e.indeterminate)
+        except Exception as e:
+            result["error"] = str(e)[:1000]
+        return result
+
+
+# Global campaign service instance
+campaign_service = CampaignService()
+
+
+def get_campaign_service() -> CampaignService:
+    """Get the global campaign service instance."""
+    return campaign_service
@@ -0,0 +1,141 @@
+"""
+Webhook Capture for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Optional recording of raw /webhook traffic for load reproduction. Each
+delivery is appended as one JSON line (arrival time, selected headers and
+the base64 raw body, so signatures still verify) to a gzip segment. Segments
+rotate by size and age; a segment is written as `*.jsonl.gz.part` and
+renamed to `*.jsonl.gz` once closed, so readers only pick up complete files.
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+import base64
+import gzip
+import logging
+import os
+import threading
+import time
+
+from ..utils import json_codec
+
+logger = logging.getLogger(__name__)
+
+CAPTURED_HEADERS = ("Content-Type", "X-Hub-Signature-256", "User-Agent")
+SEGMENT_SUFFIX = ".jsonl.gz"
+
+
+@dataclass
+class CapturedRequest:
+    """One recorded webhook delivery."""
+    arrived_at: float
+    headers: Dict[str, str]
+    body: bytes
+
+
+class CaptureWriter:
+    """
+    Appends raw webhook deliveries to compressed, rotated segment files.
+    Signature: 8598
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024, segment_seconds: int = 3600):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._lock = threading.Lock()
+        self._file: Optional[gzip.GzipFile] = None
+        self._path: Optional[Path] = None
+        self._opened_at = 0.0
+        self._written = 0
+        self._sequence = 0
+        self.captured = 0
+
+    def record(self, body: bytes, headers: Dict[str, str], arrived_at: Optional[float] = None) -> None:
+        """Append one delivery. Never raises: capture must not break ingestion."""
+        line = json_codec.dumps_bytes({
+            "t": arrived_at if arrived_at is not None else time.time(),
+            "h": {name: headers[name] for name in CAPTURED_HEADERS if headers.get(name)},
+            "b": base64.b64encode(body).decode("ascii"),
+        }) + b"\n"
+        try:
+            with self._lock:
+                if self._file is None or self._should_rotate():
+                    self._rotate()
+                self._file.write(line)
+                self._written += len(line)
+                self.captured += 1
+        except Exception as e:
+            self.logger.error(f"Webhook capture failed: {e}")
+
+    def flush(self) -> None:
+        """Flush buffered data of the open segment to disk."""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self) -> None:
+        """Close the open segment and publish it."""
+        with self._lock:
+            self._close_segment()
+
+    def stats(self) -> Dict[str, Union[int, str, None]]:
+        """Return capture counters."""
+        return {
+            "directory": str(self.directory),
+            "captured": self.captured,
+            "segment": self._path.name if self._path else None,
+        }
+
+    def _should_rotate(self) -> bool:
+        return self._written >= self.segment_bytes or time.monotonic() - self._opened_at >= self.segment_seconds
+
+    def _rotate(self) -> None:
+        self._close_segment()
+        self._sequence += 1
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        self._path = self.directory / f"webhook-{stamp}-{os.getpid()}-{self._sequence:04d}{SEGMENT_SUFFIX}.part"
+        self._file = gzip.open(self._path, "wb", compresslevel=5)
+        self._opened_at = time.monotonic()
+        self._written = 0
+
+    def _close_segment(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        final = self._path.with_name(self._path.name[:-len(".part")])
+        self._path.rename(final)
+        self.logger.info(f"Webhook capture segment closed: {final.name}")
+        self._file = None
+        self._path = None
+
+
+def segment_paths(paths: Iterable[str]) -> List[Path]:
+    """Expand files and directories into complete capture segments, oldest first."""
+    found = []
+    for raw in paths:
+        path = Path(raw)
+        if path.is_dir():
+            found.extend(path.glob(f"*{SEGMENT_SUFFIX}"))
+        else:
+            found.append(path)
+    return sorted(found)
+
+
+def read_capture(paths: Iterable[str]) -> Iterator[CapturedRequest]:
+    """Yield captured deliveries from segment files or directories in arrival order per segment."""
+    for path in segment_paths(paths):
+        with gzip.open(path, "rb") as segment:
+            try:
+                for line in segment:
+                    if not line.strip():
+                        continue
+                    item = json_codec.loads(line)
+                    yield CapturedRequest(item["t"], item.get("h") or {}, base64.b64decode(item["b"]))
+            except EOFError:
+                # Segment cut short by a crash; everything before the tear is still usable
+                logger.warning(f"Truncated capture segment: {path}")
@@ -0,0 +1,264 @@
+"""
+Webhook Payload Extraction for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Single-pass extraction of WhatsApp Cloud API and Facebook Messenger webhook
+bodies into compact typed records. Structure checks happen during the same
+walk that collects messages and status callbacks, and per-type content is
+produced by dispatch tables instead of an if/elif chain. Both the inline
+/webhook path and the spool workers consume these records.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ..utils import json_codec
+
+WHATSAPP_OBJECT = "whatsapp_business_account"
+FACEBOOK_OBJECT = "page"
+
+
+class InboundMessage:
+    """
+    One incoming customer message.
+    Signature: 8598
+    """
+
+    __slots__ = ("platform", "sender", "message_id", "message_type", "content", "extra_data", "agent")
+
+    def __init__(
+        self,
+        platform: str,
+        sender: str,
+        message_id: Optional[str],
+        message_type: str,
+        content: str,
+        extra_data: Optional[Dict[str, Any]] = None,
+        agent: Optional[str] = None
+    ):
+        self.platform = platform
+        self.sender = sender
+        self.message_id = message_id
+        self.message_type = message_type
+        self.content = content
+        self.extra_data = extra_data
+        self.agent = agent
+
+    def to_row(self) -> Dict[str, Any]:
+        """
+        Message column values, with the same checks and truncation as
+        MessageService._normalize_record.
+
+        Raises:
+            ValueError: If the agent, sender or content is missing
+        """
+        if not self.agent or not self.sender or not self.content:
+            raise ValueError("Agent, platform, recipient, and content are required")
+        content = str(self.content).strip()
+        if not content:
+            raise ValueError("Message content cannot be empty")
+        sender = str(self.sender).strip()[:50]
+        return {
+            "agent": str(self.agent).strip()[:100],
+            "platform": self.platform,
+            "recipient": sender,
+            "content": content,
+            "message_type": self.message_type,
+            "message_id": self.message_id,
+            "sender_id": self.sender,
+            "is_incoming": True,
+            "status": "received",
+            "extra_data": json_codec.dumps(self.extra_data) if self.extra_data else None
+        }
+
+    def to_record(self) -> Dict[str, Any]:
+        """Keyword arguments for MessageService.log_message."""
+        return {
+            "agent": self.agent,
+            "platform": self.platform,
+            "recipient": self.sender,
+            "content": self.content,
+            "message_type": self.message_type,
+            "message_id": self.message_id,
+            "sender_id": self.sender,
+            "is_incoming": True,
+            "status": "received",
+            "extra_data": self.extra_data
+        }
+
+    def __repr__(self) -> str:
+        return f"InboundMessage({self.platform!r}, {self.sender!r}, {self.message_id!r}, {self.message_type!r})"
+
+
+class StatusUpdate:
+    """
+    One WhatsApp delivery status callback (sent/delivered/read/failed).
+    Signature: 8598
+    """
+
+    __slots__ = ("message_id", "status", "timestamp")
+
+    def __init__(self, message_id: Optional[str], status: Optional[str], timestamp: Optional[datetime] = None):
+        self.message_id = message_id
+        self.status = status
+        self.timestamp = timestamp
+
+    def __repr__(self) -> str:
+        return f"StatusUpdate({self.message_id!r}, {self.status!r}, {self.timestamp!r})"
+
+
+# WhatsApp message type -> (content, message_type)
+ContentHandler = Callable[[Dict[str, Any]], Tuple[str, str]]
+
+WHATSAPP_CONTENT: Dict[str, ContentHandler] = {
+    "text": lambda m: (m["text"]["body"], "text"),
+    "image": lambda m: (f"[Image message] ID: {m['image']['id']}", "image"),
+    "document": lambda m: (f"[Document] {m['document'].get('filename', 'Unknown')}", "document"),
+    "audio": lambda m: ("[Audio message]", "audio"),
+    "video": lambda m: ("[Video message]", "video"),
+}
+
+
+def _whatsapp_other(message: Dict[str, Any]) -> Tuple[str, str]:
+    return f"[{message['type'].title()} message]", message["type"]
+
+
+# WhatsApp message types whose body carries a downloadable media object
+WHATSAPP_MEDIA_TYPES = frozenset(("image", "document", "audio", "video", "sticker"))
+
+
+# Messenger message body -> (content, message_type), first matching key wins
+FACEBOOK_CONTENT: Tuple[Tuple[str, ContentHandler], ...] = (
+    ("text", lambda m: (m["text"], "text")),
+    ("attachments", lambda m: (f"[Attachment] Type: {m['attachments'][0]['type']}", "attachment")),
+)
+
+
+class PayloadExtractor:
+    """
+    Turns a decoded webhook body into InboundMessage and StatusUpdate
+    records in one walk.
+    Signature: 8598
+
+    `skip` is called with each platform message id before a record is
+    built; returning True drops the message (a Meta retry of something
+    already stored).
+    """
+
+    def __init__(self, skip: Optional[Callable[[Optional[str]], bool]] = None):
+        self.skip = skip
+        self.dispatch: Dict[str, Callable[[Dict[str, Any], List[InboundMessage], List[StatusUpdate]], None]] = {
+            WHATSAPP_OBJECT: self.extract_whatsapp,
+            FACEBOOK_OBJECT: self.extract_facebook,
+        }
+
+    def extract(self, data: Dict[str, Any]) -> Tuple[List[InboundMessage], List[StatusUpdate]]:
+        """
+        Extract messages and status callbacks from a webhook payload.
+
+        Raises:
+            ValueError: If the object type is unknown or the structure is invalid
+        """
+        messages: List[InboundMessage] = []
+        statuses: List[StatusUpdate] = []
+        self.extract_into(data, messages, statuses)
+        return messages, statuses
+
+    def extract_into(self, data: Dict[str, Any], messages: List[InboundMessage], statuses: List[StatusUpdate]) -> None:
+        """Append the records of one payload to `messages` and `statuses`."""
+        if not isinstance(data, dict):
+            raise ValueError("Webhook payload is not a JSON object")
+        handler = self.dispatch.get(data.get("object"))
+        if handler is None:
+            raise ValueError(f"Unknown object type: {data.get('object')}")
+        handler(data, messages, statuses)
+
+    def extract_whatsapp(self, data: Dict[str, Any], messages: List[InboundMessage], statuses: List[StatusUpdate]) -> None:
+        """Walk every entry and change of a WhatsApp payload."""
+        entries = data.get("entry")
+        if not isinstance(entries, list) or not entries:
+            raise ValueError("Invalid WhatsApp payload structure")
+        skip = self.skip
+        for entry in entries:
+            if not isinstance(entry, dict) or not isinstance(entry.get("changes"), list):
+                raise ValueError("Invalid WhatsApp payload structure")
+            for change in entry["changes"]:
+                if not isinstance(change, dict):
+                    raise ValueError("Invalid WhatsApp payload structure")
+                value = change.get("value") or {}
+                if not isinstance(value, dict):
+                    raise ValueError("Invalid WhatsApp payload structure")
+                incoming = value.get("messages")
+                if incoming:
+                    metadata = value.get("metadata", {})
+                    phone_number_id = metadata.get("phone_number_id")
+                    display_phone_number = metadata.get("display_phone_number")
+                    for message in incoming:
+                        sender = message["from"]
+                        message_id = message.get("id")
+                        if skip is not None and skip(message_id):
+                            continue
+                        kind = message["type"]
+                        content, message_type = WHATSAPP_CONTENT.get(kind, _whatsapp_other)(message)
+                        extra_data = {
+                            "phone_number_id": phone_number_id,
+                            "display_phone_number": display_phone_number,
+                            "message_type": kind
+                        }
+                        if kind in WHATSAPP_MEDIA_TYPES:
+                            media = message.get(kind)
+                            if isinstance(media, dict) and media.get("id"):
+                                extra_data["media_id"] = media["id"]
+                                extra_data["mime_type"] = media.get("mime_type")
+                        messages.append(InboundMessage(
+                            "WhatsApp", sender, message_id, message_type, content, extra_data
+                        ))
+                for status in value.get("statuses") or ():
+                    try:
+                        timestamp = datetime.fromtimestamp(int(status["timestamp"]), timezone.utc)
+                    except (KeyError, TypeError, ValueError):
+                        timestamp = None
+                    statuses.append(StatusUpdate(status.get("id"), status.get("status"), timestamp))
+
+    def extract_facebook(self, data: Dict[str, Any], messages: List[InboundMessage], statuses: List[StatusUpdate]) -> None:
+        """Walk every entry of a Facebook Messenger payload."""
+        entries = data.get("entry")
+        if not isinstance(entries, list) or not entries:
+            raise ValueError("Invalid Facebook payload structure")
+        skip = self.skip
+        for entry in entries:
+            if not isinstance(entry, dict):
+                raise ValueError("Invalid Facebook payload structure")
+            for event in entry.get("messaging") or ():
+                if not isinstance(event, dict):
+                    raise ValueError("Invalid Facebook payload structure")
+                sender = event["sender"]["id"]
+                if "message" in event:
+                    message = event["message"]
+                    message_id = message.get("mid")
+                    if skip is not None and skip(message_id):
+                        continue
+                    content, message_type = "[Unknown message type]", "unknown"
+                    for key, handler in FACEBOOK_CONTENT:
+                        if key in message:
+                            content, message_type = handler(message)
+                            break
+                    extra_data = {"recipient_id": event.get("recipient", {}).get("id"), "message_type": message_type}
+                    if message_type == "attachment":
+                        url = (message["attachments"][0].get("payload") or {}).get("url")
+                        if url:
+                            extra_data["media_url"] = url
+                    messages.append(InboundMessage(
+                        "Facebook", sender, message_id, message_type, content, extra_data
+                    ))
+                elif "postback" in event:
+                    postback = event["postback"]
+                    message_id = postback.get("mid")
+                    if skip is not None and skip(message_id):
+                        continue
+                    messages.append(InboundMessage(
+                        "Facebook", sender, message_id, "postback",
+                        f"[Postback] {postback['title']}: {postback['payload']}",
+                        {"postback_title": postback["title"], "postback_payload": postback["payload"]},
+                        agent="Agent1"
+                    ))
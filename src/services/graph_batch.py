@@ -0,0 +1,271 @@
+"""
+Graph API Batch Coalescing for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Under campaign or auto-reply load most Graph calls are small message sends.
+GraphBatcher gathers the sends submitted within a short window (a few ms)
+and posts them as one Graph batch request (up to Meta's 50 requests per
+batch), so a burst of sends pays one round trip instead of one each. Every
+caller gets a Future resolving to that item's own response; items Meta
+throttled or did not process are retried individually with the client's
+retry policy. Every future is settled, with a response or an exception,
+however the batch fails. Enable with GRAPH_BATCH_WINDOW_MS.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Union
+from urllib.parse import urlencode
+import logging
+import threading
+import time
+
+import requests
+
+from ..config import config
+from ..utils import json_codec
+from .graph_client import GraphClient, RETRY_STATUSES, get_graph_client
+
+logger = logging.getLogger(__name__)
+
+BATCH_LIMIT = 50  # Graph's maximum requests per batch
+
+
+class BatchResponse:
+    """
+    One batch item's response, shaped like the parts of requests.Response
+    callers use: status_code, text, headers, json().
+    Signature: 8598
+    """
+
+    def __init__(self, status_code: int, text: str, headers: Optional[Dict[str, str]] = None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def json(self) -> Any:
+        return json_codec.loads(self.text)
+
+
+class _BatchItem:
+    __slots__ = ("path", "payload", "token", "future", "attempt", "queued_at")
+
+    def __init__(self, path: str, payload: Dict[str, Any], token: Optional[str], future: Future):
+        self.path = path
+        self.payload = payload
+        self.token = token
+        self.future = future
+        self.attempt = 0
+        self.queued_at = time.monotonic()
+
+
+def encode_batch_body(payload: Dict[str, Any]) -> str:
+    """Form-encode a JSON payload for a batch item; nested values are sent as JSON."""
+    return urlencode({
+        key: value if isinstance(value, str) else json_codec.dumps(value)
+        for key, value in payload.items()
+    })
+
+
+class GraphBatcher:
+    """
+    Coalesces POSTs into Graph batch requests.
+    Signature: 8598
+
+    submit() queues a POST and returns a Future; a flusher thread sends the
+    queue once the oldest item has waited `window_ms` or `max_batch` items
+    are waiting, one batch per access token, on up to `workers` concurrent
+    batch requests.
+    """
+
+    def __init__(
+        self,
+        graph: Optional[GraphClient] = None,
+        window_ms: float = 5.0,
+        max_batch: int = BATCH_LIMIT,
+        workers: int = 4
+    ):
+        self.graph = graph or get_graph_client()
+        self.window = window_ms / 1000
+        self.max_batch = max(1, min(max_batch, BATCH_LIMIT))
+        self.workers = max(1, workers)
+        # Longest an item can take: every item attempt waits a window, then a batch request
+        # that itself retries with the client's timeouts and backoff
+        retry = self.graph.retry
+        attempts = retry.max_retries + 1
+        request = attempts * sum(self.graph.timeout) + retry.max_retries * retry.backoff_max
+        self.result_timeout = attempts * (self.window + request + retry.backoff_max)
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._pending: List[_BatchItem] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stats = {"batches": 0, "items": 0, "item_retries": 0, "batch_errors": 0}
+
+    def submit(self, path: str, payload: Dict[str, Any], token: Optional[str] = None,
+               token_in_query: bool = False) -> "Future[BatchResponse]":
+        """
+        Queue a POST of `payload` to `path` (e.g. '<phone_id>/messages').
+
+        `token_in_query` is accepted for call-site compatibility with
+        GraphClient.post: a batch always carries its token once, for all items.
+        """
+        future: Future = Future()
+        self._enqueue(_BatchItem(path, payload, token, future))
+        return future
+
+    def post(self, path: str, payload: Dict[str, Any], token: Optional[str] = None,
+             token_in_query: bool = False, **kwargs: Any) -> Union[BatchResponse, requests.Response]:
+        """
+        Blocking submit, a drop-in for GraphClient.post on send paths.
+
+        Raises:
+            TimeoutError: If no response came within result_timeout (the item may have been sent)
+        """
+        if kwargs:
+            # Per-call request options (headers, verify, ...) can't be honoured inside a batch
+            return self.graph.post(path, payload, token=token, token_in_query=token_in_query, **kwargs)
+        return self.submit(path, payload, token).result(timeout=self.result_timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        """Batch and item counters, average batch size and the queue length."""
+        with self._cond:
+            stats = dict(self._stats, pending=len(self._pending), window_ms=self.window * 1000)
+        stats["avg_batch"] = round(stats["items"] / stats["batches"], 1) if stats["batches"] else 0.0
+        return stats
+
+    def close(self) -> None:
+        """Send what is queued, then stop the flusher."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(5.0)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def _enqueue(self, item: _BatchItem) -> None:
+        with self._cond:
+            if self._closed:
+                item.future.set_exception(RuntimeError("Graph batcher is closed"))
+                return
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="graph-batch")
+                self._thread = threading.Thread(target=self._run, name="graph-batcher", daemon=True)
+                self._thread.start()
+            self._pending.append(item)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # Let the window fill unless it is already full or we are closing
+                deadline = self._pending[0].queued_at + self.window
+                while len(self._pending) < self.max_batch and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                items, self._pending = self._pending, []
+            groups: Dict[Optional[str], List[_BatchItem]] = {}
+            for item in items:
+                groups.setdefault(item.token, []).append(item)
+            for token, group in groups.items():
+                for start in range(0, len(group), self.max_batch):
+                    self._executor.submit(self._send, token, group[start:start + self.max_batch])
+
+    def _send(self, token: Optional[str], items: List[_BatchItem]) -> None:
+        batch = [
+            {"method": "POST", "relative_url": item.path, "body": encode_batch_body(item.payload)}
+            for item in items
+        ]
+        error: Optional[Exception] = None
+        try:
+            resp = self.graph.post("", {"batch": batch, "include_headers": True}, token=token)
+            body = resp.json() if resp.status_code < 400 else None
+        except requests.RequestException as e:
+            error = e
+        except ValueError as e:
+            error = requests.RequestException(f"Invalid batch response: {e}")
+        except Exception as e:
+            # Anything else still settles every caller's future
+            error = e
+        if error is not None:
+            self._count("batch_errors")
+            for item in items:
+                item.future.set_exception(error)
+            return
+        with self._cond:
+            self._stats["batches"] += 1
+            self._stats["items"] += len(items)
+        if not isinstance(body, list):
+            # The batch itself failed (the client already retried 429/5xx): every item shares its response
+            self._count("batch_errors")
+            for item in items:
+                item.future.set_result(BatchResponse(resp.status_code, resp.text, dict(resp.headers)))
+            return
+        for index, item in enumerate(items):
+            try:
+                response = self._item_response(body[index] if index < len(body) else None)
+            except (AttributeError, TypeError, ValueError) as e:
+                self._count("batch_errors")
+                item.future.set_exception(requests.RequestException(f"Invalid batch item response: {e}"))
+                continue
+            if response.status_code in RETRY_STATUSES and self.graph.retry.should_retry(item.attempt, response.status_code):
+                self._retry(item, response)
+            else:
+                item.future.set_result(response)
+
+    @staticmethod
+    def _item_response(result: Any) -> BatchResponse:
+        if result is None:
+            # Meta did not get to this item (batch timeout); safe to resend
+            return BatchResponse(503, '{"error": {"message": "batch item not processed"}}')
+        headers = {h.get("name"): h.get("value") for h in result.get("headers") or []}
+        return BatchResponse(int(result.get("code") or 500), result.get("body") or "", headers)
+
+    def _retry(self, item: _BatchItem, response: BatchResponse) -> None:
+        delay = self.graph.retry.delay(item.attempt, response.headers.get("Retry-After"))
+        item.attempt += 1
+        self._count("item_retries")
+
+        def requeue() -> None:
+            item.queued_at = time.monotonic()
+            self._enqueue(item)
+
+        timer = threading.Timer(delay, requeue)
+        timer.daemon = True
+        timer.start()
+
+    def _count(self, name: str) -> None:
+        with self._cond:
+            self._stats[name] += 1
+
+
+# Global batcher, only when a batch window is configured
+graph_batcher: Optional[GraphBatcher] = None
+if config.graph.batch_window_ms > 0:
+    graph_batcher = GraphBatcher(
+        window_ms=config.graph.batch_window_ms,
+        max_batch=config.graph.batch_max,
+        workers=config.graph.batch_workers
+    )
+
+
+def get_graph_batcher() -> Optional[GraphBatcher]:
+    """Get the global Graph batcher, or None when batching is disabled."""
+    return graph_batcher
+
+
+def get_graph_sender() -> Union[GraphBatcher, GraphClient]:
+    """What send paths should POST through: the batcher when enabled, else the pooled client."""
+    return graph_batcher or get_graph_client()
@@ -0,0 +1,371 @@
+"""
+Graph API Client for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+One process-wide HTTP client for graph.facebook.com. Connections are kept
+alive in a bounded pool, so a send reuses an open TCP+TLS connection instead
+of paying a handshake, and every call gets the same timeouts and the same
+retry policy: 429, 5xx and connection failures are retried with full-jitter
+exponential backoff (honouring Retry-After). Read timeouts are not retried,
+because Meta may already have accepted the message.
+
+When Graph degrades the client fails fast instead of tying up workers for a
+full read timeout per call: each endpoint has a circuit breaker that opens
+after consecutive failures, and an AIMD limit on requests in flight shrinks
+when calls come back slow, throttled or failed and grows back as they
+recover. Both raise GraphUnavailable, which send paths treat as retryable.
+"""
+
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..config import config
+from ..utils import json_codec
+from ..utils.metrics import LatencyHistogram
+from ..utils.resilience import AIMDLimiter, CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+# Raised by requests before a call goes out; they say nothing about the endpoint's health
+CALLER_ERRORS = (
+    requests.exceptions.InvalidURL, requests.exceptions.MissingSchema, requests.exceptions.InvalidSchema,
+    requests.exceptions.InvalidHeader, requests.exceptions.URLRequired
+)
+
+
+def graph_url(path: str, base_url: Optional[str] = None, api_version: Optional[str] = None) -> str:
+    """Absolute URL of a Graph path such as '<phone_id>/messages'. Absolute URLs pass through."""
+    if path.startswith(("http://", "https://")):
+        return path
+    base_url = (base_url or config.graph.base_url).rstrip("/")
+    return f"{base_url}/{api_version or config.graph.api_version}/{path.lstrip('/')}"
+
+
+class GraphUnavailable(requests.RequestException):
+    """Raised without calling Graph: the endpoint's circuit is open or no in-flight slot freed up in time."""
+
+
+def endpoint_key(path: str) -> str:
+    """
+    Breaker key for a Graph path: the edge ('messages' for '<id>/messages'),
+    'node' for a bare object id, 'batch' for the batch endpoint, or the host
+    of an absolute URL (media downloads).
+    """
+    if path.startswith(("http://", "https://")):
+        return urlsplit(path).netloc
+    path = path.split("?", 1)[0]
+    segments = [segment for segment in path.split("/") if segment]
+    if not segments:
+        return "batch"
+    return segments[-1] if "/" in path.rstrip("/") else "node"
+
+
+class GraphRetryPolicy:
+    """
+    When and how long to wait before retrying a Graph call.
+    Signature: 8598
+    """
+
+    def __init__(self, max_retries: int = 3, backoff_base: float = 0.25, backoff_max: float = 8.0):
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def should_retry(self, attempt: int, status_code: Optional[int]) -> bool:
+        """True if attempt `attempt` (0-based) ended retryably and retries remain."""
+        if attempt >= self.max_retries:
+            return False
+        return status_code is None or status_code in RETRY_STATUSES
+
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Seconds to wait: Retry-After when given, else full jitter over base * 2**attempt."""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+class GraphClient:
+    """
+    Pooled, retrying Graph API client built on a shared requests.Session.
+    Signature: 8598
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        api_version: Optional[str] = None,
+        pool_size: Optional[int] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        retry: Optional[GraphRetryPolicy] = None,
+        limiter: Optional[AIMDLimiter] = None
+    ):
+        graph = config.graph
+        self.base_url = (base_url or graph.base_url).rstrip("/")
+        self.api_version = api_version or graph.api_version
+        self.pool_size = pool_size or graph.pool_size
+        self.timeout = (connect_timeout or graph.connect_timeout, read_timeout or graph.read_timeout)
+        self.retry = retry or GraphRetryPolicy(graph.max_retries, graph.backoff_base, graph.backoff_max)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._lock = threading.Lock()
+        self._latency = LatencyHistogram()
+        self._stats = {"requests": 0, "retries": 0, "errors": 0, "rejected": 0}
+        self.limiter = limiter or AIMDLimiter(
+            self.pool_size, minimum=min(graph.concurrency_min, self.pool_size),
+            latency_target=graph.latency_target_ms / 1000
+        )
+        self.limit_wait = graph.limit_wait
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def url(self, path: str) -> str:
+        """Absolute URL of a Graph path such as '<phone_id>/messages'."""
+        return graph_url(path, self.base_url, self.api_version)
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        token: Optional[str] = None,
+        token_in_query: bool = False,
+        json: Any = None,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        **kwargs: Any
+    ) -> requests.Response:
+        """
+        Send a request, retrying per the retry policy. Returns the final
+        response (which may still be an error status).
+
+        Raises:
+            GraphUnavailable: If the endpoint's circuit is open or the in-flight limit is reached
+            requests.RequestException: If the last attempt failed without a response
+        """
+        url = self.url(path)
+        endpoint = endpoint_key(path)
+        breaker = self.breaker(endpoint)
+        headers = dict(headers or {})
+        params = dict(params or {})
+        if token:
+            if token_in_query:
+                params["access_token"] = token
+            else:
+                headers["Authorization"] = f"Bearer {token}"
+        data = None
+        if json is not None:
+            data = json_codec.dumps_bytes(json)
+            headers.setdefault("Content-Type", "application/json")
+
+        attempt = 0
+        while True:
+            self._admit(endpoint, breaker)
+            started = time.perf_counter_ns()
+            try:
+                resp = self.session.request(
+                    method, url, data=data, params=params or None, headers=headers, timeout=self.timeout, **kwargs
+                )
+            except requests.ReadTimeout:
+                self._record(started, breaker, None)
+                raise
+            except requests.ConnectionError as e:
+                if not self.retry.should_retry(attempt, None):
+                    self._record(started, breaker, None)
+                    raise
+                self._record(started, breaker, None, retried=True)
+                self.logger.warning(f"Graph {method} {path} connection failed, retrying: {e}")
+                time.sleep(self.retry.delay(attempt))
+                attempt += 1
+                continue
+            except CALLER_ERRORS:
+                # Refused before anything was sent: no verdict on the endpoint
+                self._release(breaker)
+                raise
+            except requests.RequestException:
+                # Broken bodies, redirect loops and the like count against the endpoint
+                self._record(started, breaker, None)
+                raise
+            except BaseException:
+                self._release(breaker)
+                raise
+
+            if resp.status_code in RETRY_STATUSES and self.retry.should_retry(attempt, resp.status_code):
+                self._record(started, breaker, resp.status_code, retried=True)
+                delay = self.retry.delay(attempt, resp.headers.get("Retry-After"))
+                self.logger.warning(f"Graph {method} {path} returned {resp.status_code}, retrying in {delay:.2f}s")
+                resp.close()
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            self._record(started, breaker, resp.status_code)
+            return resp
+
+    def post(self, path: str, payload: Any, token: Optional[str] = None, token_in_query: bool = False,
+             **kwargs: Any) -> requests.Response:
+        """POST a JSON payload."""
+        return self.request("POST", path, token=token, token_in_query=token_in_query, json=payload, **kwargs)
+
+    def get(self, path: str, token: Optional[str] = None, **kwargs: Any) -> requests.Response:
+        """GET a Graph object or URL."""
+        return self.request("GET", path, token=token, **kwargs)
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        """The circuit breaker for an endpoint key (see endpoint_key)."""
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(endpoint, CircuitBreaker(
+                    config.graph.breaker_failures, config.graph.breaker_open_seconds
+                ))
+        return breaker
+
+    def stats(self) -> Dict[str, Any]:
+        """Request, retry and error counters, latency percentiles in ms, breaker states and the in-flight limit."""
+        with self._lock:
+            latency = self._latency.snapshot()
+            stats = dict(
+                self._stats,
+                pool_size=self.pool_size,
+                p50_ms=round(latency["p50_us"] / 1000, 1),
+                p99_ms=round(latency["p99_us"] / 1000, 1),
+            )
+            breakers = dict(self._breakers)
+        stats["breakers"] = {endpoint: breaker.stats() for endpoint, breaker in breakers.items()}
+        stats["concurrency"] = self.limiter.stats()
+        return stats
+
+    def close(self) -> None:
+        """Close pooled connections."""
+        self.session.close()
+
+    def _admit(self, endpoint: str, breaker: CircuitBreaker) -> None:
+        if not breaker.allow():
+            self._reject()
+            raise GraphUnavailable(f"Graph {endpoint} circuit open")
+        if not self.limiter.acquire(self.limit_wait):
+            breaker.release()
+            self._reject()
+            raise GraphUnavailable(f"Graph in-flight limit reached ({self.limiter.stats()['limit']})")
+
+    def _release(self, breaker: CircuitBreaker) -> None:
+        """Settle an admitted attempt that produced no verdict: free its slot and any half-open trial."""
+        breaker.release()
+        self.limiter.release()
+
+    def _reject(self) -> None:
+        with self._lock:
+            self._stats["rejected"] += 1
+
+    def _record(self, started_ns: int, breaker: CircuitBreaker, status_code: Optional[int],
+                retried: bool = False) -> None:
+        """Settle one attempt: counters, latency, the endpoint's breaker and the in-flight limit."""
+        elapsed_ns = time.perf_counter_ns() - started_ns
+        failed = status_code is None or status_code >= 500
+        if failed:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        self.limiter.release(elapsed_ns / 1e9, overloaded=failed or status_code == 429)
+        with self._lock:
+            self._stats["requests"] += 1
+            if retried:
+                self._stats["retries"] += 1
+            elif failed or status_code >= 400:
+                self._stats["errors"] += 1
+            self._latency.record(elapsed_ns)
+
+
+class AsyncGraphClient:
+    """
+    httpx.AsyncClient counterpart of GraphClient for the ASGI service, with
+    the same pool size, timeouts and retry policy. It consults the circuit
+    breakers of `graph` (the process's GraphClient by default), so both
+    clients see an endpoint open together; the event loop does not need the
+    in-flight limit.
+    Signature: 8598
+    """
+
+    def __init__(self, transport: Any = None, retry: Optional[GraphRetryPolicy] = None,
+                 graph_client: Optional[GraphClient] = None):
+        import httpx
+
+        graph = config.graph
+        self.graph = graph_client
+        self.retry = retry or GraphRetryPolicy(graph.max_retries, graph.backoff_base, graph.backoff_max)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(graph.read_timeout, connect=graph.connect_timeout),
+            limits=httpx.Limits(max_connections=graph.pool_size, max_keepalive_connections=graph.pool_size),
+            transport=transport
+        )
+        self._connect_errors = (httpx.ConnectError, httpx.ConnectTimeout)
+        self._request_errors = httpx.RequestError
+
+    async def post(self, path: str, payload: Any, token: Optional[str] = None, headers: Optional[Dict[str, str]] = None):
+        """POST a JSON payload, retrying per the retry policy. Returns the final httpx response."""
+        import asyncio
+
+        headers = dict(headers or {})
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        headers.setdefault("Content-Type", "application/json")
+        body = json_codec.dumps_bytes(payload)
+        url = graph_url(path)
+        endpoint = endpoint_key(path)
+        breaker = (self.graph or get_graph_client()).breaker(endpoint)
+
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise GraphUnavailable(f"Graph {endpoint} circuit open")
+            try:
+                resp = await self.client.post(url, headers=headers, content=body)
+            except self._connect_errors:
+                breaker.record_failure()
+                if not self.retry.should_retry(attempt, None):
+                    raise
+                await asyncio.sleep(self.retry.delay(attempt))
+                attempt += 1
+                continue
+            except self._request_errors:
+                breaker.record_failure()
+                raise
+            except BaseException:
+                # Invalid requests, and cancellation mid-call: hand back a half-open trial without a verdict
+                breaker.release()
+                raise
+            if resp.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if resp.status_code in RETRY_STATUSES and self.retry.should_retry(attempt, resp.status_code):
+                await asyncio.sleep(self.retry.delay(attempt, resp.headers.get("Retry-After")))
+                attempt += 1
+                continue
+            return resp
+
+    async def aclose(self) -> None:
+        """Close pooled connections."""
+        await self.client.aclose()
+
+
+# Global Graph client instance
+graph_client = GraphClient()
+
+
+def get_graph_client() -> GraphClient:
+    """Get the global Graph API client instance."""
+    return graph_client
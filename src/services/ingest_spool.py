@@ -0,0 +1,218 @@
+"""
+Ingestion Spool for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Durable on-disk queue for raw webhook bodies. The webhook endpoint appends
+the request body and acknowledges Meta immediately; a pool of background
+workers drains the spool into the message service in batches.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+import sqlite3
+import threading
+import time
+
+from ..utils import json_codec
+
+logger = logging.getLogger(__name__)
+
+# Errors a payload raises on every attempt: bad JSON or values, or a missing or mistyped structure
+PAYLOAD_ERRORS = (ValueError, KeyError, TypeError, IndexError)
+
+
+class IngestSpool:
+    """
+    SQLite-backed append-only spool of raw webhook payloads.
+    Signature: 8598
+
+    Rows are claimed with a lease; a claim that is never acknowledged (for
+    example because the process crashed) becomes visible again once the
+    lease expires, so nothing accepted by the endpoint is lost.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.signature = "8598"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS spool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                body BLOB NOT NULL,
+                received_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                claimed_at REAL,
+                dead INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_spool_ready ON spool (dead, claimed_at, id)")
+
+    def append(self, body: bytes) -> int:
+        """Durably store a raw payload and return its spool id."""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO spool (body, received_at) VALUES (?, ?)",
+                (sqlite3.Binary(body), time.time())
+            )
+            return cur.lastrowid
+
+    def claim(self, limit: int, lease_seconds: int) -> List[Tuple[int, bytes, int]]:
+        """Lease up to `limit` ready payloads. Returns (id, body, attempts) tuples."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    """
+                    SELECT id, body, attempts FROM spool
+                    WHERE dead = 0 AND (claimed_at IS NULL OR claimed_at < ?)
+                    ORDER BY id LIMIT ?
+                    """,
+                    (now - lease_seconds, limit)
+                ).fetchall()
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE spool SET claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                        [(now, r[0]) for r in rows]
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(r[0], bytes(r[1]), r[2] + 1) for r in rows]
+
+    def ack(self, ids: List[int]) -> None:
+        """Remove successfully processed payloads."""
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM spool WHERE id = ?", [(i,) for i in ids])
+
+    def release(self, spool_id: int, error: str, dead: bool = False) -> None:
+        """Return a payload to the queue after a failure, or dead-letter it."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE spool SET claimed_at = NULL, dead = ?, last_error = ? WHERE id = ?",
+                (1 if dead else 0, error[:1000], spool_id)
+            )
+
+    def recover(self, lease_seconds: int) -> int:
+        """Release claims whose lease expired (e.g. left behind by a crashed worker)."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE spool SET claimed_at = NULL WHERE dead = 0 AND claimed_at IS NOT NULL AND claimed_at < ?",
+                (time.time() - lease_seconds,)
+            )
+            return cur.rowcount
+
+    def depth(self) -> Dict[str, int]:
+        """Return pending and dead-lettered payload counts."""
+        with self._lock:
+            pending, dead = self._conn.execute(
+                "SELECT COALESCE(SUM(dead = 0), 0), COALESCE(SUM(dead = 1), 0) FROM spool"
+            ).fetchone()
+        return {"pending": int(pending), "dead": int(dead)}
+
+    def close(self) -> None:
+        """Close the underlying connection."""
+        with self._lock:
+            self._conn.close()
+
+
+class SpoolWorkerPool:
+    """
+    Background workers that drain an IngestSpool into a payload handler.
+    Signature: 8598
+    """
+
+    def __init__(
+        self,
+        spool: IngestSpool,
+        handler: Callable[[List[Dict[str, Any]]], Any],
+        workers: int = 2,
+        batch_size: int = 50,
+        poll_interval: float = 0.5,
+        lease_seconds: int = 60,
+        max_attempts: int = 5
+    ):
+        self.spool = spool
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """Recover stale claims and start the worker threads."""
+        recovered = self.spool.recover(self.lease_seconds)
+        if recovered:
+            self.logger.warning(f"Recovered {recovered} stale spool claims")
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"spool-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.logger.info(f"Spool workers started ({self.workers}) - Signature: 8598")
+
+    def stop(self, timeout: Optional[float] = 5.0) -> None:
+        """Signal the workers to stop and wait for them."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def drain_once(self) -> int:
+        """Claim and process one batch. Returns the number of payloads claimed."""
+        batch = self.spool.claim(self.batch_size, self.lease_seconds)
+        decoded = []
+        for spool_id, body, attempts in batch:
+            try:
+                decoded.append((spool_id, json_codec.loads(body), attempts))
+            except ValueError as e:
+                self._fail(spool_id, attempts, e)
+        
+        if not decoded:
+            return len(batch)
+        
+        try:
+            # Fast path: the whole batch goes through one persistence call
+            self.handler([payload for _, payload, _ in decoded])
+            self.spool.ack([spool_id for spool_id, _, _ in decoded])
+        except Exception as e:
+            self.logger.warning(f"Spool batch failed, retrying payloads individually: {e}")
+            done = []
+            for spool_id, payload, attempts in decoded:
+                try:
+                    self.handler([payload])
+                    done.append(spool_id)
+                except Exception as item_error:
+                    self._fail(spool_id, attempts, item_error)
+            self.spool.ack(done)
+        return len(batch)
+    
+    def _fail(self, spool_id: int, attempts: int, error: Exception) -> None:
+        # Malformed payloads will never succeed; dead-letter them straight away. Extraction
+        # raises KeyError/TypeError/IndexError on payloads missing the structure it expects
+        permanent = isinstance(error, PAYLOAD_ERRORS) or getattr(error, "code", None) == 400
+        dead = permanent or attempts >= self.max_attempts
+        self.logger.error(f"Spooled payload {spool_id} failed (attempt {attempts}): {error}")
+        self.spool.release(spool_id, str(error), dead=dead)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if not self.drain_once():
+                    self._stop.wait(self.poll_interval)
+            except Exception as e:
+                self.logger.error(f"Spool worker error: {e}")
+                self._stop.wait(self.poll_interval)
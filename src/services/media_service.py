@@ -0,0 +1,404 @@
+"""
+Media Service for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Background resolution of media attached to incoming messages. Ingestion
+queues one media_assets row per image/document/audio/video message in the
+same transaction as the message; a worker pool later resolves WhatsApp media
+ids through the Graph API, downloads the file with bounded concurrency and
+stores it once per content hash, so repeated media (forwarded images,
+stickers, re-sent documents) takes disk space only once.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+import requests
+from sqlalchemy import insert, or_, and_, update
+from sqlalchemy.orm import Session
+
+from ..config import config
+from ..database import MediaAsset, get_db_session, upsert_insert
+from ..utils import json_codec
+from .graph_client import GraphClient, get_graph_client
+
+logger = logging.getLogger(__name__)
+
+# messages.message_type values that can carry media
+MEDIA_MESSAGE_TYPES = frozenset(("image", "document", "audio", "video", "sticker", "attachment"))
+
+
+class MediaError(Exception):
+    """A media download failed; `permanent` failures are not retried."""
+
+    def __init__(self, message: str, permanent: bool = False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+@dataclass
+class MediaInfo:
+    """Where to fetch a media object and what Meta says about it."""
+    url: str
+    mime_type: Optional[str] = None
+    sha256: Optional[str] = None  # hex digest, when the platform reports one
+    file_size: Optional[int] = None
+    authorized: bool = True  # send the access token with the download
+
+
+class MediaClient:
+    """
+    Resolves media ids and downloads media. Subclass for other transports.
+    Signature: 8598
+    """
+
+    def resolve(self, media_id: str) -> MediaInfo:
+        """Look up the download URL and metadata of a media id."""
+        raise NotImplementedError
+
+    def download(self, info: MediaInfo) -> Iterator[bytes]:
+        """Yield the content of a resolved media object in chunks."""
+        raise NotImplementedError
+
+
+class GraphMediaClient(MediaClient):
+    """
+    WhatsApp Cloud API media client (GET /{media-id}, then the returned URL),
+    sharing the pooled Graph client.
+    Signature: 8598
+    """
+
+    CHUNK_SIZE = 65536
+
+    def __init__(self, access_token: Optional[str] = None, graph: Optional[GraphClient] = None):
+        self.access_token = access_token or config.whatsapp.access_token
+        self.graph = graph or get_graph_client()
+
+    def resolve(self, media_id: str) -> MediaInfo:
+        resp = self.graph.get(media_id, token=self.access_token)
+        self._check(resp, f"media {media_id}")
+        data = resp.json()
+        if not data.get("url"):
+            raise MediaError(f"media {media_id}: no url in Graph response", permanent=True)
+        return MediaInfo(
+            url=data["url"],
+            mime_type=data.get("mime_type"),
+            sha256=data.get("sha256"),
+            file_size=int(data["file_size"]) if data.get("file_size") else None
+        )
+
+    def download(self, info: MediaInfo) -> Iterator[bytes]:
+        token = self.access_token if info.authorized else None
+        with self.graph.get(info.url, token=token, stream=True) as resp:
+            self._check(resp, "download")
+            for chunk in resp.iter_content(self.CHUNK_SIZE):
+                if chunk:
+                    yield chunk
+
+    @staticmethod
+    def _check(resp: requests.Response, what: str) -> None:
+        if resp.status_code < 400:
+            return
+        # 429 and 5xx are worth retrying; other client errors will not change
+        permanent = resp.status_code < 500 and resp.status_code != 429
+        raise MediaError(f"{what}: HTTP {resp.status_code}", permanent=permanent)
+
+
+class StubMediaClient(MediaClient):
+    """
+    In-memory media client for tests and offline runs.
+    Signature: 8598
+
+    `blobs` maps media ids (WhatsApp) or URLs (Messenger) to content.
+    """
+
+    def __init__(self, blobs: Optional[Dict[str, bytes]] = None, mime_type: str = "application/octet-stream"):
+        self.blobs = dict(blobs or {})
+        self.mime_type = mime_type
+        self.resolved = 0
+        self.downloaded = 0
+        self._lock = threading.Lock()
+
+    def resolve(self, media_id: str) -> MediaInfo:
+        with self._lock:
+            self.resolved += 1
+        if media_id not in self.blobs:
+            raise MediaError(f"media {media_id}: HTTP 404", permanent=True)
+        content = self.blobs[media_id]
+        return MediaInfo(
+            url=media_id, mime_type=self.mime_type,
+            sha256=hashlib.sha256(content).hexdigest(), file_size=len(content)
+        )
+
+    def download(self, info: MediaInfo) -> Iterator[bytes]:
+        if info.url not in self.blobs:
+            raise MediaError(f"download {info.url}: HTTP 404", permanent=True)
+        with self._lock:
+            self.downloaded += 1
+        yield self.blobs[info.url]
+
+
+class MediaStore:
+    """
+    Content-addressed file store: <root>/<sha[:2]>/<sha[2:4]>/<sha>.
+    Signature: 8598
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+
+    def path_for(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.path_for(sha256))
+
+    def put(self, chunks: Iterable[bytes], max_bytes: int = 0) -> Tuple[str, int, bool]:
+        """
+        Stream chunks to disk, hashing as they arrive.
+
+        Returns:
+            Tuple of (sha256 hex, size in bytes, True if the content was new)
+
+        Raises:
+            MediaError: If the content exceeds max_bytes
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if max_bytes and size > max_bytes:
+                        raise MediaError(f"media larger than {max_bytes} bytes", permanent=True)
+                    digest.update(chunk)
+                    out.write(chunk)
+            sha256 = digest.hexdigest()
+            path = self.path_for(sha256)
+            if os.path.exists(path):
+                os.unlink(tmp_path)
+                return sha256, size, False
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            return sha256, size, True
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+
+def enqueue_media(session: Session, rows: List[Dict[str, Any]]) -> int:
+    """
+    Queue media_assets rows for newly inserted message rows that carry a
+    media reference. Runs inside the ingestion transaction; does no I/O
+    beyond the one INSERT.
+
+    Returns:
+        int: Number of media rows queued
+    """
+    assets = []
+    for row in rows:
+        extra = row.get("extra_data")
+        if row.get("message_type") not in MEDIA_MESSAGE_TYPES or not extra or '"media_' not in extra:
+            continue
+        data = json_codec.loads(extra)
+        if not row.get("message_id") or not (data.get("media_id") or data.get("media_url")):
+            continue
+        assets.append({
+            "message_id": row["message_id"],
+            "platform": row["platform"],
+            "media_id": data.get("media_id"),
+            "source_url": data.get("media_url"),
+            "mime_type": data.get("mime_type"),
+            "status": "pending",
+            "attempts": 0,
+            "created_at": row["created_at"],
+            "updated_at": row["created_at"],
+        })
+    if not assets:
+        return 0
+
+    stmt = upsert_insert(session, MediaAsset)
+    if stmt is None:
+        session.execute(insert(MediaAsset), assets)
+    else:
+        session.execute(stmt.on_conflict_do_nothing(index_elements=["message_id"]), assets)
+    return len(assets)
+
+
+class MediaResolverPool:
+    """
+    Background workers that download queued media into a MediaStore.
+    Signature: 8598
+
+    Each worker claims a few pending rows with a lease and handles them one
+    at a time, so at most `workers` downloads run per process. Claims left
+    behind by a crashed process become visible again once the lease expires.
+    """
+
+    def __init__(
+        self,
+        store: MediaStore,
+        client: MediaClient,
+        workers: int = 4,
+        batch_size: int = 10,
+        poll_interval: float = 1.0,
+        lease_seconds: int = 300,
+        max_attempts: int = 5,
+        max_bytes: int = 0
+    ):
+        self.store = store
+        self.client = client
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._stats = {"stored": 0, "deduplicated": 0, "failed": 0, "retried": 0, "bytes": 0}
+
+    def start(self) -> None:
+        """Start the worker threads."""
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"media-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.logger.info(f"Media workers started ({self.workers}) - Signature: 8598")
+
+    def stop(self, timeout: Optional[float] = 5.0) -> None:
+        """Signal the workers to stop and wait for them."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def claim(self, limit: int) -> List[Tuple[int, Optional[str], Optional[str], int]]:
+        """Lease up to `limit` ready rows. Returns (id, media_id, source_url, attempts) tuples."""
+        now = datetime.now(timezone.utc)
+        ready = or_(
+            MediaAsset.status == "pending",
+            and_(MediaAsset.status == "resolving", MediaAsset.claimed_at < now - timedelta(seconds=self.lease_seconds))
+        )
+        claimed = []
+        with get_db_session() as session:
+            candidates = session.query(
+                MediaAsset.id, MediaAsset.media_id, MediaAsset.source_url, MediaAsset.attempts
+            ).filter(ready).order_by(MediaAsset.id).limit(limit).all()
+            for asset_id, media_id, source_url, attempts in candidates:
+                # Conditional update: another worker or process may have won the row
+                result = session.execute(
+                    update(MediaAsset).where(MediaAsset.id == asset_id, ready).values(
+                        status="resolving", claimed_at=now, attempts=MediaAsset.attempts + 1
+                    )
+                )
+                if result.rowcount:
+                    claimed.append((asset_id, media_id, source_url, attempts + 1))
+            session.commit()
+        return claimed
+
+    def drain_once(self) -> int:
+        """Claim and resolve one batch. Returns the number of rows claimed."""
+        batch = self.claim(self.batch_size)
+        for asset_id, media_id, source_url, attempts in batch:
+            if self._stop.is_set():
+                break
+            try:
+                values = self.fetch(media_id, source_url)
+                values.update(status="stored", last_error=None, resolved_at=datetime.now(timezone.utc))
+                self._finish(asset_id, values)
+            except Exception as e:
+                self._fail(asset_id, attempts, e)
+        return len(batch)
+
+    def fetch(self, media_id: Optional[str], source_url: Optional[str]) -> Dict[str, Any]:
+        """Resolve and download one media object into the store. Returns column values."""
+        if media_id:
+            info = self.client.resolve(media_id)
+        elif source_url:
+            info = MediaInfo(url=source_url, authorized=False)
+        else:
+            raise MediaError("no media id or url", permanent=True)
+
+        if self.max_bytes and info.file_size and info.file_size > self.max_bytes:
+            raise MediaError(f"media larger than {self.max_bytes} bytes", permanent=True)
+
+        # Skip the download entirely when the reported hash is already stored
+        if info.sha256 and self.store.exists(info.sha256.lower()):
+            sha256 = info.sha256.lower()
+            size = info.file_size or os.path.getsize(self.store.path_for(sha256))
+            created = False
+        else:
+            sha256, size, created = self.store.put(self.client.download(info), self.max_bytes)
+            if info.sha256 and info.sha256.lower() != sha256:
+                raise MediaError(f"checksum mismatch for {media_id or source_url}")
+
+        with self._lock:
+            if created:
+                self._stats["stored"] += 1
+                self._stats["bytes"] += size
+            else:
+                self._stats["deduplicated"] += 1
+        return {
+            "sha256": sha256,
+            "file_size": size,
+            "mime_type": info.mime_type,
+            "storage_path": self.store.path_for(sha256),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters since start plus the configured concurrency."""
+        with self._lock:
+            return dict(self._stats, workers=self.workers)
+
+    def _finish(self, asset_id: int, values: Dict[str, Any]) -> None:
+        with get_db_session() as session:
+            row = session.get(MediaAsset, asset_id)
+            if row is not None:
+                for name, value in values.items():
+                    if value is not None or name in ("last_error",):
+                        setattr(row, name, value)
+                session.commit()
+
+    def _fail(self, asset_id: int, attempts: int, error: Exception) -> None:
+        dead = getattr(error, "permanent", False) or attempts >= self.max_attempts
+        self.logger.warning(f"Media {asset_id} failed (attempt {attempts}): {error}")
+        with self._lock:
+            self._stats["failed" if dead else "retried"] += 1
+        # A retryable row stays claimed, so it is picked up again once its lease expires
+        values: Dict[str, Any] = {"last_error": str(error)[:1000]}
+        if dead:
+            values["status"] = "failed"
+        self._finish(asset_id, values)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if not self.drain_once():
+                    self._stop.wait(self.poll_interval)
+            except Exception as e:
+                self.logger.error(f"Media worker error: {e}")
+                self._stop.wait(self.poll_interval)
+
+
+def get_media_asset(message_id: str) -> Optional[Dict[str, Any]]:
+    """Media row of a message as a dict (with storage_path), or None."""
+    with get_db_session() as session:
+        row = session.query(MediaAsset).filter(MediaAsset.message_id == message_id).first()
+        if row is None:
+            return None
+        asset = row.to_dict()
+        asset["storage_path"] = row.storage_path
+        return asset
@@ -6,15 +6,24 @@ Professional message management service with advanced analytics,
 caching, and performance optimization.
 """
 
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Set, Tuple
 from datetime import datetime, timezone, timedelta
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, and_, or_
+from sqlalchemy import func, desc, or_, insert, tuple_, update, case, bindparam, select
+from sqlalchemy.sql import Select
 import logging
-import json
 
-from ..database import Message, Agent, Conversation, AgentSchedule, AgentLeave, get_db_session
+from sqlalchemy.exc import IntegrityError
+
+from ..database import Message, Agent, Conversation, AgentSchedule, AgentLeave, get_db_session, upsert_insert
 from ..config import config
+from ..utils.cache import LRUCache
+from ..utils import json_codec
+from ..utils.metrics import stage
+from .extraction import InboundMessage
+from .media_service import enqueue_media
+from .service_window import get_service_window
+from .blocklist import get_blocklist
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +37,24 @@ class MessageService:
     def __init__(self):
         self.signature = "8598"
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        # Platform message ids already stored, so Meta retries skip the database
+        self._seen_message_ids = LRUCache(maxsize=config.ingest.dedup_cache_size)
+        # Last handling agent per (recipient, platform); written through on every log
+        self._agent_cache = LRUCache(
+            maxsize=config.ingest.agent_cache_size,
+            ttl=config.ingest.agent_cache_ttl
+        )
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters for the in-process caches."""
+        return {
+            "agent_resolution": self._agent_cache.stats(),
+            "message_ids": self._seen_message_ids.stats()
+        }
+    
+    def is_known_message(self, message_id: Optional[str]) -> bool:
+        """Return True if the platform message id is known to be stored already."""
+        return bool(message_id) and message_id in self._seen_message_ids
     
     def log_message(
         self,
@@ -41,7 +68,7 @@ class MessageService:
         is_incoming: bool = True,
         status: str = "received",
         extra_data: Optional[Dict[str, Any]] = None
-    ) -> Message:
+    ) -> Optional[Message]:
         """
         Log a message with comprehensive error handling and validation.
         
@@ -58,45 +85,50 @@ class MessageService:
             extra_data: Additional platform-specific data
             
         Returns:
-            Message: Created message object
+            Optional[Message]: Created message object, or None if message_id was already stored
             
         Raises:
             ValueError: If required parameters are invalid
             DatabaseError: If database operation fails
         """
+        if self.is_known_message(message_id):
+            self.logger.debug(f"Duplicate message skipped - Message ID: {message_id}")
+            return None
+        
         try:
-            # Validate required parameters
-            if not agent or not platform or not recipient or not content:
-                raise ValueError("Agent, platform, recipient, and content are required")
-            
-            # Sanitize and validate data
-            agent = str(agent).strip()[:100]
-            platform = str(platform).strip()[:50]
-            recipient = str(recipient).strip()[:50]
-            content = str(content).strip()
-            
-            if not content:
-                raise ValueError("Message content cannot be empty")
+            row = self._normalize_record(dict(
+                agent=agent,
+                platform=platform,
+                recipient=recipient,
+                content=content,
+                message_type=message_type,
+                message_id=message_id,
+                sender_id=sender_id,
+                is_incoming=is_incoming,
+                status=status,
+                extra_data=extra_data
+            ))
+            agent, platform = row["agent"], row["platform"]
             
             with get_db_session() as session:
                 # Create message object
-                message = Message(
-                    agent=agent,
-                    platform=platform,
-                    recipient=recipient,
-                    content=content,
-                    message_type=message_type,
-                    message_id=message_id,
-                    sender_id=sender_id,
-                    is_incoming=is_incoming,
-                    status=status,
-                    extra_data=json.dumps(extra_data, ensure_ascii=False) if extra_data else None
-                )
+                message = Message(**row)
                 
                 # Add to session and commit
                 session.add(message)
-                session.commit()
+                try:
+                    session.commit()
+                except IntegrityError:
+                    session.rollback()
+                    if not message_id:
+                        raise
+                    # Stored by an earlier delivery or another worker
+                    self._seen_message_ids.put(message_id)
+                    self.logger.info(f"Duplicate message skipped - Message ID: {message_id}")
+                    return None
                 session.refresh(message)
+                if message_id:
+                    self._seen_message_ids.put(message_id)
                 
                 # Update conversation tracking
                 self._update_conversation(session, message)
@@ -108,60 +140,382 @@ class MessageService:
             self.logger.error(f"Failed to log message: {e}")
             raise
     
-    def _update_conversation(self, session: Session, message: Message) -> None:
-        """Update conversation tracking."""
+    def log_messages(self, records: List[Dict[str, Any]]) -> int:
+        """
+        Log a batch of messages in a single transaction.
+        
+        Rows are written with one executemany INSERT and conversation tracking
+        is applied once per (recipient, platform) pair, so a whole webhook
+        delivery costs a constant number of round-trips. Records whose
+        message_id is already stored are skipped: recently seen ids never
+        reach the database and the rest are dropped by ON CONFLICT DO NOTHING.
+        
+        Args:
+            records: Message records with the same keys as log_message arguments
+            
+        Returns:
+            int: Number of messages written
+        """
+        with stage("normalize"):
+            rows, batch_ids = self.prepare_batch(records)
+        if not rows:
+            return 0
+        
         try:
-            # Find or create conversation
-            conversation = session.query(Conversation).filter(
-                and_(
-                    Conversation.recipient == message.recipient,
-                    Conversation.platform == message.platform
-                )
-            ).first()
+            with get_db_session() as session:
+                rows = self.write_batch(session, rows)
+                with stage("commit"):
+                    session.commit()
             
+            self.remember_batch(batch_ids, rows)
+            self.logger.info(f"Logged message batch - Count: {len(rows)}")
+            return len(rows)
+            
+        except Exception as e:
+            self.logger.error(f"Failed to log message batch: {e}")
+            raise
+    
+    def prepare_batch(self, records: List[Any]) -> Tuple[List[Dict[str, Any]], Set[str]]:
+        """
+        Drop duplicate and invalid records and normalize the rest into
+        messages rows sharing one timestamp. Records are InboundMessage
+        objects or log_message keyword dicts.
+        
+        Returns:
+            Tuple of (rows to insert, platform message ids in the batch)
+        """
+        rows = []
+        batch_ids = set()
+        for record in records:
+            typed = isinstance(record, InboundMessage)
+            message_id = record.message_id if typed else record.get("message_id")
+            if message_id:
+                if message_id in batch_ids or self.is_known_message(message_id):
+                    continue
+                batch_ids.add(message_id)
+            try:
+                rows.append(record.to_row() if typed else self._normalize_record(record))
+            except ValueError as e:
+                self.logger.warning(f"Skipping invalid message record: {e}")
+        
+        # One timestamp for the batch keeps the executemany parameter sets uniform
+        now = datetime.now(timezone.utc)
+        for row in rows:
+            row["timestamp"] = now
+            row["created_at"] = now
+            row["updated_at"] = now
+        return rows, batch_ids
+    
+    def write_batch(self, session: Session, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Insert prepared rows and update their conversations on `session`
+        without committing. Works on any synchronous Session, including the
+        one AsyncSession.run_sync provides.
+        
+        Returns:
+            List[Dict[str, Any]]: The rows that were actually inserted
+        """
+        with stage("insert"):
+            rows = self._insert_new_messages(session, rows)
+        if rows:
+            with stage("conversation_update"):
+                self._update_conversations(session, rows)
+            if config.media.enabled:
+                with stage("media_enqueue"):
+                    enqueue_media(session, rows)
+            get_blocklist().record_keywords(session, rows)
+        return rows
+    
+    def stage_queued(self, session: Session, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Insert outgoing messages with status 'queued' and no platform id, and
+        update their conversations, on `session` without committing, so they
+        commit with the caller's outbox or campaign rows.
+
+        Args:
+            records: Message records with the same keys as log_message arguments
+
+        Returns:
+            List[Dict[str, Any]]: The inserted rows in order, each with its new "id"
+
+        Raises:
+            ValueError: If a record is invalid
+        """
+        now = datetime.now(timezone.utc)
+        rows = [
+            dict(self._normalize_record(record), status="queued", message_id=None,
+                 timestamp=now, created_at=now, updated_at=now)
+            for record in records
+        ]
+        if not rows:
+            return rows
+        ids = session.execute(
+            insert(Message).returning(Message.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        for row, pk in zip(rows, ids):
+            row["id"] = pk
+        self._update_conversations(session, rows)
+        return rows
+
+    def remember_batch(self, batch_ids: Set[str], rows: List[Dict[str, Any]]) -> None:
+        """Record a committed batch in the message id and agent caches, the service window index and the blocklist."""
+        self._seen_message_ids.put_many(batch_ids)
+        for row in rows:
+            self._agent_cache.put((row["recipient"], row["platform"]), row["agent"])
+        get_service_window().note_rows(rows)
+        get_blocklist().note_rows(rows)
+    
+    def _insert_new_messages(self, session: Session, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Insert rows, ignoring message_id conflicts. Returns the rows actually inserted."""
+        stmt = upsert_insert(session, Message)
+        if stmt is None:
+            # No ON CONFLICT support: filter out stored ids up front
+            ids = [row["message_id"] for row in rows if row["message_id"]]
+            stored = {
+                mid for (mid,) in session.query(Message.message_id).filter(Message.message_id.in_(ids))
+            } if ids else set()
+            rows = [row for row in rows if row["message_id"] not in stored]
+            if rows:
+                session.execute(insert(Message), rows)
+            return rows
+        
+        stmt = stmt.on_conflict_do_nothing(index_elements=["message_id"]).returning(Message.message_id)
+        inserted = {mid for (mid,) in session.execute(stmt, rows)}
+        
+        # Rows without a platform id never conflict
+        return [row for row in rows if not row["message_id"] or row["message_id"] in inserted]
+    
+    def _normalize_record(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate and sanitize a message record into Message column values."""
+        agent = record.get("agent")
+        platform = record.get("platform")
+        recipient = record.get("recipient")
+        content = record.get("content")
+        
+        # Validate required parameters
+        if not agent or not platform or not recipient or not content:
+            raise ValueError("Agent, platform, recipient, and content are required")
+        
+        content = str(content).strip()
+        if not content:
+            raise ValueError("Message content cannot be empty")
+        
+        extra_data = record.get("extra_data")
+        return {
+            "agent": str(agent).strip()[:100],
+            "platform": str(platform).strip()[:50],
+            "recipient": str(recipient).strip()[:50],
+            "content": content,
+            "message_type": record.get("message_type"),
+            "message_id": record.get("message_id"),
+            "sender_id": record.get("sender_id"),
+            "is_incoming": record.get("is_incoming", True),
+            "status": record.get("status", "received"),
+            "extra_data": json_codec.dumps(extra_data) if extra_data else None
+        }
+    
+    def _update_conversations(self, session: Session, rows: List[Dict[str, Any]]) -> None:
+        """Apply conversation tracking for a batch of message rows."""
+        # Collapse the batch to one change per (recipient, platform)
+        changes: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for row in rows:
+            key = (row["recipient"], row["platform"])
+            change = changes.setdefault(key, {"count": 0, "last_inbound_at": None})
+            change["count"] += 1
+            change["agent"] = row["agent"]
+            change["last_message_at"] = row["timestamp"]
+            if row.get("is_incoming"):
+                change["last_inbound_at"] = row["timestamp"]
+        
+        now = datetime.now(timezone.utc)
+        stmt = upsert_insert(session, Conversation)
+        if stmt is not None:
+            # Single atomic statement per key; concurrent workers cannot lose increments
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["recipient", "platform"],
+                set_={
+                    "agent": stmt.excluded.agent,
+                    "last_message_at": stmt.excluded.last_message_at,
+                    "last_inbound_at": func.coalesce(stmt.excluded.last_inbound_at, Conversation.last_inbound_at),
+                    "message_count": Conversation.message_count + stmt.excluded.message_count,
+                    "updated_at": stmt.excluded.updated_at
+                }
+            )
+            session.execute(stmt, [
+                {
+                    "recipient": key[0],
+                    "platform": key[1],
+                    "agent": change["agent"],
+                    "last_message_at": change["last_message_at"],
+                    "last_inbound_at": change["last_inbound_at"],
+                    "message_count": change["count"],
+                    "is_active": True,
+                    "created_at": now,
+                    "updated_at": now
+                }
+                for key, change in changes.items()
+            ])
+            return
+        
+        existing = session.query(Conversation).filter(
+            tuple_(Conversation.recipient, Conversation.platform).in_(list(changes))
+        ).all()
+        by_key = {(conv.recipient, conv.platform): conv for conv in existing}
+        
+        for key, change in changes.items():
+            conversation = by_key.get(key)
             if conversation:
-                # Update existing conversation
-                conversation.agent = message.agent
-                conversation.last_message_at = message.timestamp
-                conversation.message_count += 1
-                conversation.updated_at = datetime.now(timezone.utc)
+                conversation.agent = change["agent"]
+                conversation.last_message_at = change["last_message_at"]
+                if change["last_inbound_at"] is not None:
+                    conversation.last_inbound_at = change["last_inbound_at"]
+                conversation.message_count += change["count"]
+                conversation.updated_at = now
             else:
-                # Create new conversation
-                conversation = Conversation(
-                    recipient=message.recipient,
-                    platform=message.platform,
-                    agent=message.agent,
-                    last_message_at=message.timestamp,
-                    message_count=1
-                )
-                session.add(conversation)
-            
+                session.add(Conversation(
+                    recipient=key[0],
+                    platform=key[1],
+                    agent=change["agent"],
+                    last_message_at=change["last_message_at"],
+                    last_inbound_at=change["last_inbound_at"],
+                    message_count=change["count"]
+                ))
+    
+    def _update_conversation(self, session: Session, message: Message) -> None:
+        """Update conversation tracking."""
+        try:
+            row = {
+                "recipient": message.recipient,
+                "platform": message.platform,
+                "agent": message.agent,
+                "content": message.content,
+                "is_incoming": message.is_incoming,
+                "timestamp": message.timestamp
+            }
+            self._update_conversations(session, [row])
+            get_blocklist().record_keywords(session, [row])
             session.commit()
+            if message.is_incoming:
+                get_service_window().note(message.platform, message.recipient, message.timestamp)
+                get_blocklist().note_rows([row])
+            self._agent_cache.put((message.recipient, message.platform), message.agent)
             
         except Exception as e:
+            session.rollback()
             self.logger.error(f"Failed to update conversation: {e}")
             # Don't raise - conversation update is not critical
     
+    def stored_message_ids(self, message_ids: List[str]) -> Set[str]:
+        """The platform message ids among `message_ids` that are stored."""
+        stored: Set[str] = set()
+        ids = list(dict.fromkeys(mid for mid in message_ids if mid))
+        with get_db_session() as session:
+            for start in range(0, len(ids), 500):
+                stored.update(mid for (mid,) in session.query(Message.message_id).filter(
+                    Message.message_id.in_(ids[start:start + 500])
+                ))
+        return stored
+    
+    # Delivery status progression; a late "delivered" never overwrites "read"
+    STATUS_RANK = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}
+    
+    def apply_status_updates(self, updates: List[Dict[str, Any]]) -> int:
+        """
+        Apply coalesced delivery status updates in one executemany UPDATE.
+        
+        Args:
+            updates: Dicts with message_id, status and an optional
+                {status: datetime} mapping under "timestamps"
+            
+        Returns:
+            int: Number of messages updated
+        """
+        params = []
+        for item in updates:
+            status = item.get("status")
+            rank = self.STATUS_RANK.get(status)
+            if not item.get("message_id") or rank is None:
+                continue
+            timestamps = item.get("timestamps") or {}
+            params.append({
+                "b_message_id": item["message_id"],
+                "b_status": status,
+                "b_rank": rank,
+                "b_sent_at": timestamps.get("sent"),
+                "b_delivered_at": timestamps.get("delivered"),
+                "b_read_at": timestamps.get("read"),
+                "b_failed_at": timestamps.get("failed"),
+            })
+        
+        if not params:
+            return 0
+        
+        table = Message.__table__
+        current_rank = case(self.STATUS_RANK, value=table.c.status, else_=0)
+        stmt = (
+            update(table)
+            .where(table.c.message_id == bindparam("b_message_id"))
+            .values(
+                status=case(
+                    (current_rank < bindparam("b_rank"), bindparam("b_status")),
+                    else_=table.c.status
+                ),
+                sent_at=func.coalesce(table.c.sent_at, bindparam("b_sent_at")),
+                delivered_at=func.coalesce(table.c.delivered_at, bindparam("b_delivered_at")),
+                read_at=func.coalesce(table.c.read_at, bindparam("b_read_at")),
+                failed_at=func.coalesce(table.c.failed_at, bindparam("b_failed_at")),
+                updated_at=datetime.now(timezone.utc)
+            )
+        )
+        
+        try:
+            with get_db_session() as session:
+                result = session.connection().execute(stmt, params)
+                session.commit()
+            self.logger.info(f"Applied status updates - Count: {len(params)}")
+            return result.rowcount if result.rowcount is not None and result.rowcount >= 0 else len(params)
+        except Exception as e:
+            self.logger.error(f"Failed to apply status updates: {e}")
+            raise
+    
     def resolve_incoming_agent(self, recipient: str, platform: str) -> str:
         """Resolve the handling agent for an incoming message based on existing conversation.
 
         Returns the conversation.agent if found; otherwise returns 'Unassigned'.
+        Results are served from an in-process TTL cache when possible.
         """
+        cached = self.cached_incoming_agent(recipient, platform)
+        if cached is not None:
+            return cached
+        
         try:
             with get_db_session() as session:
-                conv = session.query(Conversation).filter(
-                    and_(
-                        Conversation.recipient == recipient,
-                        Conversation.platform == platform
-                    )
-                ).order_by(desc(Conversation.last_message_at)).first()
-                if conv and conv.agent:
-                    return conv.agent
-                return "Unassigned"
+                agent = session.execute(self.conversation_agent_query(recipient, platform)).scalar()
+            return self.cache_incoming_agent(recipient, platform, agent)
         except Exception as e:
             self.logger.error(f"resolve_incoming_agent error: {e}")
             return "Unassigned"
     
+    def cached_incoming_agent(self, recipient: str, platform: str) -> Optional[str]:
+        """Return the cached handling agent for a conversation, or None on a miss."""
+        return self._agent_cache.get((recipient, platform))
+    
+    def cache_incoming_agent(self, recipient: str, platform: str, agent: Optional[str]) -> str:
+        """Cache the agent found for a conversation ('Unassigned' when none) and return it."""
+        agent = agent or "Unassigned"
+        self._agent_cache.put((recipient, platform), agent)
+        return agent
+    
+    @staticmethod
+    def conversation_agent_query(recipient: str, platform: str) -> Select:
+        """SELECT for the agent of the latest conversation with a recipient on a platform."""
+        return (
+            select(Conversation.agent)
+            .where(Conversation.recipient == recipient, Conversation.platform == platform)
+            .order_by(desc(Conversation.last_message_at))
+            .limit(1)
+        )
+    
     def get_messages(
         self,
         agent: Optional[str] = None,
@@ -0,0 +1,549 @@
+"""
+Outbound Send Outbox for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Every /send goes through a transactional outbox: the outgoing message (status
+'queued') and its outbound_sends row are written in one transaction before
+Meta is called, so a crash or a database failure can no longer leave a
+delivered message without its record or a record without its send. In queue
+mode /send answers 202 straight away; in direct mode the request claims its
+own outbox row, calls Meta and records the outcome, and a crash in between
+leaves the row for the relay once the claim's lease expires.
+
+The relay (OutboundWorkerPool) leases due rows in batches, delivers them
+through the shared Graph client, spending one token per send from a bucket
+per sending phone number id / page id, and writes the whole batch's outcomes
+in one transaction. Outcome writes are fenced on the claim, so a worker whose
+lease expired cannot overwrite the row's newer state, and a message leaves
+'queued' exactly once: 'sent' (with its platform message id) or 'failed'.
+A row whose recipient opted out after it was queued fails without a call.
+A send whose response timed out may have reached Meta, so its row is set
+'unconfirmed' and its message left 'queued' for reconciliation, never resent.
+"""
+
+from concurrent.futures import Future
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import itertools
+import logging
+import threading
+import uuid
+
+import requests
+from sqlalchemy import and_, func, or_, update
+
+from ..config import config
+from ..database import Message, OutboundSend, get_db_session
+from ..utils import json_codec
+from ..utils.rate_limit import KeyedRateLimiter
+from .graph_batch import GraphBatcher, get_graph_batcher
+from .graph_client import GraphClient, GraphUnavailable, RETRY_STATUSES, get_graph_client
+from .message_service import get_message_service
+from .blocklist import get_blocklist
+
+logger = logging.getLogger(__name__)
+
+
+class SendError(Exception):
+    """
+    An outgoing send failed; `permanent` failures are not retried, `deferred`
+    ones never reached Graph (open circuit) and do not spend an attempt, and
+    `indeterminate` ones (read timeout) may have been accepted by Meta, so
+    they are held for reconciliation instead of being sent again.
+    """
+
+    def __init__(self, message: str, permanent: bool = False, deferred: bool = False,
+                 indeterminate: bool = False):
+        super().__init__(message)
+        self.permanent = permanent
+        self.deferred = deferred
+        self.indeterminate = indeterminate
+
+    @classmethod
+    def from_transport_error(cls, platform: str, error: Exception) -> "SendError":
+        """
+        Classify an exception raised while sending through GraphClient,
+        AsyncGraphClient or the Graph batcher. A SendError is returned as is.
+        """
+        if isinstance(error, SendError):
+            return error
+        return cls(f"{platform} send failed: {error}", deferred=isinstance(error, GraphUnavailable),
+                   indeterminate=is_read_timeout(error))
+
+
+def is_read_timeout(error: BaseException) -> bool:
+    """
+    True for a requests or httpx read timeout, or a wait on a batched send
+    timing out: the request went out but no response came back.
+    """
+    if isinstance(error, (requests.ReadTimeout, TimeoutError)):
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(error, httpx.ReadTimeout)
+
+
+class OutboundSender:
+    """
+    Delivers one Graph API message payload. Subclass for other transports.
+    Signature: 8598
+    """
+
+    def deliver(self, platform: str, sender_key: str, payload: Dict[str, Any]) -> Optional[str]:
+        """
+        Send `payload` from `sender_key` (phone number id or page id).
+
+        Returns:
+            Optional[str]: Platform message id
+
+        Raises:
+            SendError: If the send failed
+        """
+        raise NotImplementedError
+
+    def submit(self, platform: str, sender_key: str, payload: Dict[str, Any]) -> "Future[Optional[str]]":
+        """
+        Start a send and return a Future of its platform message id. Senders
+        that can overlap or batch sends override this; the default delivers
+        before returning.
+        """
+        future: Future = Future()
+        try:
+            future.set_result(self.deliver(platform, sender_key, payload))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class GraphOutboundSender(OutboundSender):
+    """
+    Sends through the shared Graph API client, or through the Graph batcher
+    when GRAPH_BATCH_WINDOW_MS is set.
+    Signature: 8598
+    """
+
+    def __init__(self, graph: Optional[GraphClient] = None, batcher: Optional[GraphBatcher] = None):
+        self.graph = graph or get_graph_client()
+        # An explicit client means unbatched sends through it unless a batcher is given too
+        self.batcher = batcher if batcher is not None or graph is not None else get_graph_batcher()
+
+    def deliver(self, platform: str, sender_key: str, payload: Dict[str, Any]) -> Optional[str]:
+        if self.batcher is not None:
+            try:
+                return self.submit(platform, sender_key, payload).result(timeout=self.batcher.result_timeout)
+            except TimeoutError as e:
+                raise SendError.from_transport_error(platform, e)
+        path = f"{sender_key}/messages"
+        try:
+            if platform == "Facebook":
+                resp = self.graph.post(path, payload, token=config.facebook.page_access_token, token_in_query=True)
+            else:
+                resp = self.graph.post(path, payload, token=config.whatsapp.access_token)
+        except requests.RequestException as e:
+            raise SendError.from_transport_error(platform, e)
+        return parse_send_response(platform, resp.status_code, resp.text)
+
+    def submit(self, platform: str, sender_key: str, payload: Dict[str, Any]) -> "Future[Optional[str]]":
+        if self.batcher is None:
+            return super().submit(platform, sender_key, payload)
+        token = config.facebook.page_access_token if platform == "Facebook" else config.whatsapp.access_token
+        result: Future = Future()
+
+        def done(item: Future) -> None:
+            try:
+                resp = item.result()
+                result.set_result(parse_send_response(platform, resp.status_code, resp.text))
+            except requests.RequestException as e:
+                result.set_exception(SendError.from_transport_error(platform, e))
+            except Exception as e:
+                result.set_exception(e)
+
+        self.batcher.submit(f"{sender_key}/messages", payload, token=token).add_done_callback(done)
+        return result
+
+
+def parse_send_response(platform: str, status_code: int, text: str) -> Optional[str]:
+    """
+    Platform message id of a Graph send response.
+
+    Raises:
+        SendError: For an error status; 4xx other than 429 is permanent
+    """
+    if status_code >= 400:
+        # The client already retried throttling and 5xx; anything else will fail again
+        raise SendError(f"{platform} send failed: {status_code} {text[:500]}",
+                        permanent=status_code not in RETRY_STATUSES)
+    try:
+        body = json_codec.loads(text) or {}
+    except ValueError:
+        return None
+    if platform == "Facebook":
+        return body.get("message_id")
+    return (body.get("messages") or [{}])[0].get("id")
+
+
+# Stub message ids are unique, like Meta's, so stubs in several runs can share a database
+_stub_prefix = uuid.uuid4().hex[:8]
+_stub_ids = itertools.count(1)
+
+
+class StubOutboundSender(OutboundSender):
+    """
+    In-memory sender for tests and benchmarks. The first `failures` sends
+    raise a retryable SendError.
+    Signature: 8598
+    """
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.sent: List[Tuple[str, str, Dict[str, Any]]] = []
+        self._lock = threading.Lock()
+
+    def deliver(self, platform: str, sender_key: str, payload: Dict[str, Any]) -> Optional[str]:
+        with self._lock:
+            if self.failures > 0:
+                self.failures -= 1
+                raise SendError("stub failure")
+            self.sent.append((platform, sender_key, payload))
+        return f"stub.{_stub_prefix}.{next(_stub_ids)}"
+
+
+# Per-sender token buckets shared by every send path in the process, so queued
+# sends and campaigns draw from one budget per phone number / page
+send_limiters: Dict[str, KeyedRateLimiter] = {
+    "WhatsApp": KeyedRateLimiter(config.outbound.whatsapp_rate, config.outbound.whatsapp_burst),
+    "Facebook": KeyedRateLimiter(config.outbound.facebook_rate, config.outbound.facebook_burst),
+}
+
+
+def get_send_limiters() -> Dict[str, KeyedRateLimiter]:
+    """Get the process-wide per-platform send rate limiters."""
+    return send_limiters
+
+
+def sender_key_for(platform: str) -> str:
+    """The configured sending id of a platform: WhatsApp phone number id or Messenger page id."""
+    return config.facebook.page_id if platform == "Facebook" else config.whatsapp.phone_id
+
+
+class OutboxClaim(NamedTuple):
+    """A leased outbound_sends row. `claimed_at` fences the outcome write to this lease."""
+    id: int
+    message_pk: int
+    platform: str
+    sender_key: str
+    payload: str
+    attempts: int
+    claimed_at: datetime
+
+
+@dataclass
+class SendResult:
+    """Outcome of delivering one claimed row; `status` is set when it is recorded."""
+    claim: OutboxClaim
+    message_id: Optional[str] = None
+    error: Optional[str] = None
+    permanent: bool = False
+    deferred: bool = False  # not sent at all; requeued without spending an attempt
+    indeterminate: bool = False  # may have been sent; held for reconciliation, never resent
+    status: str = ""  # sent | failed | queued (retry) | unconfirmed | stale (lease lost, not recorded)
+
+
+def _write_outbox(record: Dict[str, Any], payload: Dict[str, Any], sender_key: Optional[str],
+                  claimed_at: Optional[datetime]) -> Tuple[Message, OutboundSend]:
+    """Insert the 'queued' message, its outbox row and the conversation update in one transaction."""
+    with get_db_session() as session:
+        row = get_message_service().stage_queued(session, [record])[0]
+        platform = row["platform"]
+        outbox = OutboundSend(
+            message_pk=row["id"],
+            platform=platform,
+            sender_key=sender_key or sender_key_for(platform),
+            recipient=row["recipient"],
+            payload=json_codec.dumps(payload),
+        )
+        if claimed_at is not None:
+            outbox.status = "sending"
+            outbox.claimed_at = claimed_at
+        session.add(outbox)
+        session.commit()
+        message = session.get(Message, row["id"])
+        session.refresh(outbox)
+        session.expunge(message)
+        session.expunge(outbox)
+    return message, outbox
+
+
+def enqueue_send(record: Dict[str, Any], payload: Dict[str, Any], sender_key: Optional[str] = None) -> Message:
+    """
+    Write an outgoing message with status 'queued' and its outbound_sends
+    row in one transaction, for the relay to deliver.
+
+    Args:
+        record: Message record with the same keys as MessageService.log_message
+        payload: Graph API request body to deliver
+        sender_key: Sending phone number id / page id (default: configured one)
+
+    Returns:
+        Message: The stored message; its id is the local send id
+    """
+    message, _ = _write_outbox(record, payload, sender_key, None)
+    return message
+
+
+def enqueue_claimed(record: Dict[str, Any], payload: Dict[str, Any], sender_key: Optional[str] = None) -> OutboxClaim:
+    """
+    Like enqueue_send, but the row is written already leased to the caller,
+    which delivers it inline and passes the result to OutboundWorkerPool.record.
+    If the caller dies first, the relay sends the row once the lease expires.
+
+    Returns:
+        OutboxClaim: The caller's claim on the new row
+    """
+    now = datetime.now(timezone.utc)
+    message, outbox = _write_outbox(record, payload, sender_key, now)
+    return OutboxClaim(outbox.id, message.id, outbox.platform, outbox.sender_key, outbox.payload, 0, now)
+
+
+class OutboundWorkerPool:
+    """
+    Outbox relay: background workers that deliver queued sends under
+    per-sender rate limits.
+    Signature: 8598
+
+    Each worker leases a batch of due rows, sends them (one at a time, or
+    all together into Graph batch requests when the sender batches) and
+    records the batch's outcomes in one transaction. A row whose sender has no token left goes
+    back to the queue until one will have refilled; a row left claimed by a
+    crashed worker or /send request is picked up again once its lease
+    expires. Rate limits are per process: divide Meta's limit by the number
+    of processes running workers.
+    """
+
+    def __init__(
+        self,
+        sender: OutboundSender,
+        limiters: Optional[Dict[str, KeyedRateLimiter]] = None,
+        workers: int = 4,
+        batch_size: int = 20,
+        poll_interval: float = 0.25,
+        lease_seconds: int = 60,
+        max_attempts: int = 5,
+        retry_backoff: float = 2.0,
+        retry_backoff_max: float = 300.0
+    ):
+        self.sender = sender
+        self.limiters = limiters if limiters is not None else get_send_limiters()
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._stats = {"sent": 0, "failed": 0, "retried": 0, "deferred": 0, "unconfirmed": 0, "stale": 0}
+
+    def start(self) -> None:
+        """Start the worker threads."""
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"send-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.logger.info(f"Send workers started ({self.workers}) - Signature: 8598")
+
+    def stop(self, timeout: Optional[float] = 5.0) -> None:
+        """Signal the workers to stop and wait for them."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def claim(self, limit: int) -> List[OutboxClaim]:
+        """Lease up to `limit` due rows."""
+        now = datetime.now(timezone.utc)
+        ready = or_(
+            and_(OutboundSend.status == "queued", OutboundSend.available_at <= now),
+            and_(OutboundSend.status == "sending", OutboundSend.claimed_at < now - timedelta(seconds=self.lease_seconds))
+        )
+        claimed = []
+        with get_db_session() as session:
+            candidates = session.query(
+                OutboundSend.id, OutboundSend.message_pk, OutboundSend.platform, OutboundSend.sender_key,
+                OutboundSend.payload, OutboundSend.attempts
+            ).filter(ready).order_by(OutboundSend.available_at, OutboundSend.id).limit(limit).all()
+            for row in candidates:
+                # Conditional update: another worker or process may have won the row
+                result = session.execute(
+                    update(OutboundSend).where(OutboundSend.id == row.id, ready).values(
+                        status="sending", claimed_at=now
+                    )
+                )
+                if result.rowcount:
+                    claimed.append(OutboxClaim(*row, now))
+            session.commit()
+        return claimed
+
+    def deliver(self, claim: OutboxClaim) -> SendResult:
+        """Send one claimed row. Errors are returned in the result, not raised."""
+        return self._result(claim, self._submit(claim))
+
+    def _submit(self, claim: OutboxClaim) -> "Future[Optional[str]]":
+        try:
+            payload = json_codec.loads(claim.payload)
+            recipient = payload.get("to") or (payload.get("recipient") or {}).get("id")
+            if get_blocklist().is_blocked(recipient, claim.platform):
+                raise SendError("recipient opted out", permanent=True)
+            return self.sender.submit(claim.platform, claim.sender_key, payload)
+        except Exception as e:
+            future: Future = Future()
+            future.set_exception(e)
+            return future
+
+    @staticmethod
+    def _result(claim: OutboxClaim, future: "Future[Optional[str]]") -> SendResult:
+        try:
+            message_id = future.result()
+        except Exception as e:
+            return SendResult(claim, error=str(e), permanent=getattr(e, "permanent", False),
+                              deferred=getattr(e, "deferred", False),
+                              indeterminate=getattr(e, "indeterminate", False))
+        return SendResult(claim, message_id=message_id)
+
+    def record(self, results: List[SendResult]) -> List[SendResult]:
+        """
+        Write delivery outcomes in one transaction and set each result's status.
+
+        Every write is conditional on the row still being held by the same
+        claim, and the message only moves out of 'queued' once, so a worker
+        whose lease expired cannot overwrite a newer outcome or log a send twice.
+        """
+        if not results:
+            return results
+        now = datetime.now(timezone.utc)
+        with get_db_session() as session:
+            for result in results:
+                claim = result.claim
+                attempts = claim.attempts if result.deferred else claim.attempts + 1
+                if result.error is None:
+                    status, values = "sent", {"sent_at": now, "last_error": None}
+                elif result.deferred:
+                    status, values = "queued", {"last_error": result.error[:1000],
+                                                "available_at": now + timedelta(seconds=self.retry_backoff)}
+                elif result.indeterminate:
+                    # Meta may have accepted it: resending could deliver it twice
+                    status, values = "unconfirmed", {"last_error": result.error[:1000]}
+                elif result.permanent or attempts >= self.max_attempts:
+                    status, values = "failed", {"last_error": result.error[:1000]}
+                else:
+                    delay = min(self.retry_backoff_max, self.retry_backoff * (2 ** (attempts - 1)))
+                    status, values = "queued", {"last_error": result.error[:1000],
+                                                "available_at": now + timedelta(seconds=delay)}
+                held = session.execute(update(OutboundSend).where(
+                    OutboundSend.id == claim.id,
+                    OutboundSend.status == "sending",
+                    OutboundSend.claimed_at == claim.claimed_at
+                ).values(status=status, attempts=attempts, updated_at=now, **values))
+                if not held.rowcount:
+                    result.status = "stale"
+                    continue
+                result.status = status
+                if status == "sent":
+                    session.execute(update(Message).where(Message.id == claim.message_pk, Message.status == "queued")
+                                    .values(status="sent", message_id=result.message_id, sent_at=now, updated_at=now))
+                elif status == "failed":
+                    session.execute(update(Message).where(Message.id == claim.message_pk, Message.status == "queued")
+                                    .values(status="failed", failed_at=now, updated_at=now))
+            session.commit()
+        with self._lock:
+            for result in results:
+                if result.deferred and result.status == "queued":
+                    self._stats["deferred"] += 1
+                else:
+                    self._stats[{"queued": "retried"}.get(result.status, result.status)] += 1
+        for result in results:
+            if result.status == "unconfirmed":
+                self.logger.warning(f"Send {result.claim.id} unconfirmed, held for reconciliation: {result.error}")
+            elif result.error is not None and result.status != "stale" and not result.deferred:
+                self.logger.warning(f"Send {result.claim.id} failed (attempt {result.claim.attempts + 1}): {result.error}")
+        return results
+
+    def drain_once(self) -> int:
+        """Claim, deliver and record one batch. Returns the number of rows claimed."""
+        batch = self.claim(self.batch_size)
+        # Start every send before waiting on any, so a batching sender can coalesce them
+        started: List[Tuple[OutboxClaim, Future]] = []
+        # sender -> (wait, ids): once a sender is out of tokens the rest of its rows go back together
+        deferred: Dict[Tuple[str, str], Tuple[float, List[int]]] = {}
+        for claim in batch:
+            key = (claim.platform, claim.sender_key)
+            if key in deferred or self._stop.is_set():
+                deferred.setdefault(key, (0.0, []))[1].append(claim.id)
+                continue
+            limiter = self.limiters.get(claim.platform)
+            wait = limiter.try_acquire(claim.sender_key) if limiter is not None else 0.0
+            if wait and not (wait <= self.poll_interval and limiter.acquire(claim.sender_key, timeout=wait)):
+                deferred[key] = (wait, [claim.id])
+                continue
+            started.append((claim, self._submit(claim)))
+        self.record([self._result(claim, future) for claim, future in started])
+        for wait, ids in deferred.values():
+            self._release(ids, wait)
+        return len(batch)
+
+    def depth(self) -> Dict[str, int]:
+        """Row counts by status."""
+        with get_db_session() as session:
+            rows = session.query(OutboundSend.status, func.count()).group_by(OutboundSend.status).all()
+        return {status: count for status, count in rows}
+
+    def running(self) -> bool:
+        """True while this pool's worker threads are started."""
+        return bool(self._threads)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters since start, the configured concurrency and the rate limiters."""
+        with self._lock:
+            stats = dict(self._stats, workers=self.workers, running=self.running())
+        stats["limits"] = {platform: limiter.stats() for platform, limiter in self.limiters.items()}
+        return stats
+
+    def _release(self, send_ids: List[int], delay: float) -> None:
+        """Put claimed rows back in the queue without spending an attempt."""
+        with self._lock:
+            self._stats["deferred"] += len(send_ids)
+        with get_db_session() as session:
+            session.execute(update(OutboundSend).where(
+                OutboundSend.id.in_(send_ids), OutboundSend.status == "sending"
+            ).values(status="queued", available_at=datetime.now(timezone.utc) + timedelta(seconds=delay)))
+            session.commit()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if not self.drain_once():
+                    self._stop.wait(self.poll_interval)
+            except Exception as e:
+                self.logger.error(f"Send worker error: {e}")
+                self._stop.wait(self.poll_interval)
+
+
+def get_outbound_send(message_pk: int) -> Optional[Dict[str, Any]]:
+    """Queue state of a queued message as a dict with its message status and id, or None."""
+    with get_db_session() as session:
+        row = session.query(OutboundSend, Message.status, Message.message_id).join(
+            Message, Message.id == OutboundSend.message_pk
+        ).filter(OutboundSend.message_pk == message_pk).first()
+        if row is None:
+            return None
+        send, message_status, message_id = row
+        result = send.to_dict()
+        result.update(message_status=message_status, message_id=message_id)
+        return result
@@ -0,0 +1,160 @@
+"""
+Customer-Service Window Index for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+WhatsApp allows free-form messages only within 24 hours of the customer's
+last message; outside that window a business must send an approved
+template. ServiceWindowIndex keeps each recipient's last inbound time in
+memory so /send and campaigns can pick text or template without a query.
+It is warmed from conversations.last_inbound_at (recipients still inside the
+window only), updated by this process's ingestion as batches commit, and
+pulls inbound times recorded by other processes every `check_interval`
+seconds with one indexed range query. A late pull can only make a window
+look closed, so the fallback is a template, never a rejected text.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import logging
+import time
+
+from sqlalchemy.orm import Session
+
+from ..config import config
+from ..database import Conversation
+from ..utils.refreshing import RefreshingIndex
+from ..utils.timestamps import utc_epoch
+
+logger = logging.getLogger(__name__)
+
+
+def window_key(recipient: str) -> str:
+    """Index key of a recipient: inbound WhatsApp ids have no '+', /send numbers do."""
+    return str(recipient or "").strip().lstrip("+")
+
+
+class ServiceWindowIndex(RefreshingIndex):
+    """
+    In-memory last-inbound time per (platform, recipient).
+    Signature: 8598
+    """
+
+    def __init__(
+        self,
+        hours: float = 24.0,
+        margin_seconds: float = 300.0,
+        check_interval: float = 5.0,
+        clock: Callable[[], float] = time.time
+    ):
+        super().__init__(check_interval, clock)
+        self.span = hours * 3600 - margin_seconds  # seconds a window is treated as open
+        self._last: Dict[str, Dict[str, float]] = {}  # platform -> recipient key -> epoch seconds
+        self._watermark: Optional[float] = None  # newest time pulled from the database; None until warmed
+        self._pruned_at = 0.0
+        self.checks = 0
+        self.loads = 0
+
+    def loaded(self) -> bool:
+        return self._watermark is not None
+
+    def _sync(self, session: Session, now: float, force: bool) -> None:
+        # Warm the index, or pull inbound times newer than the last pull
+        since = datetime.fromtimestamp(now - self.span, timezone.utc)
+        if self._watermark is not None and not force:
+            since = max(since, self.pull_since(self._watermark))
+        rows = session.query(Conversation.platform, Conversation.recipient, Conversation.last_inbound_at).filter(
+            Conversation.last_inbound_at >= since
+        ).all()
+        watermark = self._watermark or since.timestamp()
+        for platform, recipient, at in rows:
+            at = utc_epoch(at)
+            self._note(platform, recipient, at)
+            watermark = max(watermark, at)
+        if force or self._watermark is None:
+            self.loads += 1
+        self.checks += 1
+        self._watermark = watermark
+        if now - self._pruned_at >= self.check_interval * 12:
+            self._prune(now)
+
+    def note(self, platform: str, recipient: str, at: datetime) -> None:
+        """Record an inbound message committed by this process."""
+        with self._lock:
+            self._note(platform, recipient, utc_epoch(at))
+
+    def note_rows(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """Record the incoming rows of a committed message batch."""
+        with self._lock:
+            for row in rows:
+                if row.get("is_incoming"):
+                    self._note(row["platform"], row["recipient"], utc_epoch(row["timestamp"]))
+
+    def expires_at(self, recipient: str, platform: str = "WhatsApp") -> Optional[datetime]:
+        """When the recipient's window closes, or None if it is not open."""
+        self.refresh()
+        last = self._last.get(platform, {}).get(window_key(recipient))
+        if last is None or self.clock() >= last + self.span:
+            return None
+        return datetime.fromtimestamp(last + self.span, timezone.utc)
+
+    def is_open(self, recipient: str, platform: str = "WhatsApp") -> bool:
+        """True if free-form messages to the recipient are allowed now."""
+        return self.expires_at(recipient, platform) is not None
+
+    def lookup(self, recipients: Iterable[str], platform: str = "WhatsApp") -> Dict[str, Optional[datetime]]:
+        """Window expiry (None when closed) for each recipient, keyed as given."""
+        self.refresh()
+        now = self.clock()
+        last = self._last.get(platform, {})
+        result = {}
+        for recipient in recipients:
+            at = last.get(window_key(recipient))
+            open_ = at is not None and now < at + self.span
+            result[recipient] = datetime.fromtimestamp(at + self.span, timezone.utc) if open_ else None
+        return result
+
+    def open_recipients(self, platform: str = "WhatsApp", limit: Optional[int] = None) -> List[Tuple[str, datetime]]:
+        """Recipients whose window is open, soonest to close first, with their expiry."""
+        self.refresh()
+        cutoff = self.clock() - self.span
+        with self._lock:
+            entries = [(key, at) for key, at in self._last.get(platform, {}).items() if at > cutoff]
+        entries.sort(key=lambda entry: entry[1])
+        if limit is not None:
+            entries = entries[:limit]
+        return [(key, datetime.fromtimestamp(at + self.span, timezone.utc)) for key, at in entries]
+
+    def stats(self) -> Dict[str, Any]:
+        """Tracked recipients per platform and pull counters."""
+        return {
+            "recipients": {platform: len(entries) for platform, entries in self._last.items()},
+            "checks": self.checks,
+            "loads": self.loads,
+            "watermark": datetime.fromtimestamp(self._watermark, timezone.utc).isoformat() if self._watermark else None,
+        }
+
+    def _note(self, platform: str, recipient: str, at: float) -> None:
+        entries = self._last.setdefault(platform, {})
+        key = window_key(recipient)
+        if at > entries.get(key, 0.0):
+            entries[key] = at
+
+    def _prune(self, now: float) -> None:
+        # Closed windows can only reopen through a new inbound message, which is noted again
+        cutoff = now - self.span
+        for platform, entries in self._last.items():
+            self._last[platform] = {key: at for key, at in entries.items() if at > cutoff}
+        self._pruned_at = now
+
+
+# Global service window index
+service_window = ServiceWindowIndex(
+    hours=config.window.hours,
+    margin_seconds=config.window.margin_seconds,
+    check_interval=config.window.check_interval
+)
+
+
+def get_service_window() -> ServiceWindowIndex:
+    """Get the global customer-service window index."""
+    return service_window
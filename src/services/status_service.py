@@ -0,0 +1,234 @@
+"""
+Delivery Status Service for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Coalesces WhatsApp status callbacks (sent/delivered/read/failed) per
+message id over a short window, so a sent→delivered→read burst for one
+message becomes a single UPDATE, and flushes them in batches. Whatever is
+still buffered is flushed at interpreter exit. Spool workers, whose payloads
+are acked only once processed, apply their statuses with apply() instead, so
+an acked payload's statuses for stored messages are never only in memory.
+
+A status can arrive before its message id is stored (the outbox records the
+id after Meta answers). Such updates are held in memory, in either mode, and
+retried on every flush for up to `unmatched_ttl` seconds, then dropped with a
+warning and counted. A restart within that window loses them; stop() logs
+how many were still held.
+"""
+
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+import atexit
+import logging
+import threading
+import time
+
+from ..config import config
+from .message_service import MessageService, get_message_service
+from .extraction import StatusUpdate
+
+logger = logging.getLogger(__name__)
+
+
+class StatusCoalescer:
+    """
+    Buffers status updates per message id and flushes them periodically.
+    Signature: 8598
+    """
+
+    def __init__(
+        self,
+        message_service: Optional[MessageService] = None,
+        window: float = 1.0,
+        max_pending: int = 500,
+        unmatched_ttl: float = 60.0,
+        max_unmatched: int = 10000,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.message_service = message_service or get_message_service()
+        self.window = window
+        self.max_pending = max_pending
+        self.unmatched_ttl = unmatched_ttl
+        self.max_unmatched = max_unmatched
+        self.clock = clock
+        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        # Updates for message ids not stored yet, and when each id first missed
+        self._unmatched: Dict[str, Dict[str, Any]] = {}
+        self._unmatched_since: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.received = 0
+        self.flushed = 0
+        self.dropped = 0
+
+    def submit(self, updates: List[StatusUpdate]) -> None:
+        """
+        Queue status updates. Each update has message_id, status and an
+        optional timestamp (datetime) of the transition.
+        """
+        with self._lock:
+            for update in updates:
+                message_id = update.message_id
+                status = update.status
+                if not message_id or status not in MessageService.STATUS_RANK:
+                    continue
+                self.received += 1
+                timestamp: Optional[datetime] = update.timestamp
+                self._merge(self._pending, message_id, status, {status: timestamp} if timestamp else {})
+            full = len(self._pending) >= self.max_pending
+
+        self._ensure_started()
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """
+        Write all pending updates now, retrying held unmatched ones. Returns
+        the number of messages flushed.
+        """
+        with self._lock:
+            for entry in self._unmatched.values():
+                self._merge(self._pending, entry["message_id"], entry["status"], entry["timestamps"])
+            self._unmatched = {}
+            batch = list(self._pending.values())
+            self._pending = {}
+        if not batch:
+            return 0
+        try:
+            matched = self._write(batch)
+        except Exception as e:
+            self.logger.error(f"Status flush failed, requeueing {len(batch)} updates: {e}")
+            self._requeue(batch)
+            return 0
+        self.flushed += matched
+        return matched
+
+    def apply(self, updates: List[StatusUpdate]) -> int:
+        """
+        Write status updates now, coalesced among themselves, bypassing the
+        buffer. Errors propagate so the caller can retry the updates. Updates
+        for message ids not stored yet are held in memory (see the module
+        docstring) and are not counted.
+        """
+        merged: Dict[str, Dict[str, Any]] = {}
+        for update in updates:
+            if update.message_id and update.status in MessageService.STATUS_RANK:
+                timestamp: Optional[datetime] = update.timestamp
+                self._merge(merged, update.message_id, update.status, {update.status: timestamp} if timestamp else {})
+        if not merged:
+            return 0
+        matched = self._write(list(merged.values()))
+        with self._lock:
+            self.received += len(updates)
+            self.flushed += matched
+        if self._unmatched:
+            self._ensure_started()
+        return matched
+
+    def stop(self, timeout: Optional[float] = 5.0) -> int:
+        """Stop the flush thread and write whatever is still pending. Returns the number flushed."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        flushed = self.flush()
+        if self._unmatched:
+            self.logger.warning(f"Stopping with {len(self._unmatched)} status updates for unknown message ids unwritten")
+        return flushed
+
+    def pending(self) -> int:
+        """Number of message ids waiting to be flushed."""
+        return len(self._pending)
+
+    def stats(self) -> Dict[str, int]:
+        """Return submitted, flushed, pending, held unmatched and dropped unmatched counters."""
+        return {"received": self.received, "flushed": self.flushed, "pending": self.pending(),
+                "unmatched": len(self._unmatched), "dropped": self.dropped}
+
+    def _write(self, batch: List[Dict[str, Any]]) -> int:
+        """
+        Apply the updates whose message is stored and hold the rest for the
+        next flush. Looking up before updating means a message stored in
+        between is retried, never missed. Returns the number applied.
+        """
+        stored = self.message_service.stored_message_ids([entry["message_id"] for entry in batch])
+        matched = [entry for entry in batch if entry["message_id"] in stored]
+        if matched:
+            self.message_service.apply_status_updates(matched)
+        self._hold([entry for entry in batch if entry["message_id"] not in stored],
+                   [entry["message_id"] for entry in matched])
+        return len(matched)
+
+    def _hold(self, unmatched: List[Dict[str, Any]], matched_ids: List[str]) -> None:
+        now = self.clock()
+        expired = []
+        with self._lock:
+            for message_id in matched_ids:
+                self._unmatched_since.pop(message_id, None)
+            for entry in unmatched:
+                message_id = entry["message_id"]
+                since = self._unmatched_since.setdefault(message_id, now)
+                if now - since >= self.unmatched_ttl or (
+                        message_id not in self._unmatched and len(self._unmatched) >= self.max_unmatched):
+                    del self._unmatched_since[message_id]
+                    expired.append(message_id)
+                    continue
+                self._merge(self._unmatched, message_id, entry["status"], entry["timestamps"])
+            self.dropped += len(expired)
+        if expired:
+            self.logger.warning(
+                f"Dropped {len(expired)} status updates for unknown message ids, e.g. {', '.join(expired[:5])}"
+            )
+
+    def _requeue(self, batch: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            for entry in batch:
+                self._merge(self._pending, entry["message_id"], entry["status"], entry["timestamps"])
+
+    @staticmethod
+    def _merge(pending: Dict[str, Dict[str, Any]], message_id: str, status: str,
+               timestamps: Dict[str, datetime]) -> None:
+        # Caller holds the lock for the shared buffer. Keep the furthest status and the earliest time per transition.
+        ranks = MessageService.STATUS_RANK
+        entry = pending.setdefault(message_id, {"message_id": message_id, "status": status, "timestamps": {}})
+        if ranks[status] > ranks[entry["status"]]:
+            entry["status"] = status
+        for name, timestamp in timestamps.items():
+            if name not in entry["timestamps"] or timestamp < entry["timestamps"][name]:
+                entry["timestamps"][name] = timestamp
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="status-coalescer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(self.window)
+            self._wakeup.clear()
+            if self._stop.is_set():
+                break  # stop() writes the rest
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.error(f"Status coalescer error: {e}")
+
+
+# Global status coalescer instance
+status_coalescer = StatusCoalescer(
+    window=config.ingest.status_window,
+    max_pending=config.ingest.status_batch_size,
+    unmatched_ttl=config.ingest.status_unmatched_ttl
+)
+atexit.register(status_coalescer.stop)
+
+
+def get_status_coalescer() -> StatusCoalescer:
+    """Get the global status coalescer instance."""
+    return status_coalescer
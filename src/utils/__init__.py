@@ -7,10 +7,20 @@ from .logging import setup_logging, get_logger, PerformanceLogger, log_function_
 from .security import validate_webhook_signature, sanitize_input, is_valid_phone_number, is_valid_email
 from .validators import validate_whatsapp_payload, validate_facebook_payload
 from .agents import extract_initials_and_strip, format_agent_display
+from .cache import LRUCache
+from .bloom import BloomFilter
+from .backpressure import LoadShedder
+from .rate_limit import TokenBucket, KeyedRateLimiter
+from .resilience import CircuitBreaker, AIMDLimiter
+from .refreshing import RefreshingIndex
+from .timestamps import as_utc, utc_epoch
+from . import json_codec
 
 __all__ = [
     "setup_logging", "get_logger", "PerformanceLogger", "log_function_call",
     "validate_webhook_signature", "sanitize_input", "is_valid_phone_number", "is_valid_email",
     "validate_whatsapp_payload", "validate_facebook_payload",
-    "extract_initials_and_strip", "format_agent_display"
+    "extract_initials_and_strip", "format_agent_display",
+    "LRUCache", "BloomFilter", "LoadShedder", "TokenBucket", "KeyedRateLimiter", "CircuitBreaker", "AIMDLimiter",
+    "RefreshingIndex", "as_utc", "utc_epoch", "json_codec"
 ]
@@ -0,0 +1,88 @@
+"""
+Backpressure for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Bounded in-flight accounting for request handlers. Past the high-water mark
+requests are shed immediately (the caller answers 503 + Retry-After) instead
+of queueing on the database pool until it times out.
+"""
+
+from threading import Lock
+from typing import Any, Callable, Dict, Optional
+import time
+
+
+class LoadShedder:
+    """
+    Admits at most `high_water` concurrent requests per process and,
+    optionally, sheds while an external queue (e.g. the ingest spool) is
+    deeper than `queue_high_water`. A high_water of 0 disables the limit.
+    Signature: 8598
+    """
+
+    def __init__(
+        self,
+        high_water: int,
+        retry_after: int = 1,
+        queue_depth: Optional[Callable[[], int]] = None,
+        queue_high_water: int = 0,
+        probe_interval: float = 0.5
+    ):
+        self.high_water = high_water
+        self.retry_after = retry_after
+        self.queue_depth = queue_depth
+        self.queue_high_water = queue_high_water
+        self.probe_interval = probe_interval
+        self._lock = Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.admitted = 0
+        self.shed = 0
+        self._depth = 0
+        self._depth_checked_at = 0.0
+
+    def try_acquire(self) -> bool:
+        """Admit one request, or count it as shed and return False."""
+        overloaded = self._queue_overloaded()
+        with self._lock:
+            if overloaded or (self.high_water and self.in_flight >= self.high_water):
+                self.shed += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            if self.in_flight > self.peak:
+                self.peak = self.in_flight
+            return True
+
+    def release(self) -> None:
+        """Finish a request admitted by try_acquire."""
+        with self._lock:
+            self.in_flight -= 1
+
+    def _queue_overloaded(self) -> bool:
+        if self.queue_depth is None or not self.queue_high_water:
+            return False
+        # Probing the queue is a query; reuse the last answer for a short interval
+        now = time.monotonic()
+        if now - self._depth_checked_at >= self.probe_interval:
+            self._depth_checked_at = now
+            try:
+                self._depth = self.queue_depth()
+            except Exception:
+                self._depth = 0
+        return self._depth >= self.queue_high_water
+
+    def stats(self) -> Dict[str, Any]:
+        """Return in-flight, queue depth and shed counters."""
+        stats = {
+            "in_flight": self.in_flight,
+            "high_water": self.high_water,
+            "peak": self.peak,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "retry_after": self.retry_after,
+        }
+        if self.queue_depth is not None:
+            stats["queue_depth"] = self._depth
+            stats["queue_high_water"] = self.queue_high_water
+        return stats
@@ -0,0 +1,64 @@
+"""
+Bloom Filter for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+"""
+
+from typing import Any, Dict, List
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    Fixed-size set membership filter: no false negatives, false positives at
+    about `error_rate` while it holds no more than `capacity` keys. Keys
+    cannot be removed. Lookups are safe alongside one writer at a time.
+    Signature: 8598
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(1, int(capacity))
+        self.error_rate = min(max(error_rate, 1e-9), 0.5)
+        self.size = max(64, math.ceil(-self.capacity * math.log(self.error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str) -> List[int]:
+        # Double hashing over one 128-bit digest instead of `hashes` separate hashes
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str) -> bool:
+        """Add a key. Returns False if it was (probably) present already."""
+        added = False
+        for position in self._positions(key):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not self._bits[byte] & mask:
+                self._bits[byte] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def false_positive_rate(self) -> float:
+        """Expected false positive rate at the current fill."""
+        return (1.0 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "keys": self.count,
+            "capacity": self.capacity,
+            "bytes": len(self._bits),
+            "hashes": self.hashes,
+            "false_positive_rate": round(self.false_positive_rate(), 6),
+        }
@@ -0,0 +1,85 @@
+"""
+In-process caches for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+import time
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded least-recently-used cache with optional TTL.
+    Signature: 8598
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 10000, ttl: Optional[float] = None):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        # key -> (value, expires_at); expires_at is None when there is no TTL
+        self._data: "OrderedDict[Hashable, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value (refreshing its recency) or `default`."""
+        with self._lock:
+            item = self._data.get(key, self._MISSING)
+            if item is not self._MISSING and item[1] is not None and item[1] <= time.monotonic():
+                del self._data[key]
+                item = self._MISSING
+            if item is self._MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: Any = True) -> None:
+        """Insert or refresh a key, evicting the least recently used entry if full."""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def put_many(self, keys: Iterable[Hashable], value: Any = True) -> None:
+        """Insert several keys with the same value."""
+        for key in keys:
+            self.put(key, value)
+
+    def discard(self, key: Hashable) -> None:
+        """Remove a key if present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Drop every entry and reset counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, self._MISSING) is not self._MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size and hit/miss counters."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
@@ -0,0 +1,67 @@
+"""
+JSON codec for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Single place for JSON encoding/decoding on hot paths. Uses orjson when it is
+installed and falls back to the standard library otherwise; both backends
+produce UTF-8 output without ASCII escaping.
+"""
+
+from typing import Any, Callable, Optional, Union
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised when orjson is absent
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+JSONDecodeError = json.JSONDecodeError  # orjson.JSONDecodeError subclasses this
+
+
+def dumps_bytes(obj: Any, default: Optional[Callable[[Any], Any]] = None, sort_keys: bool = False) -> bytes:
+    """Serialize `obj` to UTF-8 encoded JSON bytes."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(obj, default=default, sort_keys=sort_keys, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None, sort_keys: bool = False) -> str:
+    """Serialize `obj` to a JSON string."""
+    if orjson is not None:
+        return dumps_bytes(obj, default=default, sort_keys=sort_keys).decode("utf-8")
+    return json.dumps(obj, default=default, sort_keys=sort_keys, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """Deserialize JSON from str or bytes. Raises ValueError on invalid input."""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by the codec, so request.get_json() and
+    jsonify() share the fast backend. Pretty-printed output (indent) and
+    custom encoder classes still go through the stdlib implementation.
+    Signature: 8598
+    """
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs.get("indent") is not None or kwargs.get("cls") is not None:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, default=self.default, sort_keys=kwargs.get("sort_keys", self.sort_keys))
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
@@ -0,0 +1,173 @@
+"""
+Stage Latency Metrics for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Low-overhead per-stage timing for the webhook pipeline. A request opens a
+StageTrace; code along the pipeline adds perf_counter_ns durations to the
+current trace (a no-op when no trace is open), and the finished trace is
+folded into fixed-bucket in-process histograms, one per stage.
+"""
+
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter_ns
+from typing import Any, Dict, List, Optional
+
+# Bucket upper bounds in ns: R10 series (10 per decade) from 1us to 100s
+_R10 = (1.0, 1.25, 1.6, 2.0, 2.5, 3.15, 4.0, 5.0, 6.3, 8.0)
+BUCKET_BOUNDS: List[int] = [int(m * 10 ** e) for e in range(3, 11) for m in _R10] + [10 ** 11]
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram (~25% resolution) with exact count,
+    sum, min and max.
+    Signature: 8598
+    """
+
+    __slots__ = ("counts", "count", "total_ns", "min_ns", "max_ns")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = 0
+        self.max_ns = 0
+
+    def record(self, ns: int) -> None:
+        """Add one observation. Callers serialize access."""
+        self.counts[bisect_left(BUCKET_BOUNDS, ns)] += 1
+        if not self.count or ns < self.min_ns:
+            self.min_ns = ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+        self.count += 1
+        self.total_ns += ns
+
+    def percentile(self, pct: float) -> int:
+        """Upper bound of the bucket holding the pct-th observation, capped at the max."""
+        if not self.count:
+            return 0
+        rank = max(1, int(pct / 100 * self.count + 0.5))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                bound = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.max_ns
+                return min(bound, self.max_ns)
+        return self.max_ns
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Summary in microseconds."""
+        return {
+            "count": self.count,
+            "mean_us": round(self.total_ns / self.count / 1000, 1) if self.count else 0.0,
+            "min_us": round(self.min_ns / 1000, 1),
+            "p50_us": round(self.percentile(50) / 1000, 1),
+            "p95_us": round(self.percentile(95) / 1000, 1),
+            "p99_us": round(self.percentile(99) / 1000, 1),
+            "max_us": round(self.max_ns / 1000, 1),
+            "total_ms": round(self.total_ns / 1e6, 1),
+        }
+
+
+class StageTrace:
+    """Per-request accumulator of nanoseconds spent in each stage."""
+
+    __slots__ = ("started_ns", "stages")
+
+    def __init__(self):
+        self.started_ns = perf_counter_ns()
+        self.stages: Dict[str, int] = {}
+
+    def add(self, stage: str, ns: int) -> None:
+        self.stages[stage] = self.stages.get(stage, 0) + ns
+
+    def as_micros(self) -> Dict[str, float]:
+        """Per-stage breakdown of this request in microseconds."""
+        return {stage: round(ns / 1000, 1) for stage, ns in self.stages.items()}
+
+
+_current_trace: ContextVar[Optional[StageTrace]] = ContextVar("stage_trace", default=None)
+
+
+class stage:
+    """
+    Context manager timing a block into the current trace.
+
+        with stage("insert"):
+            ...
+    """
+
+    __slots__ = ("name", "trace", "started_ns")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> "stage":
+        self.trace = _current_trace.get()
+        if self.trace is not None:
+            self.started_ns = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        if self.trace is not None:
+            self.trace.add(self.name, perf_counter_ns() - self.started_ns)
+
+
+def add_stage(name: str, ns: int) -> None:
+    """Add a duration measured by the caller to the current trace, if any."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, ns)
+
+
+def tracing() -> bool:
+    """True when a trace is open, so callers can skip taking timestamps otherwise."""
+    return _current_trace.get() is not None
+
+
+class StageMetrics:
+    """
+    In-process histograms of per-request stage latency.
+    Signature: 8598
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._lock = Lock()
+
+    def start(self) -> Optional[StageTrace]:
+        """Open a trace for the current request (None when disabled)."""
+        if not self.enabled:
+            return None
+        trace = StageTrace()
+        _current_trace.set(trace)
+        return trace
+
+    def finish(self, trace: Optional[StageTrace]) -> Optional[StageTrace]:
+        """Close a trace and fold its stages and total time into the histograms."""
+        if trace is None:
+            return None
+        trace.stages["total"] = perf_counter_ns() - trace.started_ns
+        _current_trace.set(None)
+        with self._lock:
+            for name, ns in trace.stages.items():
+                histogram = self._histograms.get(name)
+                if histogram is None:
+                    histogram = self._histograms[name] = LatencyHistogram()
+                histogram.record(ns)
+        return trace
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Per-stage summaries, slowest total time first."""
+        with self._lock:
+            items = [(name, h.snapshot()) for name, h in self._histograms.items()]
+        return dict(sorted(items, key=lambda item: -item[1]["total_ms"]))
+
+    def reset(self) -> None:
+        """Drop all recorded observations."""
+        with self._lock:
+            self._histograms = {}
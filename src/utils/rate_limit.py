@@ -0,0 +1,101 @@
+"""
+Rate Limiting for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Token buckets for outbound sends. Meta throttles per sending WhatsApp phone
+number and per Messenger page, so each sender id gets its own bucket: sends
+spend a token, tokens refill at a steady rate and a full bucket allows a
+short burst.
+"""
+
+from threading import Lock
+from typing import Any, Callable, Dict, Optional
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. `rate` tokens per second, at most `burst`
+    tokens banked. A rate of 0 disables the limit.
+    Signature: 8598
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+        self._lock = Lock()
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """
+        Spend `tokens` if available.
+
+        Returns:
+            float: 0.0 on success, else seconds until enough tokens will have refilled
+        """
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0, timeout: float = 0.0) -> bool:
+        """Spend `tokens`, sleeping up to `timeout` seconds for them. Returns False on timeout."""
+        deadline = self.clock() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return True
+            if self.clock() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class KeyedRateLimiter:
+    """
+    One TokenBucket per key (phone number id, page id), created on first use.
+    Signature: 8598
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = Lock()
+        self.throttled = 0
+
+    def bucket(self, key: str) -> TokenBucket:
+        """The bucket of `key`."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.setdefault(key, TokenBucket(self.rate, self.burst, self.clock))
+        return bucket
+
+    def try_acquire(self, key: str) -> float:
+        """Spend one token of `key`. Returns 0.0 or the seconds to wait."""
+        wait = self.bucket(key).try_acquire()
+        if wait:
+            with self._lock:
+                self.throttled += 1
+        return wait
+
+    def acquire(self, key: str, timeout: float = 0.0) -> bool:
+        """Spend one token of `key`, waiting up to `timeout` seconds."""
+        if self.bucket(key).acquire(timeout=timeout):
+            return True
+        with self._lock:
+            self.throttled += 1
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        """Configured rate, number of keys and throttle count."""
+        return {"rate": self.rate, "burst": self.burst, "keys": len(self._buckets), "throttled": self.throttled}
@@ -0,0 +1,76 @@
+"""
+Refreshing In-Memory Index for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Base for process-wide copies of database state that lookups read from
+memory: the agent initials registry, the service window index and the
+opt-out blocklist. Lookups call refresh(), which checks the database in its
+own session at most every `check_interval` seconds.
+"""
+
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Callable
+import logging
+import time
+
+from sqlalchemy.orm import Session
+
+
+class RefreshingIndex:
+    """
+    In-memory index loaded from the database and brought up to date by a
+    periodic check. Subclasses implement loaded() and _sync(). Once loaded,
+    a failed check is logged and lookups keep answering from memory until
+    the next interval; the first load raises.
+    Signature: 8598
+    """
+
+    def __init__(self, check_interval: float, clock: Callable[[], float] = time.time, overlap: float = 60.0):
+        self.check_interval = check_interval
+        self.clock = clock
+        # Incremental pulls re-read this far behind their watermark, for commits that landed out of order
+        self.overlap = overlap
+        self._checked_at = 0.0
+        self._lock = Lock()
+        self.logger = logging.getLogger(f"{type(self).__module__}.{type(self).__name__}")
+
+    def loaded(self) -> bool:
+        """True once the first load has completed."""
+        raise NotImplementedError
+
+    def stale(self) -> bool:
+        """True when the next lookup will check the database."""
+        return not self.loaded() or self.clock() - self._checked_at >= self.check_interval
+
+    def sync(self, session: Session, force: bool = False) -> None:
+        """Load or update the index with `session` when it is due, or always when `force`."""
+        with self._lock:
+            if not force and not self.stale():
+                return
+            now = self.clock()
+            self._sync(session, now, force)
+            self._checked_at = now
+
+    def refresh(self, force: bool = False) -> None:
+        """Run sync() in its own session when it is due."""
+        if not force and not self.stale():
+            return
+        # Imported here: the database package imports these utilities
+        from ..database import get_db_session
+        try:
+            with get_db_session() as session:
+                self.sync(session, force)
+        except Exception as e:
+            if not self.loaded():
+                raise
+            self.logger.warning(f"{type(self).__name__} refresh failed, serving from memory: {e}")
+            self._checked_at = self.clock()
+
+    def pull_since(self, watermark: float) -> datetime:
+        """Lower bound of an incremental pull after `watermark` (epoch seconds)."""
+        return datetime.fromtimestamp(watermark - self.overlap, timezone.utc)
+
+    def _sync(self, session: Session, now: float, force: bool) -> None:
+        """Load or update the index; called with the lock held."""
+        raise NotImplementedError
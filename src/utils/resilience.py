@@ -0,0 +1,151 @@
+"""
+Failure Isolation for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Guards for calls to a remote service that may degrade. A CircuitBreaker
+stops calling an endpoint after repeated failures and lets a single trial
+call through once a cool-off has passed. An AIMDLimiter caps concurrent
+calls, growing the cap by one per window of healthy calls and halving it
+when calls come back slow, throttled or failed, so a slow upstream holds a
+few workers instead of all of them.
+"""
+
+from threading import Condition, Lock
+from typing import Any, Callable, Dict, Optional
+import time
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open circuit breaker.
+    Signature: 8598
+
+    Closed: calls pass; `failure_threshold` consecutive failures open it.
+    Open: calls are rejected for `open_seconds`, then one trial call is let
+    through (half-open). The trial's success closes the circuit; its
+    failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, open_seconds: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0  # consecutive
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.trips = 0
+        self._trial = False
+        self._lock = Lock()
+
+    def allow(self) -> bool:
+        """True if a call may go ahead. In half-open state only one trial call is admitted."""
+        with self._lock:
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                self._trial = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        """A call completed and the endpoint answered."""
+        with self._lock:
+            self.failures = 0
+            self.state = self.CLOSED
+            self._trial = False
+
+    def record_failure(self) -> None:
+        """A call failed (no answer, timeout or server error)."""
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+                self._trial = False
+
+    def release(self) -> None:
+        """A call admitted by allow() was not made; free the half-open trial slot."""
+        with self._lock:
+            self._trial = False
+
+    def stats(self) -> Dict[str, Any]:
+        """State, consecutive failures, trips and rejected calls."""
+        with self._lock:
+            stats = {"state": self.state, "failures": self.failures, "trips": self.trips, "rejected": self.rejected}
+            if self.state == self.OPEN:
+                stats["retry_in_s"] = round(max(0.0, self.open_seconds - (self.clock() - self.opened_at)), 1)
+            return stats
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit adjusted by additive increase / multiplicative decrease.
+    Signature: 8598
+
+    Each healthy call adds 1/limit (about +1 per `limit` calls); a call that
+    was slower than `latency_target`, throttled or failed multiplies the
+    limit by `backoff`, at most once per `latency_target` so one burst of
+    failures is one decrease.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: Optional[int] = None,
+                 latency_target: float = 3.0, backoff: float = 0.5, clock: Callable[[], float] = time.monotonic):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum or initial)
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.clock = clock
+        self.in_flight = 0
+        self.decreases = 0
+        self.rejected = 0
+        self._decreased_at = float("-inf")
+        self._cond = Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Take a slot, waiting up to `timeout` seconds. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self.rejected += 1
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False) -> None:
+        """
+        Return a slot. `latency` (seconds) and `overloaded` adjust the limit;
+        pass neither when the call was not made.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if overloaded or (latency is not None and latency > self.latency_target):
+                now = self.clock()
+                if now - self._decreased_at >= self.latency_target:
+                    self.limit = max(float(self.minimum), self.limit * self.backoff)
+                    self._decreased_at = now
+                    self.decreases += 1
+            elif latency is not None:
+                self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        """Current limit, bounds, calls in flight, decreases and rejected acquires."""
+        with self._cond:
+            return {"limit": int(self.limit), "min": self.minimum, "max": self.maximum, "in_flight": self.in_flight,
+                    "decreases": self.decreases, "rejected": self.rejected}
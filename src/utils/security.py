@@ -6,15 +6,25 @@ Copyright (c) 2025 - Signature: 8598
 import hmac
 import hashlib
 import re
-from typing import Optional
+from typing import Optional, Union
 from flask import request
 
 
-def validate_webhook_signature(payload: str, signature: str, secret: str) -> bool:
-    """Validate webhook signature for security."""
+def validate_webhook_signature(payload: Union[bytes, str], signature: Optional[str], secret: str) -> bool:
+    """Validate webhook signature for security.
+
+    `payload` should be the raw request body bytes exactly as received;
+    `signature` may carry Meta's "sha256=" prefix (X-Hub-Signature-256).
+    """
+    if not signature or not secret:
+        return False
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    if signature.startswith('sha256='):
+        signature = signature[len('sha256='):]
     expected_signature = hmac.new(
         secret.encode('utf-8'),
-        payload.encode('utf-8'),
+        payload,
         hashlib.sha256
     ).hexdigest()
     return hmac.compare_digest(signature, expected_signature)
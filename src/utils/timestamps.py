@@ -0,0 +1,21 @@
+"""
+Timestamp Helpers for HCTC-CRM
+Copyright (c) 2025 - Signature: 8598
+
+Every datetime column is written in UTC, but SQLite hands them back naive.
+"""
+
+from datetime import datetime, timezone
+from typing import Optional
+
+
+def as_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    """`moment` as an aware UTC datetime; naive values are taken to be UTC already."""
+    if moment is not None and moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+def utc_epoch(moment: datetime) -> float:
+    """Epoch seconds of a stored datetime."""
+    return as_utc(moment).timestamp()
@@ -19,9 +19,9 @@ def validate_whatsapp_payload(data: Dict[str, Any]) -> bool:
     if not isinstance(data['entry'], list) or len(data['entry']) == 0:
         return False
     
-    entry = data['entry'][0]
-    if 'changes' not in entry:
-        return False
+    for entry in data['entry']:
+        if not isinstance(entry, dict) or not isinstance(entry.get('changes'), list):
+            return False
     
     return True
 